@@ -8,6 +8,8 @@ from bokeh.models import ColumnDataSource, GeoJSONDataSource, HoverTool, LogColo
 from bokeh.layouts import column
 from bokeh.palettes import Inferno as palette
 
+from areas import get_areas_cached, get_density
+
 def get_geometry_coords(geo_object):
     """
     Finds the x and y coordinates of a geometry object and returns them as two lists in the
@@ -70,12 +72,6 @@ def add_patch_coords(geodataframe):
 
     return geodataframe
 
-def get_population_density(row, pop):
-    if row['geometry'] is not None:
-        return row[pop] / row['geometry'].area
-    else:
-        return None
-
 def remove_none(row):
     if row['geometry'] is None:
         return Polygon()
@@ -93,7 +89,10 @@ pop_data = pd.read_csv(pop_data_file, header=2)
 
 merge_data = geodata.merge(pop_data[['Country Code', 'Country Name', '2019']],
                       how='outer', left_on='ISO_A3', right_on='Country Code')
-merge_data['pop_density'] = merge_data.apply(get_population_density, pop='2019', axis=1) 
+# population per km^2, with the equal-area areas of areas.py (NaN for the rows without a
+# polygon), rather than per square degree of the unprojected polygons
+merge_data['pop_density'] = get_density(merge_data['2019'],
+                                        get_areas_cached(merge_data['geometry']) / 10**6)
 #merge_data['geometry'] = merge_data.apply(remove_none, axis=1) 
 
 merge_data.drop(columns='geometry', inplace=True)
@@ -102,11 +101,11 @@ merge_data.drop(columns='geometry', inplace=True)
 #source = GeoJSONDataSource(geojson=merge_data.to_json())
 color_mapper = LogColorMapper(palette=list(reversed(palette[256])))
 
-plot = figure(plot_width=1300, plot_height=680, title="Map")
+plot = figure(plot_width=1300, plot_height=680, title="Population density, 2019")
 plot.multi_polygons("xs", "ys", source=merge_data[:241], line_color="black",
                 fill_color={'field': 'pop_density', 'transform': color_mapper})
 
-color_bar = ColorBar(color_mapper=color_mapper, ticker=LogTicker(),
+color_bar = ColorBar(color_mapper=color_mapper, ticker=LogTicker(), title='Population per km², 2019',
                      label_standoff=12, border_line_color=None, location=(0,0))
 plot.add_layout(color_bar, 'right')
 
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from create_dataframe import get_areas_parallel
+
+##################################################################
+# The countries' areas, and the densities and per capita values of indicators.
+#
+# Computing an area means projecting the geometry to an equal-area projection (see
+# create_dataframe.get_areas()), which is most of the time spent on areas. The area of
+# every geometry is computed once and kept in AREA_CACHE_DIR under the hash of the
+# geometry (its WKB and CRS), so building the data set or the map cache again only
+# projects the geometries that changed, e.g. the country of an edited polygon fix.
+#
+# The densities and per capita values are plain array divisions, for one column of
+# values or a whole countries x years (or x indicators) matrix at once, so adding another
+# World Bank indicator only needs the areas already known.
+##################################################################
+
+AREA_CACHE_DIR = "area_cache"  # folder holding the areas already computed
+AREA_CACHE_FILE = "areas.npz"
+
+_areas = {}  # the areas already computed (in m^2), by geometry hash, once loaded
+
+
+def get_geometry_keys(geometries, crs=None):
+    """
+    Hashes geometries, with their CRS since it changes their area.
+    Input: A sequence of Shapely geometry objects (None allowed) and their CRS.
+    Returns: The list of every geometry's hash (as bytes), None for missing geometries.
+    """
+
+    geometries = np.asarray(geometries, dtype=object)
+    prefix = str(crs).encode()
+    wkbs = shapely.to_wkb(geometries)
+    return [None if wkb is None else hashlib.sha1(prefix + wkb).digest() for wkb in wkbs.tolist()]
+
+
+def load_area_cache(cache_dir=AREA_CACHE_DIR):
+    """
+    Loads the areas computed in previous runs, the first time it's called.
+    Returns: The dictionary of the areas, by geometry hash.
+    """
+
+    if cache_dir not in _areas:
+        areas = {}
+        try:
+            with np.load(os.path.join(cache_dir, AREA_CACHE_FILE)) as cached:
+                areas = dict(zip(cached['keys'].tolist(), cached['areas'].tolist()))
+        except (OSError, KeyError, ValueError):
+            pass  # no cache yet, or an unreadable one which will be rewritten
+        _areas[cache_dir] = areas
+
+    return _areas[cache_dir]
+
+
+def save_area_cache(cache_dir=AREA_CACHE_DIR):
+    """
+    Writes the areas computed so far to the cache.
+    """
+
+    areas = load_area_cache(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first so other processes never read a half written cache
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, keys=np.array(list(areas), dtype='S20'),
+                 areas=np.array(list(areas.values()), dtype=np.float64))
+    os.replace(tmp, os.path.join(cache_dir, AREA_CACHE_FILE))
+
+
+def get_areas_cached(geometries, workers=1, cache_dir=AREA_CACHE_DIR):
+    """
+    Same as create_dataframe.get_areas(), only projecting the geometries whose area isn't
+    in the cache yet (in a pool of processes, see get_areas_parallel()).
+    Input: A GeoSeries, the number of processes (None for all the CPUs) and the folder of the
+    cache.
+    Returns: The Series of the areas in m^2, with the GeoSeries' index. Missing geometries have
+    an area of 0.
+    """
+
+    areas = load_area_cache(cache_dir)
+    keys = get_geometry_keys(geometries.values, geometries.crs)
+
+    new = [i for i, key in enumerate(keys) if key is not None and key not in areas]
+    if new:
+        new_areas = get_areas_parallel(geometries.iloc[new], workers)
+        for i, area in zip(new, new_areas.tolist()):
+            areas[keys[i]] = area
+        save_area_cache(cache_dir)
+
+    return pd.Series([0.0 if key is None else areas[key] for key in keys], index=geometries.index,
+                     dtype=np.float64)
+
+
+def divide_by_country(values, divisors):
+    """
+    Divides the values of every country by one value of that country, NaN where the divisor
+    is missing or not positive.
+    Input: The values, either one per country or a countries x columns matrix (array or
+    DataFrame), and one divisor per country.
+    Returns: The quotients, of the same type and shape as values.
+    """
+
+    divisors = np.asarray(divisors, dtype=np.float64)
+    divisors = np.where(divisors > 0, divisors, np.nan)
+    if np.ndim(values) == 2:
+        divisors = divisors[:, np.newaxis]
+
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        return values / (divisors if isinstance(values, pd.DataFrame) else
+                         pd.Series(divisors, index=values.index))
+    return np.asarray(values, dtype=np.float64) / divisors
+
+
+def get_density(values, areas):
+    """
+    Computes the density of an indicator (e.g. the population per km^2).
+    Input: The indicator's values (one per country, or countries x years) and the countries'
+    areas (in km^2 for densities per km^2).
+    Returns: The densities, of the same type and shape as values. Countries without an area
+    have NaN densities.
+    """
+
+    return divide_by_country(values, areas)
+
+
+def get_per_capita(values, population):
+    """
+    Computes the per capita values of an indicator (e.g. the GDP per person).
+    Input: The indicator's values (one per country, or countries x years) and the countries'
+    population, of the same shape.
+    Returns: The per capita values, NaN where the population is missing.
+    """
+
+    population = np.asarray(population, dtype=np.float64)
+    if np.ndim(population) == 2:
+        population = np.where(population > 0, population, np.nan)
+        return values / population
+    return divide_by_country(values, population)
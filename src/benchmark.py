@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from bokeh.document import Document
+from bokeh.plotting import figure
+
+from create_dataframe import (FINAL_FILE, GEODATA_FILES, add_patch_coords, fix_polygons, get_areas,
+                              read_final_dataset)
+from map_cache import build_map_cache, prepare_countries
+import areas
+from areas import get_areas_cached
+from world_map import make_document, patch_colors
+
+##################################################################
+# Benchmarks of the map's data path.
+#
+# Every stage (reading the final data set, building the patch coordinates, the polygon fixes,
+# the areas, projected and from the cache of areas.py, the colors, the map cache and a
+# whole session of world_map.py) is timed on the bundled files, and the stages depending
+# on the number of vertices are also run on copies of the countries with SCALES times
+# more vertices (and LARGE_SCALE times with --large). The areas of areas.py are timed both
+# with an empty cache and with every area already in it. For each stage this reports
+# the best wall time of a few runs, the peak memory allocated (from a separate run under
+# tracemalloc, which slows things down) and the size of the serialized Bokeh document
+# when the stage produces something to plot.
+#
+# Results can be saved as a baseline in BENCHMARK_DIR and later runs compared to it:
+#   python benchmark.py --save before
+#   python benchmark.py --compare before
+##################################################################
+
+BENCHMARK_DIR = "benchmarks"  # folder of the saved baselines
+SCALES = [1, 10]  # vertex multipliers of the synthetic data sets
+LARGE_SCALE = 100  # also run with --large, it takes several minutes
+REGRESSION_THRESHOLD = 0.2  # a stage regressed when it's this much slower than the baseline...
+MIN_REGRESSION_SECONDS = 0.01  # ...and at least this much slower, to ignore the noise of fast stages
+DOCUMENT_SIZE_MAX_VERTICES = 2 * 10**6  # documents with more vertices aren't serialized
+
+
+def measure(function, setup=None, repeat=3):
+    """
+    Times a function and measures the memory it allocates.
+    Input: The function, a function returning the arguments to call it with (not timed) and the
+    number of timed runs.
+    Returns: A tuple of the best time in seconds, the peak memory allocated in MB and the
+    function's result.
+    """
+
+    setup = setup or tuple
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return (min(times), peak / 2**20, result)
+
+
+def get_document_size(doc):
+    """
+    Returns the size in bytes of a Bokeh document serialized to JSON, as sent to the browser.
+    """
+
+    return len(json.dumps(doc.to_json(), separators=(',', ':'), default=str))
+
+
+def get_patches_document_size(xs, ys):
+    """
+    Returns the serialized size of a document plotting the given patch coordinates.
+    """
+
+    doc = Document()
+    plot = figure()
+    plot.multi_polygons(xs=list(xs), ys=list(ys))
+    doc.add_root(plot)
+    return get_document_size(doc)
+
+
+def forget_areas(cache_dir):
+    """
+    Forgets the areas of areas.py loaded from a cache folder, so they're read again.
+    Returns: No arguments, for measure().
+    """
+
+    areas._areas.pop(cache_dir, None)
+    return ()
+
+
+def count_vertices(geodataframe):
+    """
+    Returns the number of vertices of the geometries of a GeoDataFrame.
+    """
+
+    return int(shapely.get_num_coordinates(np.asarray(geodataframe.geometry.array)).sum())
+
+
+def scale_vertices(geodataframe, factor):
+    """
+    Makes a copy of a GeoDataFrame whose geometries have about factor times more vertices, by
+    splitting their segments. The shapes don't change.
+    """
+
+    geometries = np.asarray(geodataframe.geometry.array)
+    n_vertices = shapely.get_num_coordinates(geometries).sum()
+    length = np.nansum(shapely.length(geometries))
+
+    scaled = geodataframe.copy()
+    scaled['geometry'] = gpd.GeoSeries(
+        shapely.segmentize(geometries, length / (n_vertices * factor)),
+        index=geodataframe.index, crs=geodataframe.crs)
+    return scaled
+
+
+def run_benchmarks(shapefile=FINAL_FILE + ".shp", scales=SCALES, repeat=3, log=print):
+    """
+    Runs every benchmark.
+    Input: The shapefile of the final data set, the vertex multipliers of the synthetic data sets,
+    the number of timed runs of each stage and the function printing the progress.
+    Returns: A list with, for each stage and scale, a dictionary of the stage's name, the scale,
+    the number of vertices, the time in seconds, the peak memory in MB and the document size in
+    bytes (None if the stage has no document).
+    """
+
+    results = []
+
+    def run(stage, scale, vertices, function, setup=None, document=None):
+        seconds, peak, result = measure(function, setup, repeat)
+        size = document(result) if document and vertices <= DOCUMENT_SIZE_MAX_VERTICES else None
+        results.append({'stage': stage, 'scale': scale, 'vertices': vertices,
+                        'seconds': seconds, 'peak_mb': peak, 'document_bytes': size})
+        log(format_result(results[-1]))
+
+    base = read_final_dataset(shapefile)
+    temp_dir = tempfile.mkdtemp(prefix='world_map_benchmark')
+    try:
+        for scale in scales:
+            if scale == 1:
+                path, geodata = shapefile, base
+            else:
+                geodata = scale_vertices(base, scale)
+                path = os.path.join(temp_dir, 'scaled%d.shp' % scale)
+                geodata.to_file(path)
+            vertices = count_vertices(geodata)
+
+            run('read_dataset', scale, vertices, lambda: read_final_dataset(path))
+            run('add_patch_coords', scale, vertices, add_patch_coords,
+                setup=lambda: (geodata.copy(),),
+                document=lambda df: get_patches_document_size(df['xs'], df['ys']))
+            run('get_areas', scale, vertices, lambda: get_areas(geodata['geometry']))
+            run('get_areas_cold', scale, vertices,
+                lambda area_dir: get_areas_cached(geodata['geometry'], cache_dir=area_dir),
+                setup=lambda: (tempfile.mkdtemp(dir=temp_dir),))
+            area_dir = os.path.join(temp_dir, 'areas%d' % scale)
+            get_areas_cached(geodata['geometry'], cache_dir=area_dir)
+            # the cache file is read again by every run, like in a new process
+            run('get_areas_warm', scale, vertices,
+                lambda: get_areas_cached(geodata['geometry'], cache_dir=area_dir),
+                setup=lambda: forget_areas(area_dir))
+            run('build_map_cache', scale, vertices,
+                lambda: build_map_cache(path, tempfile.mkdtemp(dir=temp_dir)))
+
+        # stages which don't depend on the number of vertices of the final data set
+        vertices = count_vertices(base)
+        missing = [path for path in GEODATA_FILES if not os.path.exists(path)]
+        if missing:
+            log('fix_polygons skipped, missing: ' + ', '.join(missing))
+        else:
+            run('fix_polygons', 1, vertices, fix_polygons)
+        run('patch_colors', 1, vertices, patch_colors_stage,
+            setup=lambda: (prepare_countries(base.copy()).drop(columns='geometry'),))
+        run('load_shared_data', 1, vertices, load_shared_data_stage)
+        run('session', 1, vertices, session_stage, document=get_document_size)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return results
+
+
+def patch_colors_stage(df):
+    """
+    Colors the countries by population density, like world_map.patch_colors().
+    """
+
+    return patch_colors(df.assign(density=df['pop_density']))
+
+
+def load_shared_data_stage():
+    """
+    Loads the data shared by the sessions of world_map.py, from an already built map cache.
+    """
+
+    import map_cache
+    import shared_data
+    for memo in (map_cache._loaded, map_cache._topology_loaded, map_cache._lod_loaded,
+                 map_cache._index_loaded, shared_data._shared):
+        memo.clear()
+    return shared_data.load_shared_data()
+
+
+def session_stage():
+    """
+    Creates a session of world_map.py, once its shared data is loaded.
+    Returns: The session's document.
+    """
+
+    doc = Document()
+    make_document(doc)
+    return doc
+
+
+def format_result(result):
+    """
+    Formats one result of run_benchmarks() as a line of the report.
+    """
+
+    size = result['document_bytes']
+    return '%-18s %5dx %10d %10.3f s %9.1f MB %12s' % (
+        result['stage'], result['scale'], result['vertices'], result['seconds'],
+        result['peak_mb'], '-' if size is None else '%d B' % size)
+
+
+def compare_results(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares results to a baseline.
+    Returns: A list of (stage, scale, time ratio, memory ratio, regressed) tuples for the stages
+    found in both, where regressed is True if the stage got slower or used more memory by more
+    than threshold (and by more than MIN_REGRESSION_SECONDS for the time).
+    """
+
+    old = {(r['stage'], r['scale']): r for r in baseline}
+    comparison = []
+    for result in results:
+        before = old.get((result['stage'], result['scale']))
+        if before is None:
+            continue
+        time_ratio = result['seconds'] / max(before['seconds'], 1e-9)
+        memory_ratio = result['peak_mb'] / max(before['peak_mb'], 1e-9)
+        slower = (time_ratio > 1 + threshold
+                  and result['seconds'] - before['seconds'] > MIN_REGRESSION_SECONDS)
+        regressed = slower or memory_ratio > 1 + threshold
+        comparison.append((result['stage'], result['scale'], time_ratio, memory_ratio, regressed))
+
+    return comparison
+
+
+def get_baseline_path(name, benchmark_dir=BENCHMARK_DIR):
+    return os.path.join(benchmark_dir, name + '.json')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the map's data path.")
+    parser.add_argument('--shapefile', default=FINAL_FILE + ".shp")
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES,
+                        help="vertex multipliers of the synthetic data sets")
+    parser.add_argument('--large', action='store_true',
+                        help="also run with %dx the vertices" % LARGE_SCALE)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs of each stage")
+    parser.add_argument('--save', metavar='NAME', help="save the results as a baseline")
+    parser.add_argument('--compare', metavar='NAME', help="compare the results to a baseline")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    print('%-18s %6s %10s %12s %12s %12s' % ('stage', 'scale', 'vertices', 'time', 'memory', 'document'))
+    scales = args.scales + [LARGE_SCALE] if args.large else args.scales
+    results = run_benchmarks(args.shapefile, scales, args.repeat)
+
+    if args.save:
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+        with open(get_baseline_path(args.save), 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(get_baseline_path(args.compare)) as f:
+            comparison = compare_results(results, json.load(f), args.threshold)
+
+        print('\n%-18s %6s %8s %8s' % ('stage', 'scale', 'time', 'memory'))
+        for stage, scale, time_ratio, memory_ratio, regressed in comparison:
+            print('%-18s %5dx %7.2fx %7.2fx %s' % (stage, scale, time_ratio, memory_ratio,
+                                                  'REGRESSION' if regressed else ''))
+        if any(c[4] for c in comparison):
+            sys.exit(1)
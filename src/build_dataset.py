@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from create_dataframe import (FINAL_FILE, FINAL_FORMATS, GEODATA_FILES, POLYGON_FIXES,
+                              POPULATION_FILE, read_geodata, get_name_indexes,
+                              get_fix_sources, get_fix_geometry, apply_polygon_fixes, get_areas,
+                              add_population, repair_chunk, repair_geometries,
+                              get_areas_chunk, get_areas_parallel, map_chunks,
+                              get_final_path, write_final_dataset)
+from map_cache import get_source_stats, hash_file
+from areas import get_areas_cached
+
+##################################################################
+# Incremental build of the final data set.
+#
+# This does the same as create_dataframe.create_polygon_dataset(), but split into stages:
+# reading each source, each of the POLYGON_FIXES, applying them, computing the areas,
+# adding the population and writing the shapefile. The output of every stage is saved
+# in BUILD_CACHE_DIR under a key made from its inputs (the contents of the source files,
+# the stage's parameters, its code and the keys of the stages it uses), so a stage only
+# runs again when something it depends on changed. E.g. editing one fix only reruns that
+# fix and the stages after it, and updating the population file only reruns the last two.
+#
+# The sources, and then the fixes, are built at the same time in threads, and the repair
+# of the geometries and their areas are computed in a pool of processes (see the parallel
+# build in create_dataframe.py).
+#
+# Run with: python build_dataset.py
+##################################################################
+
+BUILD_CACHE_DIR = "build_cache"  # folder holding the outputs of the stages
+
+stage_timings = []  # (stage name, 'built' or 'cached', seconds) of every stage that was needed
+
+
+class Stage:
+    """
+    A step of the build whose output is cached by the hash of its inputs.
+    Input: The stage's name, the function computing its output from the outputs of the input
+    stages, the input stages, any extra parameters (JSON serializable) the output depends on
+    and the functions called by the stage, whose code is part of the key like the stage's own.
+    """
+
+    def __init__(self, name, function, inputs=(), params=None, code=(), cache_dir=BUILD_CACHE_DIR):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.cache_dir = cache_dir
+        self.force = False
+        self._output = None
+        self._done = False
+
+        sha = hashlib.sha1(name.encode())
+        sha.update(json.dumps(params, sort_keys=True).encode())
+        for f in [function] + list(code):
+            sha.update(inspect.getsource(f).encode())
+        for stage in self.inputs:
+            sha.update(stage.key.encode())
+        self.key = sha.hexdigest()[:16]
+
+    def get_path(self):
+        return os.path.join(self.cache_dir, '%s-%s.pkl' % (self.name, self.key))
+
+    def is_cached(self):
+        """
+        Returns whether the stage's output is already known or will be loaded from the cache,
+        without needing its input stages.
+        """
+
+        return self._done or (not self.force and os.path.exists(self.get_path()))
+
+    def output(self):
+        """
+        Returns the stage's output, loading it from the cache if it was already built and
+        building it (and any input stage it needs) otherwise.
+        """
+
+        if self._done:
+            return self._output
+
+        path = self.get_path()
+        start = time.perf_counter()
+        if not self.force and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self._output = pickle.load(f)
+            status = 'cached'
+        else:
+            args = [stage.output() for stage in self.inputs]
+            start = time.perf_counter()  # don't count the time of the input stages
+            self._output = self.function(*args)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(self._output, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+            status = 'built'
+
+        stage_timings.append((self.name, status, time.perf_counter() - start))
+        self._done = True
+        return self._output
+
+
+def make_fix_function(fix):
+    """
+    Returns the function computing the new geometry of one of the POLYGON_FIXES from the data
+    sets it uses.
+    """
+
+    def compute_fix(base, other=None):
+        geodatasets = [base] + [None] * (len(GEODATA_FILES) - 1)
+        if 'replace_from' in fix:
+            geodatasets[fix['replace_from']] = other
+        return get_fix_geometry(fix, geodatasets)
+
+    return compute_fix
+
+
+def create_stages(fixes=POLYGON_FIXES, cache_dir=BUILD_CACHE_DIR, workers=None):
+    """
+    Creates the stages of the build, whose geometry work uses the given number of processes.
+    Returns: The stage producing the final data set (whose inputs lead to every other stage).
+    """
+
+    sources = []
+    for i, path in enumerate(GEODATA_FILES):
+        read = lambda i=i: read_geodata(i)
+        hashes = {name: stats['sha1'] for name, stats in get_source_stats(path).items()}
+        sources.append(Stage('source%d' % i, read, params=hashes, code=[read_geodata],
+                             cache_dir=cache_dir))
+
+    fix_stages = []
+    for fix in fixes:
+        inputs = [sources[0]]
+        if 'replace_from' in fix:
+            inputs.append(sources[fix['replace_from']])
+        fix_stages.append(Stage('fix_' + fix['country'].replace(' ', '_'), make_fix_function(fix),
+                                inputs, params=fix, code=[get_fix_geometry, get_fix_sources, get_name_indexes], cache_dir=cache_dir))
+
+    fixed = Stage('fixed', lambda base, *geometries: apply_polygon_fixes(base, fixes, geometries),
+                  [sources[0]] + fix_stages, params=fixes, code=[apply_polygon_fixes],
+                  cache_dir=cache_dir)
+    repaired = Stage('repaired', lambda df: df.assign(geometry=repair_geometries(df['geometry'], workers)),
+                     [fixed], code=[repair_geometries, repair_chunk, map_chunks], cache_dir=cache_dir)
+    areas = Stage('areas', lambda df: get_areas_cached(df['geometry'], workers), [repaired],
+                  code=[get_areas_cached, get_areas_parallel, get_areas_chunk, get_areas],
+                  cache_dir=cache_dir)
+    population = Stage('population', add_population, [repaired, areas],
+                       params=hash_file(POPULATION_FILE), cache_dir=cache_dir)
+
+    return population
+
+
+def get_all_stages(final):
+    """
+    Returns every stage the given stage depends on (and itself), each once.
+    """
+
+    stages = {}
+    pending = [final]
+    while pending:
+        stage = pending.pop()
+        if stage.name not in stages:
+            stages[stage.name] = stage
+            pending.extend(stage.inputs)
+    return list(stages.values())
+
+
+def get_needed_stages(final):
+    """
+    Returns the stages whose output is needed to get the given stage's output, each once: the
+    stage itself and, for those that aren't cached, their input stages.
+    """
+
+    stages = {}
+    pending = [final]
+    while pending:
+        stage = pending.pop()
+        if stage.name not in stages:
+            stages[stage.name] = stage
+            if not stage.is_cached():
+                pending.extend(stage.inputs)
+    return list(stages.values())
+
+
+def prefetch_stages(stages, workers=None):
+    """
+    Builds (or loads) independent stages at the same time, in threads.
+    """
+
+    if workers == 1:
+        for stage in stages:
+            stage.output()
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda stage: stage.output(), stages))
+
+
+def build_final_dataset(force=False, write=True, cache_dir=BUILD_CACHE_DIR, workers=None,
+                        file_format='shapefile'):
+    """
+    Builds the final data set, only running the stages whose inputs changed, and writes it (see
+    create_dataframe.write_final_dataset()) if it changed since it was last written.
+    Input: Whether to rerun every stage, whether to write the data set, the folder of the
+    stages' cache, the number of threads and processes to use (all the CPUs by default) and the
+    format to write.
+    Returns: The final data set.
+    """
+
+    del stage_timings[:]
+    final = create_stages(cache_dir=cache_dir, workers=workers)
+
+    if force:
+        for stage in get_all_stages(final):
+            stage.force = True
+
+    # the sources don't depend on anything, and the fixes only on the sources. Only the ones
+    # the stages after them need are loaded, e.g. none of them when the final stage is cached
+    stages = get_needed_stages(final)
+    prefetch_stages([stage for stage in stages if stage.name.startswith('source')], workers)
+    prefetch_stages([stage for stage in stages if stage.name.startswith('fix_')], workers)
+    df = final.output()
+
+    if write:
+        path = get_final_path(file_format)
+        written_path = os.path.join(cache_dir, 'written-%s.key' % file_format)
+        written = None
+        if os.path.exists(written_path) and os.path.exists(path):
+            with open(written_path) as f:
+                written = f.read().strip()
+
+        start = time.perf_counter()
+        if force or written != final.key:
+            if os.path.isdir(path):
+                shutil.rmtree(path)  # some drivers can't overwrite the folder
+            write_final_dataset(df, file_format)  # write the good polygons
+            with open(written_path, 'w') as f:
+                f.write(final.key)
+            stage_timings.append(('write', 'built', time.perf_counter() - start))
+        else:
+            stage_timings.append(('write', 'cached', time.perf_counter() - start))
+
+    return df
+
+
+def print_timings():
+    """
+    Prints how long each stage took and whether it was built or loaded from the cache.
+    """
+
+    print('%-24s %-8s %9s' % ('stage', 'status', 'seconds'))
+    for name, status, seconds in stage_timings:
+        print('%-24s %-8s %9.3f' % (name, status, seconds))
+    print('%-24s %-8s %9.3f' % ('total', '', sum(t[2] for t in stage_timings)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build " + FINAL_FILE + ", rerunning only the stages whose inputs changed.")
+    parser.add_argument('--force', action='store_true', help="rerun every stage")
+    parser.add_argument('--no-write', action='store_true', help="don't write the data set")
+    parser.add_argument('--format', choices=list(FINAL_FORMATS), default='shapefile',
+                        help="format of the data set written")
+    parser.add_argument('--cache-dir', default=BUILD_CACHE_DIR)
+    parser.add_argument('--workers', type=int, help="threads and processes to use (all the CPUs by default)")
+    args = parser.parse_args()
+
+    build_final_dataset(force=args.force, write=not args.no_write, cache_dir=args.cache_dir,
+                        workers=args.workers, file_format=args.format)
+    print_timings()
@@ -0,0 +1,222 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+##################################################################
+# Choropleth classification: splits a numeric column into classes and gives each row the
+# color and legend label of its class.
+#
+# Breaks are the upper bounds of every class but the last one, so with breaks [10, 25]
+# the classes are: ≤ 10, 10 - 25 and 25+. Classifying is a single np.searchsorted over
+# the breaks, and the breaks of a column are only computed once for the same values.
+##################################################################
+
+SCHEMES = ['manual', 'quantile', 'equal_interval', 'log', 'jenks']
+JENKS_MAX_VALUES = 2000  # above this, natural breaks are computed on a sample of the values
+
+_breaks_cache = {}  # breaks already computed, by column, scheme, number of classes and values
+
+
+def get_breaks(values, scheme='quantile', n_classes=9):
+    """
+    Computes the class breaks of a set of values.
+    Input: The values, the classification scheme (one of SCHEMES other than 'manual') and the
+    number of classes.
+    Returns: An array of n_classes - 1 increasing breaks. NaN and infinite values are ignored.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    values = np.sort(values[np.isfinite(values)])
+    if len(values) == 0 or n_classes < 2:
+        return np.empty(0)
+
+    if scheme == 'quantile':
+        breaks = np.quantile(values, np.linspace(0, 1, n_classes + 1)[1:-1])
+    elif scheme == 'equal_interval':
+        breaks = np.linspace(values[0], values[-1], n_classes + 1)[1:-1]
+    elif scheme == 'log':
+        positive = values[values > 0]
+        if len(positive) == 0:
+            return np.empty(0)
+        breaks = np.logspace(np.log10(positive[0]), np.log10(positive[-1]), n_classes + 1)[1:-1]
+    elif scheme == 'jenks':
+        breaks = get_jenks_breaks(values, n_classes)
+    else:
+        raise ValueError("Unknown classification scheme: " + str(scheme))
+
+    return np.unique(breaks)
+
+
+def get_jenks_breaks(values, n_classes):
+    """
+    Computes the Jenks natural breaks of a set of values, i.e. the breaks minimizing the sum of
+    squared deviations from the class means (Fisher's exact algorithm).
+    Input: The sorted, finite values and the number of classes.
+    Returns: An array of at most n_classes - 1 breaks.
+    """
+
+    if len(values) > JENKS_MAX_VALUES:
+        values = np.quantile(values, np.linspace(0, 1, JENKS_MAX_VALUES))
+    n = len(values)
+    n_classes = min(n_classes, n)
+
+    # prefix sums, so the squared deviation of values[i:j] is found in constant time
+    sums = np.concatenate(([0], np.cumsum(values)))
+    squares = np.concatenate(([0], np.cumsum(values ** 2)))
+
+    def deviation(starts, end):
+        count = end - starts
+        total = sums[end] - sums[starts]
+        return squares[end] - squares[starts] - total ** 2 / count
+
+    # cost[c, j] is the lowest total deviation of values[:j] split into c + 1 classes and
+    # first[c, j] the index where the last of those classes starts
+    cost = np.full((n_classes, n + 1), np.inf)
+    first = np.zeros((n_classes, n + 1), dtype=np.int64)
+    ends = np.arange(1, n + 1)
+    cost[0, 1:] = deviation(np.zeros(n, dtype=np.int64), ends)
+    for c in range(1, n_classes):
+        for end in range(c + 1, n + 1):
+            starts = np.arange(c, end)
+            candidates = cost[c - 1, starts] + deviation(starts, end)
+            best = np.argmin(candidates)
+            cost[c, end] = candidates[best]
+            first[c, end] = starts[best]
+
+    breaks = []
+    end = n
+    for c in range(n_classes - 1, 0, -1):
+        end = first[c, end]
+        breaks.append(values[end - 1])
+
+    return np.array(breaks[::-1])
+
+
+def classify(values, breaks):
+    """
+    Finds the class of every value.
+    Input: The values and the class breaks.
+    Returns: An integer array with each value's class, or -1 for NaN values.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    classes = np.searchsorted(breaks, values, side='left')
+    classes[np.isnan(values)] = -1
+    return classes
+
+
+def format_break(value):
+    """
+    Formats a class break for the legend, with at most 3 significant digits.
+    """
+
+    if abs(value) >= 100:
+        return '%d' % round(value)
+    return '%g' % float('%.3g' % value)
+
+
+def get_labels(breaks):
+    """
+    Returns the legend label of each class, e.g. ['≤ 10', '10 - 25', '25+'].
+    """
+
+    if len(breaks) == 0:
+        return ['All']
+
+    labels = ['≤ ' + format_break(breaks[0])]
+    for low, high in zip(breaks[:-1], breaks[1:]):
+        labels.append(format_break(low) + ' - ' + format_break(high))
+    labels.append(format_break(breaks[-1]) + '+')
+
+    return labels
+
+
+def get_class_colors(palette, n_classes):
+    """
+    Picks n_classes colors spread evenly along a palette.
+    """
+
+    if len(palette) == n_classes:
+        return list(palette)
+    indices = np.round(np.linspace(0, len(palette) - 1, n_classes)).astype(int)
+    return [palette[i] for i in indices]
+
+
+def get_column_breaks(df, column, scheme='quantile', n_classes=9):
+    """
+    Same as get_breaks() for a DataFrame column, but the breaks are cached so they're only
+    computed again when the column's values change.
+    """
+
+    values = np.ascontiguousarray(df[column].to_numpy(dtype=np.float64))
+    digest = hashlib.sha1(values.tobytes()).hexdigest()
+    key = (column, scheme, n_classes, digest)
+    if key not in _breaks_cache:
+        _breaks_cache[key] = get_breaks(values, scheme, n_classes)
+    return _breaks_cache[key]
+
+
+def get_column_classes(df, column, palette, scheme='quantile', n_classes=None, breaks=None):
+    """
+    Finds the class of every row of a DataFrame from the values of a numeric column.
+    Input: The DataFrame, the name of the column and the palette to use. Either the scheme and
+    number of classes (the length of the palette by default), or for the 'manual' scheme, the
+    breaks.
+    Returns: A tuple of the array of each row's class (-1 for NaN values), the list of the
+    classes' colors and the list of their legend labels.
+    """
+
+    if scheme == 'manual':
+        breaks = np.asarray(breaks, dtype=np.float64)
+    else:
+        breaks = get_column_breaks(df, column, scheme, n_classes or len(palette))
+
+    labels = get_labels(breaks)
+    colors = get_class_colors(palette, len(labels))
+    classes = classify(df[column].to_numpy(dtype=np.float64), breaks)
+
+    return (classes, colors, labels)
+
+
+def get_category_classes(df, column, palette, max_classes=None, min_count=1, other_label='other'):
+    """
+    Same as get_column_classes() for a column of categories (text) rather than numbers.
+    The categories are ordered from most to least common and, past max_classes (the length of
+    the palette by default) or under min_count rows, the least common ones are grouped under
+    other_label.
+    """
+
+    max_classes = max_classes or len(palette)
+    values = df[column]
+    counts = values.value_counts()
+    labels = counts.index.tolist()
+    if len(labels) > max_classes or counts.min() < min_count:
+        labels = [label for label in labels
+                  if label != other_label and counts[label] >= min_count][:max_classes - 1]
+        labels.append(other_label)
+
+    # -1 for the values that aren't one of the labels (and NaN)
+    codes = pd.Index(labels).get_indexer(values).astype(np.int64)
+    if other_label in labels:
+        codes[(codes == -1) & values.notna().to_numpy()] = labels.index(other_label)
+
+    return (codes, get_class_colors(palette, len(labels)), labels)
+
+
+def classify_column(df, column, palette, scheme='quantile', n_classes=None, breaks=None):
+    """
+    Gives every row of a DataFrame the color and legend label of the class of its value.
+    Takes the same inputs as get_column_classes().
+    Returns: A tuple of arrays of the colors and the legend labels. Rows with NaN values get
+    empty strings.
+    """
+
+    classes, colors, labels = get_column_classes(
+        df, column, palette, scheme, n_classes, breaks)
+
+    # the extra empty string at the end is picked by the NaN values' class of -1
+    color_array = np.array(colors + [''], dtype=object)[classes]
+    label_array = np.array(labels + [''], dtype=object)[classes]
+
+    return (color_array, label_array)
@@ -0,0 +1,235 @@
+import re
+import unicodedata
+
+import pandas as pd
+
+from create_dataframe import POPULATION_FILE
+
+##################################################################
+# A registry of every country, to join the data sets in database/ together.
+#
+# Most of the data sets only have the countries' names, and each one names some
+# countries differently (Swaziland/eSwatini, Brunei/Brunei Darussalam, ...). The
+# registry maps every known name of a country, once normalized, to its ISO 3166-1
+# alpha-3 code, so the data sets can all be joined on that code with a dictionary
+# lookup instead of comparing the names row by row.
+#
+# The names and codes come from the World Bank population file, plus the ALIASES below
+# for the names it doesn't use. Territories without an ISO code use the Natural Earth
+# one (e.g. Somaliland).
+##################################################################
+
+# other names of countries, and the names of countries missing from the World Bank file
+ALIASES = {
+    'Aland Islands': 'ALA', 'Åland Islands': 'ALA',
+    'Anguilla': 'AIA',
+    'Antarctica': 'ATA',
+    'Ashmore and Cartier Islands': 'ATC',
+    'Australian Indian Ocean Territories': 'IOA',
+    'Bahamas': 'BHS',
+    'British Indian Ocean Territory': 'IOT',
+    'Brunei': 'BRN',
+    'Burma': 'MMR', 'Myanmar (Burma)': 'MMR',
+    'Cape Verde': 'CPV',
+    'Christmas Island': 'CXR',
+    'Cocos Islands': 'CCK', 'Cocos (Keeling) Islands': 'CCK',
+    'Cook Islands': 'COK',
+    'Democratic Republic of the Congo': 'COD', 'DR Congo': 'COD',
+    'East Timor': 'TLS',
+    'Egypt': 'EGY',
+    'Eswatini': 'SWZ', 'Swaziland': 'SWZ',
+    'Falkland Islands': 'FLK', 'Falkland Islands (Islas Malvinas)': 'FLK',
+    'Federated States of Micronesia': 'FSM', 'Micronesia': 'FSM',
+    'French Guiana': 'GUF',
+    'French Southern and Antarctic Lands': 'ATF',
+    'Gambia': 'GMB',
+    'Greenland (Denmark)': 'GRL',
+    'Guadeloupe': 'GLP',
+    'Guernsey': 'GGY',
+    'Heard Island and McDonald Islands': 'HMD',
+    'Hong Kong': 'HKG',
+    'Iran': 'IRN',
+    'Ivory Coast': 'CIV',
+    'Jersey': 'JEY',
+    'Kyrgyzstan': 'KGZ',
+    'Laos': 'LAO',
+    'Macao': 'MAC', 'Macau': 'MAC', 'Macau, China': 'MAC',
+    'Macedonia': 'MKD', 'Republic of Macedonia': 'MKD',
+    'Martinique': 'MTQ',
+    'Mayotte': 'MYT',
+    'Montserrat': 'MSR',
+    'Niue': 'NIU',
+    'Norfolk Island': 'NFK',
+    'North Korea': 'PRK',
+    'Northern Cyprus': 'CYN', 'Turkish Republic of Northern Cyprus': 'CYN',
+    'Palestine': 'PSE',
+    "People's Republic of China": 'CHN',
+    'Pitcairn Islands': 'PCN',
+    'Republic of Congo': 'COG', 'Republic of the Congo': 'COG',
+    'Reunion': 'REU',
+    'Russia': 'RUS',
+    'Saint Barthelemy': 'BLM',
+    'Saint Helena': 'SHN', 'Saint Helena, Ascension, and Tristan da Cunha': 'SHN',
+    'Saint Kitts and Nevis': 'KNA',
+    'Saint Lucia': 'LCA',
+    'Saint Martin': 'MAF',
+    'Saint Pierre and Miquelon': 'SPM',
+    'Saint Vincent and the Grenadines': 'VCT',
+    'Sahrawi Arab Democratic Republic': 'ESH', 'Western Sahara': 'ESH',
+    'Siachen Glacier': 'KAS',
+    'Sint Maarten': 'SXM',
+    'Slovakia': 'SVK',
+    'Somaliland': 'SOL',
+    'South Georgia and South Sandwich Islands': 'SGS',
+    'South Georgia and the South Sandwich Islands': 'SGS',
+    'South Korea': 'KOR',
+    'Svalbard': 'SJM',
+    'Syria': 'SYR',
+    'São Tomé and Príncipe': 'STP',
+    'Taiwan': 'TWN',
+    'Tokelau': 'TKL',
+    'United States of America': 'USA',
+    'US Minor Outlying Islands': 'UMI',
+    'United States Virgin Islands': 'VIR', 'US Virgin Islands': 'VIR', 'Virgin Islands': 'VIR',
+    'Vatican City': 'VAT',
+    'Venezuela': 'VEN',
+    'Wallis and Futuna': 'WLF',
+    'Yemen': 'YEM',
+}
+
+# the data sets in database/ keyed by country name: (file, column with the names, read_csv options)
+DATASETS = {
+    'population': (POPULATION_FILE, 'Country Name', {'header': 2}),
+    'population_2020': ("../database/population.csv", 'name', {}),
+    'capitals': ("../database/df_capitals.csv", 'Country/Region', {'index_col': 0}),
+    'country_capitals': ("../database/country-capitals.csv", 'CountryName', {}),
+    'languages': ("../database/languages.csv", 'Country/Region', {}),
+    'governments': ("../database/df_governments.csv", 'country', {'index_col': 0}),
+}
+
+_registry = {}  # the registry, once built
+
+
+def normalize_name(name):
+    """
+    Normalizes a country name so different spellings of it compare equal: case, accents,
+    punctuation and a leading 'the' are ignored.
+    """
+
+    if not isinstance(name, str):
+        return None
+
+    # some of the shapefiles' names were decoded as latin-1 instead of utf-8 (e.g. CuraÃ§ao)
+    try:
+        name = name.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        pass
+
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).casefold()
+    name = re.sub(r'[^a-z0-9]+', ' ', name.replace('&', ' and ')).strip()
+    if name.startswith('the '):
+        name = name[4:]
+
+    return name
+
+
+def build_registry(population_file=POPULATION_FILE):
+    """
+    Builds the country registry.
+    Returns: A tuple of the dictionary mapping normalized names to ISO3 codes and the dictionary
+    mapping ISO3 codes to the countries' names in the World Bank data.
+    """
+
+    df_pop = pd.read_csv(population_file, header=2)
+    names = dict(zip(df_pop['Country Code'], df_pop['Country Name']))
+
+    iso3_by_name = {}
+    for iso3, name in names.items():
+        iso3_by_name[normalize_name(name)] = iso3
+    for name, iso3 in ALIASES.items():
+        iso3_by_name[normalize_name(name)] = iso3
+        names.setdefault(iso3, name)
+
+    return (iso3_by_name, names)
+
+
+def get_registry():
+    """
+    Returns the country registry (see build_registry()), building it the first time.
+    """
+
+    if 'registry' not in _registry:
+        _registry['registry'] = build_registry()
+    return _registry['registry']
+
+
+def lookup_iso3(name):
+    """
+    Returns the ISO3 code of a country from any of its names, or None if it's unknown.
+    """
+
+    return get_registry()[0].get(normalize_name(name))
+
+
+def lookup_name(iso3):
+    """
+    Returns the name of a country from its ISO3 code, or None if it's unknown.
+    """
+
+    return get_registry()[1].get(iso3)
+
+
+def get_iso3_codes(names):
+    """
+    Finds the ISO3 codes of a Series of country names.
+    Returns: A tuple of the Series of ISO3 codes (None where the name is unknown) and the sorted
+    list of the names that weren't matched.
+    """
+
+    iso3_by_name = get_registry()[0]
+    unique = names.dropna().unique()
+    codes = {name: iso3_by_name.get(normalize_name(name)) for name in unique}
+
+    iso3 = names.map(codes)
+    unmatched = sorted(name for name, code in codes.items() if code is None)
+
+    return (iso3, unmatched)
+
+
+def add_iso3(df, name_column, iso3_column='ISO3'):
+    """
+    Adds a column of ISO3 codes to a DataFrame from its column of country names.
+    Returns: A tuple of the new DataFrame and the list of the names that weren't matched.
+    """
+
+    iso3, unmatched = get_iso3_codes(df[name_column])
+    return (df.assign(**{iso3_column: iso3}), unmatched)
+
+
+def load_dataset(dataset):
+    """
+    Reads one of the DATASETS and adds its countries' ISO3 codes.
+    Returns: A tuple of the DataFrame, with an 'ISO3' column, and the list of the names that
+    weren't matched.
+    """
+
+    path, name_column, options = DATASETS[dataset]
+    return add_iso3(pd.read_csv(path, **options), name_column)
+
+
+def join_dataset(df, dataset, columns=None, iso3_column='ISO3'):
+    """
+    Joins the columns of one of the DATASETS onto a DataFrame which has ISO3 codes.
+    Input: The DataFrame, the name of the data set, the columns of the data set to keep (all of
+    them by default) and the DataFrame's column of ISO3 codes.
+    Returns: A tuple of the joined DataFrame (with the same rows as df) and the list of the data
+    set's country names that weren't matched.
+    """
+
+    other, unmatched = load_dataset(dataset)
+    other = other.dropna(subset=['ISO3']).drop_duplicates('ISO3').set_index('ISO3')
+    if columns is not None:
+        other = other[columns]
+
+    return (df.join(other, on=iso3_column, rsuffix='_' + dataset), unmatched)
@@ -0,0 +1,112 @@
+from collections import namedtuple
+from functools import lru_cache
+from html import escape
+
+import numpy as np
+
+from countries import get_iso3_codes, join_dataset
+from shared_data import load_shared_data
+
+##################################################################
+# The details of a country (languages, government, population...) shown when it's hovered
+# or clicked on the map.
+#
+# Instead of adding every column of the data sets to the countries' ColumnDataSource,
+# which every session would send whole, the browser sends the row of the country the
+# mouse is over and world_map.py answers with the details of that one country. The data
+# sets are joined once per server process, and the records of the countries last asked
+# for are kept in an LRU cache shared by all the sessions.
+##################################################################
+
+DETAILS_CACHE_SIZE = 64  # records kept in the cache
+MAX_VALUE_LENGTH = 200  # longer values are cut (some government types are whole paragraphs)
+
+# the details of one country, None where the data sets don't have the value
+CountryDetails = namedtuple('CountryDetails', ['name', 'iso3', 'capital', 'languages',
+                                               'government', 'population', 'density', 'year'])
+
+_tables = {}  # the joined data sets, once loaded
+
+
+def load_details_table():
+    """
+    Joins the data sets the details come from onto the countries, the first time it's called.
+    Returns: A tuple of a DataFrame with the same rows as the shared countries and the columns
+    'ISO3', 'capital', 'languages' and 'government', and the YearStore of the countries.
+    """
+
+    if 'details' not in _tables:
+        shared = load_shared_data()
+        countries = shared['countries']
+        iso3, _ = get_iso3_codes(countries['NAME_EN'])
+        table = countries[['NAME_EN']].assign(ISO3=iso3)
+        table, _ = join_dataset(table, 'capitals', ['CapitalName_x'])
+        table, _ = join_dataset(table, 'languages', ['Languages'])
+        table, _ = join_dataset(table, 'governments', ['gov_edit'])
+        table = table.rename(columns={
+            'CapitalName_x': 'capital', 'Languages': 'languages', 'gov_edit': 'government'})
+        _tables['details'] = (table, shared['year_store'])
+
+    return _tables['details']
+
+
+def get_value(value):
+    """
+    Returns a value of the data sets, or None if it's missing.
+    """
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.strip() if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=DETAILS_CACHE_SIZE)
+def get_country_details(row):
+    """
+    Builds the details of a country.
+    Input: The country's row in the shared countries.
+    Returns: A CountryDetails, with the population and density of the last year that has them.
+    """
+
+    table, year_store = load_details_table()
+    record = table.iloc[row]
+
+    population = year_store.population[row]
+    known = np.flatnonzero(~np.isnan(population))
+    if len(known):
+        year_index = known[-1]
+        year = int(year_store.years[year_index])
+        population = float(population[year_index])
+        density = get_value(float(year_store.density[row, year_index]))
+    else:
+        year = population = density = None
+
+    return CountryDetails(name=record['NAME_EN'], iso3=get_value(record['ISO3']),
+                          capital=get_value(record['capital']),
+                          languages=get_value(record['languages']),
+                          government=get_value(record['government']),
+                          population=population, density=density, year=year)
+
+
+def format_details(details):
+    """
+    Formats the details of a country as HTML, for the hover tooltip and the clicked country.
+    Values the data sets don't have are left out, and long ones are cut.
+    """
+
+    lines = []
+    if details.capital:
+        lines.append(('Capital', details.capital))
+    if details.languages:
+        lines.append(('Languages', details.languages))
+    if details.government:
+        lines.append(('Government', details.government))
+    if details.population is not None:
+        lines.append(('Population (%d)' % details.year, '{:,.0f}'.format(details.population)))
+    if details.density is not None:
+        lines.append(('Density (%d)' % details.year, '{:,.1f} / km²'.format(details.density)))
+
+    return ''.join('<div><b>%s:</b> %s</div>' % (
+        escape(label),
+        escape(value if len(value) <= MAX_VALUE_LENGTH else value[:MAX_VALUE_LENGTH - 3] + '...'))
+        for label, value in lines)
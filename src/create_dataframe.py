@@ -1,5 +1,11 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from shapely.geometry import Point, LineString, Polygon, Point
 from shapely.geometry.collection import GeometryCollection
 import matplotlib.pyplot as plt
@@ -19,6 +25,30 @@ from bokeh.palettes import Inferno as palette
 ##################################################################
 
 FINAL_FILE = "final_dataset"  # folder name for final shapefiles
+# formats the final data set can be written in, with their file extension. Unlike shapefiles,
+# Parquet (GeoParquet) and Feather files keep the full column names and load much faster.
+FINAL_FORMATS = {'shapefile': '.shp', 'parquet': '.parquet', 'feather': '.feather'}
+# the columns whose names are cut to 10 characters in shapefiles
+SHAPEFILE_COLUMNS = {'pop_density': 'pop_densit', 'Country Code': 'Country Co',
+                     'Country Name': 'Country Na'}
+
+# the three polygon data sets, see plot_data_set() for what each one looks like
+GEODATA_FILES = ["../database/ne_50m_admin_0_countries.shp",  # the base data set
+                 "../database/0/99bfd9e7-bb42-4728-87b5-07f8c8ac631c2020328-1-1vef4ev.lu5nk.shp",
+                 "../database/1/TM_WORLD_BORDERS-0.3.shp"]
+GEODATA_COLUMNS = [['NAME_EN', 'ISO_A3', 'geometry'], None, ['ISO3', 'NAME', 'geometry']]
+NAME_COLUMNS = ['NAME_EN', 'CNTRY_NAME', 'NAME']  # column with the country names in each set
+POPULATION_FILE = "../database/API_SP.POP.TOTL_DS2_en_csv_v2_1976634.csv"
+
+# Changes made to the base data set (set 0), in order. Each one either merges the polygons of
+# another country of set 0 into a country (and drops the other country), or replaces a
+# country's polygons with those of the same country in another data set.
+POLYGON_FIXES = [
+    {'country': 'Morocco', 'union': 'Western Sahara'},
+    {'country': 'Somalia', 'union': 'Somaliland'},
+    {'country': 'Maldives', 'replace_from': 2},
+    {'country': 'Kiribati', 'replace_from': 2},
+]
 
 
 def get_geometry_coords(geo_object):
@@ -39,7 +69,7 @@ def get_geometry_coords(geo_object):
     ys = []
 
     if geo_object.geom_type == 'MultiPolygon':
-        for p in geo_object:
+        for p in geo_object.geoms:
             polygon_x = []
             polygon_y = []
             x = p.exterior.coords.xy[0]
@@ -74,13 +104,121 @@ def get_geometry_coords(geo_object):
     return (xs, ys)
 
 
+# Flat coordinate buffers of a sequence of polygonal geometries.
+# The coordinates of ring i are x[ring_offsets[i]:ring_offsets[i+1]], the rings of
+# part (polygon) j are ring_offsets[part_offsets[j]:part_offsets[j+1]] and the parts
+# of geometry k are part_offsets[geom_offsets[k]:geom_offsets[k+1]].
+PatchBuffers = namedtuple(
+    'PatchBuffers', ['x', 'y', 'ring_offsets', 'part_offsets', 'geom_offsets'])
+
+
+def get_patch_buffers(geometries):
+    """
+    Extracts the coordinates of all the Polygons and MultiPolygons in a sequence of
+    geometries in a single pass, without looping over the geometries in Python.
+    Input: A sequence (list, array or GeoSeries) of Shapely geometry objects.
+    Returns: A PatchBuffers tuple with the x and y coordinates as flat float64 arrays and
+    the ring, part and geometry offset arrays.
+
+    Geometries that aren't non-empty Polygons or MultiPolygons (Points, None, empty
+    geometries...) are given zero parts, so geom_offsets always has len(geometries) + 1
+    entries.
+    """
+
+    geoms = np.asarray(geometries, dtype=object)
+    type_ids = shapely.get_type_id(geoms)
+    polygonal = ((type_ids == shapely.GeometryType.POLYGON) |
+                 (type_ids == shapely.GeometryType.MULTIPOLYGON))
+    polygonal[polygonal] = ~shapely.is_empty(geoms[polygonal])
+
+    parts_per_geom = np.zeros(len(geoms), dtype=np.int64)
+    if polygonal.any():
+        geom_type, coords, offsets = shapely.to_ragged_array(geoms[polygonal])
+        if geom_type == shapely.GeometryType.POLYGON:
+            # only single Polygons, so every geometry is made of exactly one part
+            ring_offsets, part_offsets = offsets
+            parts_per_geom[polygonal] = 1
+        else:
+            ring_offsets, part_offsets, geom_offsets = offsets
+            parts_per_geom[polygonal] = np.diff(geom_offsets)
+        x = np.ascontiguousarray(coords[:, 0], dtype=np.float64)
+        y = np.ascontiguousarray(coords[:, 1], dtype=np.float64)
+    else:
+        x = y = np.empty(0, dtype=np.float64)
+        ring_offsets = part_offsets = np.zeros(1, dtype=np.int64)
+
+    geom_offsets = np.zeros(len(geoms) + 1, dtype=np.int64)
+    np.cumsum(parts_per_geom, out=geom_offsets[1:])
+
+    return PatchBuffers(x, y, np.asarray(ring_offsets, dtype=np.int64),
+                        np.asarray(part_offsets, dtype=np.int64), geom_offsets)
+
+
+def buffers_to_patch_coords(buffers, rows=None):
+    """
+    Converts a PatchBuffers tuple into the nested lists Bokeh's multi_polygons expects.
+    Input: A PatchBuffers tuple, as returned by get_patch_buffers(), and the geometries to
+    convert (all of them by default).
+    Returns: A tuple containing the lists of the geometries' x and y coordinates, in the
+    same form as get_geometry_coords(). Geometries with no parts get empty lists.
+    """
+
+    rings = buffers.ring_offsets.tolist()
+    parts = buffers.part_offsets.tolist()
+    geoms = buffers.geom_offsets.tolist()
+    if rows is None:
+        rows = range(len(geoms) - 1)
+
+    xs, ys = [], []
+    for g in rows:
+        # convert each geometry's coordinates to Python floats once, then only slice them
+        start, end = rings[parts[geoms[g]]], rings[parts[geoms[g + 1]]]
+        x = buffers.x[start:end].tolist()
+        y = buffers.y[start:end].tolist()
+        geom_x, geom_y = [], []
+        for p in range(geoms[g], geoms[g + 1]):
+            polygon_x, polygon_y = [], []
+            for r in range(parts[p], parts[p + 1]):
+                polygon_x.append(x[rings[r] - start:rings[r + 1] - start])
+                polygon_y.append(y[rings[r] - start:rings[r + 1] - start])
+            geom_x.append(polygon_x)
+            geom_y.append(polygon_y)
+        xs.append(geom_x)
+        ys.append(geom_y)
+
+    return (xs, ys)
+
+
+def buffers_to_geometries(buffers):
+    """
+    Rebuilds the Shapely geometries from a PatchBuffers tuple, without looping in Python.
+    Returns: An array of MultiPolygons. Geometries with no parts become empty MultiPolygons.
+    """
+
+    coords = np.column_stack((buffers.x, buffers.y))
+    return shapely.from_ragged_array(
+        shapely.GeometryType.MULTIPOLYGON, coords,
+        (buffers.ring_offsets, buffers.part_offsets, buffers.geom_offsets))
+
+
 def add_patch_coords(geodataframe):
-    x_patches, y_patches = [], []
+    """
+    Adds the 'xs' and 'ys' columns, containing the coordinates of each row's geometry in the
+    form returned by get_geometry_coords(), to a GeoDataFrame.
 
-    for country in geodataframe['geometry'].tolist():
-        coords = get_geometry_coords(country)
-        x_patches.append(coords[0])
-        y_patches.append(coords[1])
+    The Polygons and MultiPolygons are all extracted at once with get_patch_buffers(); only
+    the remaining geometries (Points, None...) go through get_geometry_coords().
+    """
+
+    geometries = np.asarray(geodataframe['geometry'].values, dtype=object)
+    buffers = get_patch_buffers(geometries)
+    x_patches, y_patches = buffers_to_patch_coords(buffers)
+
+    no_parts = np.flatnonzero(np.diff(buffers.geom_offsets) == 0)
+    for i in no_parts.tolist():
+        coords = get_geometry_coords(geometries[i])
+        x_patches[i] = coords[0]
+        y_patches[i] = coords[1]
 
     geodataframe['xs'] = x_patches
     geodataframe['ys'] = y_patches
@@ -149,104 +287,358 @@ def plot_data_set(dataset):
     return geodata
 
 
-def fix_polygons():
+def read_geodata(dataset):
+    """
+    Reads one of the polygon data sets (as the index in GEODATA_FILES), keeping only the
+    columns that are needed.
+    """
+
+    geodata = gpd.read_file(GEODATA_FILES[dataset])
+    if GEODATA_COLUMNS[dataset] is not None:
+        geodata = geodata[GEODATA_COLUMNS[dataset]]
+    return geodata
+
+
+def get_name_indexes(geodatasets):
+    """
+    Indexes the geometries of the polygon data sets by country name (see NAME_COLUMNS), so the
+    fixes look their countries up instead of comparing every name.
+    Input: The list of polygon data sets (GeoDataFrames, in the order of GEODATA_FILES, None for
+    the ones that weren't read).
+    Returns: The list of the dictionaries mapping each data set's names to their geometry (the
+    first one, for repeated names), None for the data sets that weren't read.
+    """
+
+    indexes = []
+    for dataset, geodata in enumerate(geodatasets):
+        if geodata is None:
+            indexes.append(None)
+            continue
+        index = {}
+        for name, geometry in zip(geodata[NAME_COLUMNS[dataset]].tolist(), geodata['geometry']):
+            index.setdefault(name, geometry)
+        indexes.append(index)
+    return indexes
+
+
+def get_fix_sources(fix, indexes):
+    """
+    Finds the geometries one of the POLYGON_FIXES is made from.
+    Input: The fix and the name indexes of the polygon data sets (see get_name_indexes()).
+    Returns: The list of the geometries whose union is the new geometry of fix['country'].
+    """
+
+    if 'union' in fix:
+        return [indexes[0][name] for name in (fix['country'], fix['union'])]
+    elif 'replace_from' in fix:
+        return [indexes[fix['replace_from']][fix['country']]]
+    else:
+        raise ValueError("Unknown polygon fix: " + str(fix))
+
+
+def get_fix_geometry(fix, geodatasets):
+    """
+    Computes the new geometry of the country changed by one of the POLYGON_FIXES.
+    Input: The fix and the list of polygon data sets (GeoDataFrames, in the order of
+    GEODATA_FILES).
+    Returns: The new Shapely geometry of fix['country'].
+    """
+
+    sources = get_fix_sources(fix, get_name_indexes(geodatasets))
+    return sources[0] if len(sources) == 1 else sources[0].union(sources[1])
+
+
+def apply_polygon_fixes(base, fixes, geometries):
+    """
+    Replaces the geometries of the countries changed by the fixes and drops the countries that
+    were merged into others.
+    Input: The base data set, the list of fixes and the list of their new geometries (as given
+    by get_fix_geometry()).
+    Returns: The fixed copy of the base data set.
+    """
+
+    base = base.copy()
+    rows = dict(zip(base[NAME_COLUMNS[0]], base.index))  # row index of each country, looked up once
+
+    dropped = []
+    for fix, geometry in zip(fixes, geometries):
+        # assigning through a one element list avoids geopandas trying to unpack a multipolygon
+        # see here: https://stackoverflow.com/questions/56018427/geopandas-set-geometry-valueerror-for-multipolygon-equal-len-keys-and-value
+        base.loc[[rows[fix['country']]], 'geometry'] = [geometry]
+        if 'union' in fix:
+            dropped.append(rows[fix['union']])
+
+    return base.drop(dropped)
+
+
+def fix_polygons(workers=None):
     """
     Picks certain country Polygons from the three different datasets and creates from them
     a single, final dataset.
 
     I used file0 as the base dataset since that was the one with Kosovo/Serbia and Sudan/South
     Sudan correctly separated. I then replaced some countries' Polygons with those from
-    the other files because they looked better.
-    """
-
-    file0 = "../database/ne_50m_admin_0_countries.shp"  # the base data set
-    file1 = "../database/0/99bfd9e7-bb42-4728-87b5-07f8c8ac631c2020328-1-1vef4ev.lu5nk.shp"
-    file2 = "../database/1/TM_WORLD_BORDERS-0.3.shp"
-
-    geodata0 = gpd.read_file(
-        file0)[['NAME_EN', 'ISO_A3', 'geometry']]  # good dataframe
-    geodata1 = gpd.read_file(file1)
-    geodata2 = gpd.read_file(file2)[['ISO3', 'NAME', 'geometry']]
-    geodata2.crs = geodata0.crs
-
-    # merge morocco and western sahara polygons
-    # extract good serbia geometry
-    morocco = geodata0[geodata0['NAME_EN'] == 'Morocco']['geometry'].squeeze()
-    morocco_index = geodata0[geodata0['NAME_EN'] ==
-                             'Morocco'].index.tolist()  # row index of serbia
-    # extract good serbia geometry
-    sahara = geodata0[geodata0['NAME_EN'] ==
-                      'Western Sahara']['geometry'].squeeze()
-    geodata0.at[morocco_index[0], 'geometry'] = morocco.union(
-        sahara)  # assign new serbia
-    geodata0 = geodata0.drop(
-        geodata0[geodata0['NAME_EN'] == 'Western Sahara'].index)
-
-    # merge somalia and somaliland polygons
-    # extract good serbia geometry
-    somalia = geodata0[geodata0['NAME_EN'] == 'Somalia']['geometry'].squeeze()
-    somalia_index = geodata0[geodata0['NAME_EN'] ==
-                             'Somalia'].index.tolist()  # row index of serbia
-    # extract good serbia geometry
-    somaliland = geodata0[geodata0['NAME_EN']
-                          == 'Somaliland']['geometry'].squeeze()
-    geodata0.at[somalia_index[0], 'geometry'] = somalia.union(
-        somaliland)  # assign new serbia polygon
-    geodata0 = geodata0.drop(
-        geodata0[geodata0['NAME_EN'] == 'Somaliland'].index)
-
-    # replace maldives with polygons from set 2
-    maldives_index = geodata0[geodata0['NAME_EN'] ==
-                              'Maldives'].index.tolist()  # row index of serbia
-    # the following line of code doesn't work if you try to assign a variable containing the multipolygon
-    # see here: https://stackoverflow.com/questions/56018427/geopandas-set-geometry-valueerror-for-multipolygon-equal-len-keys-and-value
-    geodata0.loc[maldives_index[0], 'geometry'] = geodata2.loc[geodata2['NAME']
-                                                               == 'Maldives', 'geometry'].values  # assign new serbia polygon
-
-    # replace kiribati with polygons from set 2
-    kiribati_index = geodata0[geodata0['NAME_EN'] ==
-                              'Kiribati'].index.tolist()  # row index of serbia
-    geodata0.loc[kiribati_index[0], 'geometry'] = geodata2.loc[geodata2['NAME']
-                                                               == 'Kiribati', 'geometry'].values  # assign new serbia polygon
-
-    return geodata0
-
-
-def add_population(df_final):
-    """
-    Adds the population data to the final data set. Only meant to be called after
-    fix_polygons().
-    """
-
-    def get_population_density(row):
-        if row['geometry'].area == 0 or row['geometry'] is None:
-            return 0
-        else:
-            # get population / area and convert to km^2
-            return row['2019'] / row['geometry'].area * 10**6
+    the other files because they looked better. The changes are listed in POLYGON_FIXES.
 
-    df_pop = pd.read_csv(
-        "../database/API_SP.POP.TOTL_DS2_en_csv_v2_1976634.csv", header=2)
+    The data sets are read concurrently and the geometry work is split between the given number
+    of worker processes (all the CPUs by default, see map_chunks()).
+    """
+
+    geodatasets = read_all_geodata(workers)
+    geodatasets[2].crs = geodatasets[0].crs
+
+    geometries = get_fix_geometries(POLYGON_FIXES, geodatasets, workers)
+    fixed = apply_polygon_fixes(geodatasets[0], POLYGON_FIXES, geometries)
+    fixed['geometry'] = repair_geometries(fixed['geometry'], workers)
+    return fixed
+
+
+def get_areas(geometries):
+    """
+    Computes the area, in m^2, of every geometry of a GeoSeries.
+    Missing geometries have an area of 0.
+    """
 
-    df_final = df_final.merge(df_pop[['Country Code', 'Country Name', '2019']],
-                              how='outer', left_on='ISO_A3', right_on='Country Code')
     # change any None geometries to actual geometry objects...
-    df_copy = df_final['geometry'].apply(
-        lambda x: x if x else GeometryCollection())
+    geometries = geometries.apply(lambda x: x if x else GeometryCollection())
     # ...so next line doesn't throw error
     # change to CRS which gives most accurate area values
-    df_copy = df_copy.to_crs({'proj': 'cea'})
-    df_final['pop_density'] = df_final['2019'] / df_copy.area * 10**6
+    return geometries.to_crs({'proj': 'cea'}).area
+
+
+def add_population(df_final, areas=None):
+    """
+    Adds the population data to the final data set, keeping its rows. Only meant to be called
+    after fix_polygons().
+    The areas of the countries (as given by get_areas()) can be passed in if they're already
+    known, otherwise they're computed here (or read from the cache of areas.py).
+    """
+
+    from countries import get_iso3_codes, join_dataset
+    if areas is None:
+        from areas import get_areas_cached
+        areas = get_areas_cached(df_final['geometry'])
+
+    # joined on the ISO3 codes of the countries' names (see countries.py) rather than on
+    # ISO_A3, which many countries (e.g. France, Norway) don't have in set 0
+    iso3, _ = get_iso3_codes(df_final['NAME_EN'])
+    df_final = df_final.assign(area=areas, ISO3=iso3)
+    df_final, _ = join_dataset(df_final, 'population', ['Country Code', 'Country Name', '2019'])
+    df_final = df_final.drop(columns='ISO3')
+    # countries without polygons have an area of 0, like in get_areas()
+    df_final['pop_density'] = df_final['2019'] / df_final['area'].fillna(0) * 10**6
+    df_final = df_final.drop(columns='area')
     # df_final['geometry'] = df_final['geometry'].to_crs(epsg=3857) # change to CRS back to longitude/latitude
 
     return df_final
 
 
-def create_polygon_dataset():
-    df = fix_polygons()
-    df = add_population(df)
-    df.to_file(FINAL_FILE)  # write the good polygons to a shapefile
-    # column names get truncated here, but I don't know how to fix it
+##################################################################
+# Parallel build.
+#
+# The polygon data sets are read in threads, since reading a shapefile is mostly spent in
+# GDAL, which releases the GIL. The work done on every country (the unions of the fixes,
+# repairing invalid geometries and projecting them to compute their areas) is split into
+# chunks which are run in a pool of processes, so with bigger data sets (e.g. the 10m
+# Natural Earth countries) the build scales with the number of CPUs. With workers=1,
+# everything runs in this process.
+##################################################################
+
+CHUNK_SIZE = 32  # countries per task sent to the worker processes
+
+
+def map_chunks(function, values, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Calls a function on chunks of a sequence of values in a pool of processes.
+    Input: The function (defined at the top level of a module, so it can be sent to the
+    processes), the sequence, the number of processes (all the CPUs by default) and the number
+    of values in each chunk.
+    Returns: The list of the function's results, one per chunk, in order.
+    """
+
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        return [function(chunk) for chunk in chunks]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, chunks))
+
+
+def read_all_geodata(workers=None):
+    """
+    Reads every polygon data set (see read_geodata()) at the same time.
+    Returns: The list of GeoDataFrames, in the order of GEODATA_FILES.
+    """
+
+    if workers == 1:
+        return [read_geodata(i) for i in range(len(GEODATA_FILES))]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_geodata, range(len(GEODATA_FILES))))
+
+
+def union_pairs(pairs):
+    """
+    Returns the union of each pair of geometries of a list.
+    """
+
+    return [geometry.union(other) for geometry, other in pairs]
+
+
+def get_fix_geometries(fixes, geodatasets, workers=None):
+    """
+    Same as calling get_fix_geometry() on every fix, but with the unions computed in parallel.
+    Returns: The list of the new geometries of the fixes' countries.
+    """
+
+    indexes = get_name_indexes(geodatasets)  # built once for all the fixes
+    geometries = [None] * len(fixes)
+    pairs, union_indices = [], []
+    for i, fix in enumerate(fixes):
+        sources = get_fix_sources(fix, indexes)
+        if len(sources) == 2:
+            pairs.append(tuple(sources))
+            union_indices.append(i)
+        else:
+            geometries[i] = sources[0]
+
+    # the unions are few but can be slow, so each one is its own task
+    unions = sum(map_chunks(union_pairs, pairs, workers, chunk_size=1), [])
+    for i, geometry in zip(union_indices, unions):
+        geometries[i] = geometry
+
+    return geometries
+
+
+def repair_chunk(geometries):
+    """
+    Makes the invalid geometries of a list valid, keeping only their polygons.
+    Returns: The array of repaired geometries, an empty Polygon for those that have no polygon
+    left (e.g. a ring collapsed to a line).
+    """
+
+    geometries = np.array(geometries, dtype=object)
+    invalid = np.flatnonzero(~shapely.is_valid(geometries) & ~shapely.is_missing(geometries))
+    for i in invalid.tolist():
+        parts = shapely.get_parts(shapely.make_valid(geometries[i]))
+        polygons = shapely.get_parts(parts[shapely.get_dimensions(parts) == 2])
+        if len(polygons) == 0:
+            geometries[i] = shapely.Polygon()
+        else:
+            geometries[i] = shapely.multipolygons(polygons) if len(polygons) > 1 else polygons[0]
+
+    return geometries
+
+
+def repair_geometries(geometries, workers=None):
+    """
+    Makes the invalid geometries of a GeoSeries valid (see repair_chunk()), in parallel.
+    Returns: The repaired GeoSeries.
+    """
+
+    chunks = map_chunks(repair_chunk, np.asarray(geometries.values, dtype=object), workers)
+    return gpd.GeoSeries(np.concatenate(chunks) if chunks else [], index=geometries.index,
+                         crs=geometries.crs)
+
+
+def get_areas_chunk(chunk):
+    """
+    Computes the areas of a chunk of geometries, given as a tuple of the geometries and their CRS.
+    """
+
+    geometries, crs = chunk[0]
+    return get_areas(gpd.GeoSeries(geometries, crs=crs)).to_numpy()
+
+
+def get_areas_parallel(geometries, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Same as get_areas(), with the projection split between processes.
+    """
+
+    values = np.asarray(geometries.values, dtype=object)
+    chunks = [(values[i:i + chunk_size], geometries.crs) for i in range(0, len(values), chunk_size)]
+    areas = map_chunks(get_areas_chunk, chunks, workers, chunk_size=1)
+    return pd.Series(np.concatenate(areas) if areas else [], index=geometries.index,
+                     dtype=np.float64)
+
+
+##################################################################
+# Reading and writing the final data set.
+##################################################################
+
+def get_final_path(file_format='shapefile'):
+    """
+    Returns the path of the final data set in one of the FINAL_FORMATS. Shapefiles are written
+    in the FINAL_FILE folder.
+    """
+
+    if file_format == 'shapefile':
+        return FINAL_FILE
+    return FINAL_FILE + FINAL_FORMATS[file_format]
+
+
+def write_final_dataset(df, file_format='shapefile'):
+    """
+    Writes the final data set.
+    Input: The final data set and one of the FINAL_FORMATS.
+    Returns: The path written.
+    """
+
+    path = get_final_path(file_format)
+    if file_format == 'shapefile':
+        df.to_file(path)  # column names get truncated to 10 characters here
+        return path
+
+    if file_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif file_format == 'feather':
+        df.to_feather(path)
+    else:
+        raise ValueError("Unknown format: " + str(file_format))
+
+    return path
+
+
+def find_final_dataset():
+    """
+    Returns the path of the final data set, in the fastest format there is one of (Parquet,
+    then Feather, then the shapefile).
+    """
+
+    for file_format in ['parquet', 'feather']:
+        path = get_final_path(file_format)
+        if os.path.exists(path):
+            return path
+    return FINAL_FILE + FINAL_FORMATS['shapefile']
+
+
+def read_final_dataset(path=FINAL_FILE + ".shp", columns=None):
+    """
+    Reads the final data set from a shapefile, Parquet or Feather file.
+    Input: The path of the file and the columns to read (all of them by default).
+    Returns: A GeoDataFrame with the full column names, even from a shapefile.
+    """
+
+    extension = os.path.splitext(path)[1]
+    if extension in ('.parquet', '.feather'):
+        read_geo_table = gpd.read_parquet if extension == '.parquet' else gpd.read_feather
+        df = read_geo_table(path, columns=None if columns is None else list(columns) + ['geometry'])
+        # files written by older versions may still have the patch coordinates and the bounds
+        df = df.drop(columns=['xs', 'ys', 'minx', 'miny', 'maxx', 'maxy'], errors='ignore')
+    else:
+        if columns is not None:
+            columns = [SHAPEFILE_COLUMNS.get(column, column) for column in columns]
+        df = gpd.read_file(path, columns=columns)
+        df = df.rename(columns={short: full for full, short in SHAPEFILE_COLUMNS.items()})
+
+    return df
+
+
+def create_polygon_dataset(workers=None, file_format='shapefile'):
+    from areas import get_areas_cached
+    df = fix_polygons(workers)
+    df = add_population(df, get_areas_cached(df['geometry'], workers))
+    write_final_dataset(df, file_format)  # write the good polygons
 
     return df
 
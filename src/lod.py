@@ -0,0 +1,87 @@
+import numpy as np
+import shapely
+
+from create_dataframe import get_patch_buffers
+
+##################################################################
+# Level-of-detail versions of the country polygons.
+#
+# Drawing the full resolution polygons is only needed when zoomed in, so we also keep
+# simplified copies of them at a few tolerances and pick one based on how many degrees a
+# pixel spans. The simplification works on the whole coverage at once, so a border shared
+# by two countries is simplified the same way for both and no gaps open up between them.
+##################################################################
+
+# simplification tolerance (in degrees) of each level, level 0 being the original polygons
+LOD_TOLERANCES = [0, 0.05, 0.2, 0.5]
+
+
+def simplify_coverage(geometries, tolerance):
+    """
+    Simplifies a set of polygons that share borders, keeping the shared borders identical.
+    Input: A sequence of Shapely geometry objects (None allowed) and the tolerance in degrees.
+    Returns: An array of the simplified geometries. Missing geometries stay None.
+    """
+
+    geoms = np.asarray(geometries, dtype=object).copy()
+    if tolerance <= 0:
+        return geoms
+
+    present = ~shapely.is_missing(geoms)
+    geoms[present] = shapely.coverage_simplify(geoms[present], tolerance)
+    return geoms
+
+
+def create_lod_buffers(geometries, tolerances=LOD_TOLERANCES):
+    """
+    Computes the patch coordinate buffers of every level of detail.
+    Returns: A list of PatchBuffers tuples, one for each tolerance.
+    """
+
+    return [get_patch_buffers(simplify_coverage(geometries, tolerance))
+            for tolerance in tolerances]
+
+
+def get_patch_bounds(buffers):
+    """
+    Finds the bounding box of every geometry in a PatchBuffers tuple.
+    Returns: An array of shape (n, 4) with the (minx, miny, maxx, maxy) of each geometry.
+    Geometries with no parts get NaN bounds.
+    """
+
+    # index of the first coordinate of each geometry
+    starts = buffers.ring_offsets[buffers.part_offsets[buffers.geom_offsets]]
+    bounds = np.full((len(starts) - 1, 4), np.nan)
+
+    has_coords = np.diff(starts) > 0
+    if has_coords.any():
+        first = starts[:-1][has_coords]
+        bounds[has_coords, 0] = np.minimum.reduceat(buffers.x, first)
+        bounds[has_coords, 1] = np.minimum.reduceat(buffers.y, first)
+        bounds[has_coords, 2] = np.maximum.reduceat(buffers.x, first)
+        bounds[has_coords, 3] = np.maximum.reduceat(buffers.y, first)
+
+    return bounds
+
+
+def choose_level(x_span, plot_width, tolerances=LOD_TOLERANCES):
+    """
+    Picks the coarsest level of detail whose tolerance is still under one pixel.
+    Input: The width of the visible x range (in degrees) and of the plot (in pixels).
+    Returns: The index of the level in tolerances.
+    """
+
+    degrees_per_pixel = x_span / max(plot_width, 1)
+    level = np.searchsorted(tolerances, degrees_per_pixel, side='right') - 1
+    return int(max(level, 0))
+
+
+def visible_rows(bounds, x_start, x_end, y_start, y_end):
+    """
+    Finds the geometries whose bounding box overlaps the visible area.
+    Returns: A boolean array. Geometries with no parts are never visible.
+    """
+
+    with np.errstate(invalid='ignore'):
+        return ((bounds[:, 0] <= x_end) & (bounds[:, 2] >= x_start) &
+                (bounds[:, 1] <= y_end) & (bounds[:, 3] >= y_start))
@@ -0,0 +1,11 @@
+from bokeh.io import curdoc
+
+from world_map import make_document
+
+##################################################################
+# Entry point of the map when the whole src folder is served as a Bokeh directory app:
+# bokeh serve --show .
+# (server_lifecycle.py loads the shared data when the server starts)
+##################################################################
+
+make_document(curdoc())
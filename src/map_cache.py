@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from create_dataframe import (FINAL_FILE, PatchBuffers, buffers_to_patch_coords, buffers_to_geometries,
+                              read_final_dataset)
+from lod import LOD_TOLERANCES, create_lod_buffers, get_patch_bounds
+from spatial_index import build_spatial_index
+from topology import Topology, build_topology, topology_to_buffers
+from areas import get_areas_cached, get_density
+
+##################################################################
+# A compiled, binary copy of the final data set for world_map.py.
+#
+# Reading final_dataset.shp means parsing the .dbf records and the shapes and then
+# rebuilding the patch coordinates, which is slow to do for every Bokeh session.
+# build_map_cache() does all of that once and writes the coordinate buffers and the
+# attribute columns as .npy files, which load_map_cache() memory-maps read-only.
+# Since the arrays are memory-mapped, every worker process shares the same pages,
+# and within a process the loaded cache is kept and reused by every session.
+#
+# The cache is keyed by the contents of the shapefile, so it's rebuilt automatically
+# whenever the shapefile changes. Its rows are those of the final data set with the ones
+# without a polygon moved last. The simplified levels of detail from lod.py are
+# compiled into the same cache. The final data set can also be a Parquet or Feather file
+# (see create_dataframe.write_final_dataset()).
+#
+# The polygons of every level are also stored as their topology (see topology.py), in
+# which the borders shared by two countries are only stored once, for world_map.py's
+# --compact mode. The coordinate buffers are the ones rebuilt from the topology, so both
+# draw exactly the same polygons.
+##################################################################
+
+CACHE_VERSION = 8  # bump whenever the layout of the cache files changes
+CACHE_DIR = "map_cache"  # folder holding the compiled caches
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+# the columns of the final data set world_map.py uses, the others aren't read
+MAP_COLUMNS = ['NAME_EN', 'Country Code', 'Country Name', '2019', 'pop_density']
+
+_loaded = {}  # caches already loaded in this process, by cache folder
+_topology_loaded = {}  # topologies already memory-mapped, by cache folder
+_lod_loaded = {}  # levels of detail already loaded, with their bounds, by cache folder
+_index_loaded = {}  # spatial indexes already built, by cache folder
+
+
+def get_source_files(shapefile):
+    """
+    Returns the list of files making up a shapefile (.shp, .dbf, etc.) which exist. Parquet and
+    Feather files are a single file.
+    """
+
+    base, extension = os.path.splitext(shapefile)
+    if extension != '.shp':
+        return [shapefile] if os.path.exists(shapefile) else []
+    return [base + ext for ext in SHAPEFILE_PARTS if os.path.exists(base + ext)]
+
+
+def hash_file(path):
+    """
+    Returns the SHA-1 hex digest of a file's contents.
+    """
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_source_stats(shapefile, hashes=True):
+    """
+    Returns a dictionary mapping each file of the shapefile to its size, modification time
+    and (optionally) content hash.
+    """
+
+    stats = {}
+    for path in get_source_files(shapefile):
+        st = os.stat(path)
+        stats[os.path.basename(path)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if hashes:
+            stats[os.path.basename(path)]['sha1'] = hash_file(path)
+    return stats
+
+
+def get_cache_key(stats):
+    """
+    Computes the cache key from the content hashes of the source files and the cache version.
+    """
+
+    sha = hashlib.sha1(str(CACHE_VERSION).encode())
+    for name in sorted(stats):
+        sha.update(name.encode())
+        sha.update(stats[name]['sha1'].encode())
+    return sha.hexdigest()[:16]
+
+
+def prepare_countries(geodataframe):
+    """
+    Applies the derived columns world_map.py needs to the final data set.
+    """
+
+    # area in km^2, in the equal-area projection of get_areas(), so the densities of other
+    # years (see year_store.py) don't need the polygons
+    geodataframe['area'] = get_areas_cached(geodataframe['geometry']).to_numpy() / 10**6
+    # population density, per km^2, recomputed like those of the other years rather than read
+    # from the data set, since the committed shapefile's densities are 10^4 times too big
+    geodataframe['pop_density'] = get_density(geodataframe['2019'], geodataframe['area'])
+    return geodataframe
+
+
+def build_map_cache(shapefile=FINAL_FILE + ".shp", cache_dir=CACHE_DIR):
+    """
+    Compiles a shapefile into a binary cache in cache_dir.
+    Input: The path to the shapefile and the folder to write the cache in.
+    Returns: The path of the compiled cache's folder.
+    """
+
+    stats = get_source_stats(shapefile)
+    key = get_cache_key(stats)
+    target = os.path.join(cache_dir, key)
+
+    if not os.path.isdir(target):
+        geodata = prepare_countries(read_final_dataset(shapefile, MAP_COLUMNS))
+        geometries = np.asarray(geodata['geometry'].values, dtype=object)
+        missing = shapely.is_missing(geometries) | shapely.is_empty(geometries)
+        # the countries with polygons first, so the rows world_map.py shows (see
+        # shared_data.load_countries()) are the same in the attributes and in the buffers
+        order = np.argsort(missing, kind='stable')
+        geodata = geodata.iloc[order].reset_index(drop=True)
+        geometries, missing = geometries[order], missing[order]
+        levels = create_lod_buffers(geometries, LOD_TOLERANCES)
+
+        # only polygons and missing geometries can be rebuilt from the buffers
+        no_parts = np.diff(levels[0].geom_offsets) == 0
+        if (no_parts & ~missing).any():
+            raise ValueError(
+                "Only (Multi)Polygons and missing geometries can be cached.")
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # write into a temporary folder first so other processes never see a half written cache
+        tmp = tempfile.mkdtemp(dir=cache_dir, prefix='.' + key)
+        for level, buffers in enumerate(levels):
+            topology = build_topology(buffers)
+            for field, array in topology._asdict().items():
+                np.save(os.path.join(tmp, 'lod%d_%s.npy' % (level, field)), array)
+            for field, array in topology_to_buffers(topology)._asdict().items():
+                np.save(os.path.join(tmp, 'lod%d_buffers_%s.npy' % (level, field)), array)
+        np.save(os.path.join(tmp, 'missing.npy'), missing)
+
+        text_columns = {}
+        numeric_columns = []
+        for col in geodata.columns.drop('geometry'):
+            if geodata[col].dtype.kind in 'biuf':
+                np.save(os.path.join(tmp, 'col%d.npy' % len(numeric_columns)),
+                        geodata[col].to_numpy())
+                numeric_columns.append(col)
+            else:
+                text_columns[col] = geodata[col].astype(object).where(
+                    geodata[col].notna(), None).tolist()
+
+        with open(os.path.join(tmp, 'attributes.json'), 'w') as f:
+            json.dump({'columns': geodata.columns.drop('geometry').tolist(),
+                       'tolerances': LOD_TOLERANCES,
+                       'numeric': numeric_columns, 'text': text_columns}, f)
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'key': key, 'sources': stats}, f)
+
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # another process finished building the same cache first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(os.path.join(cache_dir, os.path.basename(shapefile) + '.json'), 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'key': key, 'sources': stats}, f)
+
+    return target
+
+
+def find_map_cache(shapefile=FINAL_FILE + ".shp", cache_dir=CACHE_DIR):
+    """
+    Finds the up-to-date cache of a shapefile, building it if it's missing or stale.
+    Returns: The path of the cache's folder.
+    """
+
+    pointer = os.path.join(cache_dir, os.path.basename(shapefile) + '.json')
+    try:
+        with open(pointer) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return build_map_cache(shapefile, cache_dir)
+
+    target = os.path.join(cache_dir, manifest['key'])
+    if manifest['version'] != CACHE_VERSION or not os.path.isdir(target):
+        return build_map_cache(shapefile, cache_dir)
+
+    # the files' sizes and modification times are enough to tell nothing changed,
+    # otherwise compare the contents
+    stats = get_source_stats(shapefile, hashes=False)
+    for name, stat in stats.items():
+        cached = manifest['sources'].get(name)
+        if cached is None or cached['size'] != stat['size']:
+            return build_map_cache(shapefile, cache_dir)
+        if cached['mtime_ns'] != stat['mtime_ns']:
+            return build_map_cache(shapefile, cache_dir)
+    if set(stats) != set(manifest['sources']):
+        return build_map_cache(shapefile, cache_dir)
+
+    return target
+
+
+def load_map_topologies(path):
+    """
+    Memory-maps the topologies of every level of detail of the compiled cache in the given
+    folder.
+    Returns: The list of the Topology of every level (level 0 being the original polygons).
+    """
+
+    if path not in _topology_loaded:
+        with open(os.path.join(path, 'attributes.json')) as f:
+            attributes = json.load(f)
+
+        _topology_loaded[path] = [
+            Topology(*[np.load(os.path.join(path, 'lod%d_%s.npy' % (level, field)), mmap_mode='r')
+                       for field in Topology._fields])
+            for level in range(len(attributes['tolerances']))]
+
+    return _topology_loaded[path]
+
+
+def load_map_buffers(path):
+    """
+    Loads the compiled cache in the given folder.
+    Returns: A tuple of the list of PatchBuffers of every level of detail (level 0 being the
+    original polygons), the boolean array of missing (or empty) geometries and a DataFrame of
+    the attribute columns. The rows with a geometry come first.
+    """
+
+    if path in _loaded:
+        return _loaded[path]
+
+    with open(os.path.join(path, 'attributes.json')) as f:
+        attributes = json.load(f)
+
+    levels = [PatchBuffers(*[np.load(os.path.join(path, 'lod%d_buffers_%s.npy' % (level, field)),
+                                     mmap_mode='r')
+                             for field in PatchBuffers._fields])
+              for level in range(len(attributes['tolerances']))]
+    missing = np.load(os.path.join(path, 'missing.npy'), mmap_mode='r')
+
+    columns = dict(attributes['text'])
+    for i, col in enumerate(attributes['numeric']):
+        columns[col] = np.load(os.path.join(path, 'col%d.npy' % i), mmap_mode='r')
+    df = pd.DataFrame({col: columns[col] for col in attributes['columns']})
+
+    _loaded[path] = (levels, missing, df)
+    return _loaded[path]
+
+
+def load_map_cache(shapefile=FINAL_FILE + ".shp", cache_dir=CACHE_DIR):
+    """
+    Loads the final data set ready to be plotted, from its compiled cache.
+    Returns: A DataFrame with the attribute columns plus the 'xs' and 'ys' patch coordinates,
+    like add_patch_coords() followed by dropping the geometry column.
+    """
+
+    levels, missing, attributes = load_map_buffers(find_map_cache(shapefile, cache_dir))
+
+    xs, ys = buffers_to_patch_coords(levels[0])
+    for i in np.flatnonzero(missing).tolist():
+        xs[i], ys[i] = [0], [0]  # same as get_geometry_coords(None)
+
+    df = attributes.copy()
+    df['xs'] = xs
+    df['ys'] = ys
+
+    return df
+
+
+def load_lod_levels(shapefile=FINAL_FILE + ".shp", cache_dir=CACHE_DIR):
+    """
+    Loads every level of detail of the final data set.
+    Returns: A list with, for each level, a tuple of its memory-mapped PatchBuffers, the boolean
+    array of missing geometries and the array of each country's bounds. get_patch_coords()
+    converts the countries shown to patch coordinates.
+    The bounds are computed once per process.
+    """
+
+    path = find_map_cache(shapefile, cache_dir)
+    if path not in _lod_loaded:
+        levels, missing, _ = load_map_buffers(path)
+        _lod_loaded[path] = [(buffers, missing, get_patch_bounds(buffers)) for buffers in levels]
+
+    return _lod_loaded[path]
+
+
+def get_patch_coords(lod_level, rows):
+    """
+    Converts some of the countries of a level of detail to patch coordinates.
+    Input: One of the levels of load_lod_levels() and the rows of the countries.
+    Returns: A tuple of the lists of the countries' xs and ys, as in load_map_cache().
+    """
+
+    buffers, missing, _ = lod_level
+    xs, ys = buffers_to_patch_coords(buffers, rows)
+    for i in np.flatnonzero(missing[rows]).tolist():
+        xs[i], ys[i] = [0], [0]  # same as get_geometry_coords(None)
+    return (xs, ys)
+
+
+def load_spatial_index(shapefile=FINAL_FILE + ".shp", cache_dir=CACHE_DIR):
+    """
+    Loads the spatial index (see spatial_index.py) of the full resolution polygons of the final
+    data set. The index is built once per process.
+    """
+
+    path = find_map_cache(shapefile, cache_dir)
+    if path not in _index_loaded:
+        levels, _, _ = load_map_buffers(path)
+        _index_loaded[path] = build_spatial_index(buffers_to_geometries(levels[0]))
+
+    return _index_loaded[path]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compile a shapefile into the binary cache used by world_map.py.")
+    parser.add_argument('shapefile', nargs='?', default=FINAL_FILE + ".shp")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+    print(build_map_cache(args.shapefile, args.cache_dir))
@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+import numpy as np
+
+##################################################################
+# Layers of points (capitals, cities...) which stay fast with hundreds of thousands of
+# points.
+#
+# The points are binned once, on grids of POINT_CELL_SIZES degrees: every cell with
+# points becomes a single point, at the mean of its points, which counts them. When the
+# map moves, world_map.py picks the grid whose cells are about POINT_CELL_PIXELS wide
+# on the screen and only sends the binned points inside the visible area, so the
+# browser never gets more than a few thousand points whatever the size of the layer.
+# Zoomed in enough, the points themselves are sent (the last level, with cells of 0).
+#
+# The points of every level are sorted by longitude, so the visible ones are found with
+# a binary search rather than by testing every point.
+##################################################################
+
+POINT_CELL_SIZES = [360 / 2**k for k in range(3, 13)]  # 45 to ~0.09 degrees
+POINT_CELL_PIXELS = 16  # width of the cells on the screen
+POINT_SIZE = 4.5  # size of the single points, the clusters are bigger
+
+# the binned points of one grid: the cell size, the points' coordinates sorted by x, the number
+# of points in each one and the index of the first of them in the layer
+PointLevel = namedtuple('PointLevel', ['cell_size', 'x', 'y', 'count', 'first'])
+
+
+def bin_points(x, y, cell_size):
+    """
+    Bins points on a grid.
+    Input: The points' x and y coordinates and the size of the grid's cells (0 to keep every
+    point as it is).
+    Returns: A PointLevel of the points of every non-empty cell.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if cell_size == 0:
+        count = np.ones(len(x), dtype=np.int64)
+        first = np.arange(len(x))
+        bin_x, bin_y = x, y
+    else:
+        columns = np.floor(x / cell_size).astype(np.int64)
+        rows = np.floor(y / cell_size).astype(np.int64)
+        _, first, inverse, count = np.unique(columns * (1 << 32) + rows, return_index=True,
+                                             return_inverse=True, return_counts=True)
+        bin_x = np.bincount(inverse, weights=x) / count
+        bin_y = np.bincount(inverse, weights=y) / count
+
+    order = np.argsort(bin_x, kind='stable')
+    return PointLevel(cell_size, bin_x[order], bin_y[order], count[order], first[order])
+
+
+def build_point_levels(x, y, cell_sizes=POINT_CELL_SIZES):
+    """
+    Bins points on every grid, from the biggest cells to the smallest, followed by the points
+    themselves. Points with missing coordinates are ignored.
+    Returns: The list of PointLevels.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+
+    levels = []
+    for cell_size in sorted(cell_sizes, reverse=True) + [0]:
+        level = bin_points(x[valid], y[valid], cell_size)
+        levels.append(level._replace(first=valid[level.first]))
+    return levels
+
+
+def choose_point_level(levels, x_span, plot_width):
+    """
+    Picks the level whose cells are closest to POINT_CELL_PIXELS wide without being smaller.
+    The points themselves (the last level, with cells of 0) count as a grid with cells half
+    the size of the smallest ones, so they're picked once the smallest cells get twice as wide.
+    Input: The levels, the visible width in degrees and the plot's width in pixels.
+    Returns: The index of the level, 0 (the biggest cells) when even those are too small.
+    """
+
+    wanted = x_span / plot_width * POINT_CELL_PIXELS
+    for i in range(len(levels) - 1, 0, -1):
+        cell_size = levels[i].cell_size or levels[i - 1].cell_size / 2
+        if cell_size >= wanted:
+            return i
+    return 0
+
+
+def query_points(level, x_start, x_end, y_start, y_end):
+    """
+    Returns the indices (in the level) of the points inside a rectangle, edges included.
+    """
+
+    start = np.searchsorted(level.x, x_start, side='left')
+    end = np.searchsorted(level.x, x_end, side='right')
+    inside = (level.y[start:end] >= y_start) & (level.y[start:end] <= y_end)
+    return start + np.flatnonzero(inside)
+
+
+def get_point_data(levels, labels, x_start, x_end, y_start, y_end, plot_width, unit='points'):
+    """
+    Finds the points of a layer to draw for the visible area.
+    Input: The layer's levels, the label of each of its points, the visible area, the plot's
+    width in pixels and what the points are called (for the clusters' labels).
+    Returns: A dictionary of the columns 'x', 'y', 'count', 'size' and 'label' of the points.
+    Single points keep their own label, the clusters are labelled with their first point and
+    the number of other points.
+    """
+
+    level = levels[choose_point_level(levels, x_end - x_start, plot_width)]
+    indices = query_points(level, x_start, x_end, y_start, y_end)
+
+    count = level.count[indices]
+    first_labels = np.asarray(labels, dtype=object)[level.first[indices]]
+    label = [name if n == 1 else '%s and %d other %s' % (name, n - 1, unit)
+             for name, n in zip(first_labels.tolist(), count.tolist())]
+
+    return {'x': level.x[indices], 'y': level.y[indices], 'count': count,
+            'size': POINT_SIZE + 2 * np.log2(count), 'label': label}
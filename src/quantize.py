@@ -0,0 +1,201 @@
+import numpy as np
+from bokeh.models import CustomJSExpr
+
+##################################################################
+# Compact encoding of the countries' polygons, as an alternative to the nested lists of
+# floats of buffers_to_patch_coords(), which Bokeh sends as JSON.
+#
+# world_map.py --compact sends the arcs of the countries' topology (see topology.py), so
+# the borders shared by two countries are only sent once. The arcs' coordinates are
+# quantized to COORDINATE_PRECISION decimals and delta-encoded (each one is stored as the
+# difference from the previous vertex of the same arc) into int32 arrays, which go in a
+# ColumnDataSource of their own as a single row of flat arrays. Each country has a parts
+# column, an int32 array giving for every polygon its number of rings followed by the
+# number of arcs of each ring, and the list of its arcs. Bokeh sends numpy arrays as binary
+# buffers (base64 in standalone HTML) instead of JSON, and the browser puts the nested
+# lists multi_polygons needs back together with the CustomJSExpr of
+# make_topology_decoder(), so nothing but the integers ever leaves the server.
+##################################################################
+
+COORDINATE_PRECISION = 4  # decimals kept, 4 is about 10 m at the equator
+MAX_PRECISION = 7  # more decimals overflow the int32 of the longitudes
+
+# rebuilds the nested lists of one coordinate (column) of the arcs source from the parts and
+# the arcs (refs) of the countries, or the arc of every row when lines is true
+DECODE_TOPOLOGY_JS = """
+const arc_values = [];
+if (arcs.data[column].length > 0) {
+    const deltas = arcs.data[column][0];
+    const lengths = arcs.data['lengths'][0];
+    let k = 0;
+    for (let a = 0; a < lengths.length; a++) {
+        const values = new Float64Array(lengths[a]);
+        let value = 0;
+        for (let v = 0; v < lengths[a]; v++) {
+            value += deltas[k++];
+            values[v] = value / scale;
+        }
+        arc_values.push(values);
+    }
+}
+const refs_column = this.data[refs];
+if (lines)
+    return Array.from(refs_column, (ref) => arc_values[ref] === undefined ? [] : Array.from(arc_values[ref]));
+const parts_column = this.data[parts];
+const coords = new Array(parts_column.length);
+for (let i = 0; i < parts_column.length; i++) {
+    const structure = parts_column[i];
+    const ring_refs = refs_column[i];
+    const polygons = [];
+    let k = 0;
+    let j = 0;
+    while (j < structure.length) {
+        const n_rings = structure[j++];
+        const rings = [];
+        for (let r = 0; r < n_rings; r++) {
+            const n_arcs = structure[j++];
+            const ring = [];
+            for (let a = 0; a < n_arcs; a++) {
+                const ref = ring_refs[k++];
+                // the arcs and the countries are replaced one after the other
+                const values = arc_values[ref >= 0 ? ref : ~ref];
+                if (values === undefined)
+                    continue;
+                const skip = a == 0 ? 0 : 1;
+                if (ref >= 0) {
+                    for (let v = skip; v < values.length; v++)
+                        ring.push(values[v]);
+                } else {
+                    for (let v = values.length - 1 - skip; v >= 0; v--)
+                        ring.push(values[v]);
+                }
+            }
+            rings.push(ring);
+        }
+        polygons.push(rings);
+    }
+    coords[i] = polygons;
+}
+return coords;
+"""
+
+
+def quantize(values, precision=COORDINATE_PRECISION):
+    """
+    Rounds coordinates to the given number of decimals, as integers.
+    """
+
+    if not 0 <= precision <= MAX_PRECISION:
+        raise ValueError("The precision must be between 0 and %d decimals." % MAX_PRECISION)
+    return np.round(np.asarray(values, dtype=np.float64) * 10**precision).astype(np.int64)
+
+
+def encode_deltas(values, starts, precision=COORDINATE_PRECISION):
+    """
+    Quantizes and delta-encodes flat coordinates.
+    Input: The coordinates, the index of the first coordinate of every geometry (or arc) and
+    the number of decimals to keep.
+    Returns: The list of every geometry's int32 deltas, the first delta of each one being its
+    first quantized coordinate.
+    """
+
+    quantized = quantize(values, precision)
+    deltas = np.diff(quantized, prepend=0)
+    # every geometry starts from 0 rather than from the last vertex of the previous one
+    firsts = starts[starts < len(quantized)]
+    deltas[firsts] = quantized[firsts]
+    return np.split(deltas.astype(np.int32), starts[1:-1])
+
+
+def encode_parts(ring_sizes, part_offsets, geom_offsets):
+    """
+    Describes the polygons and rings of every geometry.
+    Input: The size of every ring (its number of vertices or arcs) and the part and geometry
+    offsets of the PatchBuffers or Topology.
+    Returns: The list of every geometry's int32 parts array: for every polygon, its number of
+    rings followed by the size of each of them.
+    """
+
+    n_polygons = len(part_offsets) - 1
+    rings_per_polygon = np.diff(part_offsets)
+    polygon_of_ring = np.repeat(np.arange(n_polygons), rings_per_polygon)
+    parts = np.empty(n_polygons + len(ring_sizes), dtype=np.int32)
+    parts[np.arange(n_polygons) + part_offsets[:-1]] = rings_per_polygon
+    parts[polygon_of_ring + 1 + np.arange(len(ring_sizes))] = ring_sizes
+    parts_starts = geom_offsets + part_offsets[geom_offsets]
+    return np.split(parts, parts_starts[1:-1])
+
+
+def encode_topology(topology, precision=COORDINATE_PRECISION):
+    """
+    Encodes the arcs of a Topology (see topology.py).
+    Input: The Topology and the number of decimals to keep.
+    Returns: A tuple of the int32 arrays of the arcs' x deltas and y deltas (one arc after the
+    other, as in the Topology), the arcs' offsets, and the lists of every geometry's parts and
+    arcs (its signed arc references), all int32 arrays.
+    """
+
+    arc_offsets = np.asarray(topology.arc_offsets)
+    arc_ring_offsets = np.asarray(topology.arc_ring_offsets)
+    part_offsets = np.asarray(topology.part_offsets)
+    geom_offsets = np.asarray(topology.geom_offsets)
+
+    geom_starts = arc_ring_offsets[part_offsets[geom_offsets]]
+    arcs = np.split(np.asarray(topology.ring_arcs, dtype=np.int32), geom_starts[1:-1])
+
+    return (np.concatenate(encode_deltas(topology.arc_x, arc_offsets, precision)),
+            np.concatenate(encode_deltas(topology.arc_y, arc_offsets, precision)), arc_offsets,
+            encode_parts(np.diff(arc_ring_offsets), part_offsets, geom_offsets), arcs)
+
+
+def decode_topology_coords(arc_x_deltas, arc_y_deltas, arc_lengths, parts, arcs,
+                           precision=COORDINATE_PRECISION):
+    """
+    Decodes the output of encode_topology() (with the number of coordinates of each arc) back
+    into the nested lists of buffers_to_patch_coords(), like the browser does with
+    DECODE_TOPOLOGY_JS.
+    """
+
+    splits = np.cumsum(arc_lengths)[:-1]
+    coords = []
+    for arc_deltas in (arc_x_deltas, arc_y_deltas):
+        arc_values = [(np.cumsum(deltas, dtype=np.int64) / 10**precision).tolist()
+                      for deltas in np.split(arc_deltas, splits)]
+        decoded = []
+        for structure, refs in zip(parts, arcs):
+            structure, refs = structure.tolist(), refs.tolist()
+            polygons = []
+            k = j = 0
+            while j < len(structure):
+                n_rings = structure[j]
+                j += 1
+                rings = []
+                for n_arcs in structure[j:j + n_rings]:
+                    ring = []
+                    for a, ref in enumerate(refs[k:k + n_arcs]):
+                        values = arc_values[ref] if ref >= 0 else arc_values[~ref][::-1]
+                        ring.extend(values if a == 0 else values[1:])
+                    rings.append(ring)
+                    k += n_arcs
+                j += n_rings
+                polygons.append(rings)
+            decoded.append(polygons)
+        coords.append(decoded)
+
+    return tuple(coords)
+
+
+def make_topology_decoder(arcs, column, parts='parts', refs='arcs', precision=COORDINATE_PRECISION,
+                          lines=False):
+    """
+    Returns the expression rebuilding the patch coordinates from the arcs in the browser, to use
+    as the xs or ys of multi_polygons.
+    Input: The ColumnDataSource of the arcs, whose single row has the coordinate's deltas (from
+    encode_topology()) and the number of coordinates of each arc in a 'lengths' column, the
+    name of the coordinate's column, the names of the countries' parts and arcs columns, and
+    whether the rows are lines, each being the arc given by its refs column (without parts),
+    to use as the xs or ys of multi_line instead.
+    """
+
+    return CustomJSExpr(args={'arcs': arcs, 'column': column, 'parts': parts, 'refs': refs,
+                              'scale': 10**precision, 'lines': lines}, code=DECODE_TOPOLOGY_JS)
@@ -0,0 +1,226 @@
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch, PathPatch
+from matplotlib.path import Path
+
+from create_dataframe import map_chunks
+from lod import choose_level
+from map_cache import find_map_cache, load_map_buffers
+from shared_data import (COLOR_FIELDS, DEFAULT_YEAR, NAN_COLOR, SHAPEFILE, YEAR_FIELDS,
+                         load_countries)
+from year_store import get_year_colors
+
+##################################################################
+# Static images of the map (PNG, SVG...) for every color field and year, without a browser.
+#
+# The countries are drawn with matplotlib from the map cache (see map_cache.py), at the
+# level of detail matching the width of the images. Each process builds the figure and
+# the collection of the countries' paths once, and every image then only changes the
+# collection's face colors, the title and the legend before being saved. The images are
+# split between a pool of processes (see create_dataframe.map_chunks()).
+#
+# Run with, e.g.:
+#   python render.py --years 1960-2019 --format png
+##################################################################
+
+RENDER_DIR = "renders"  # folder the images are written to
+IMAGE_WIDTH = 1300  # pixels
+IMAGE_DPI = 100
+RENDER_CHUNK_SIZE = 8  # images per task sent to the worker processes
+
+# one image: the file to write, its title, the countries' colors and the legend's (colors,
+# labels), drawn at the given level of detail and size
+Frame = namedtuple('Frame', ['path', 'title', 'colors', 'legend', 'level', 'width', 'dpi'])
+
+_renderers = {}  # the figures already built in this process, by level, width and dpi
+
+
+def get_country_paths(buffers, n_countries):
+    """
+    Builds a matplotlib Path of each country's polygons from a PatchBuffers tuple.
+    The exterior rings are made counterclockwise and the holes clockwise, so the holes stay
+    empty whatever the fill rule.
+    Returns: The list of the Paths of the first n_countries geometries.
+    """
+
+    x = np.asarray(buffers.x)
+    y = np.asarray(buffers.y)
+    ring_offsets = np.asarray(buffers.ring_offsets)
+    part_offsets = np.asarray(buffers.part_offsets)
+    geom_offsets = np.asarray(buffers.geom_offsets)
+
+    n_rings = len(ring_offsets) - 1
+    ring_lengths = np.diff(ring_offsets)
+    ring_ids = np.repeat(np.arange(n_rings), ring_lengths)
+
+    # signed areas of the rings (shoelace formula), positive when counterclockwise
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    same_ring = ring_ids[:-1] == ring_ids[1:]
+    areas = np.bincount(ring_ids[:-1][same_ring], weights=cross[same_ring], minlength=n_rings)
+
+    exterior = np.zeros(n_rings, dtype=bool)
+    exterior[part_offsets[:-1][np.diff(part_offsets) > 0]] = True
+    flip = np.where(exterior, areas < 0, areas > 0)
+
+    index = np.arange(len(x))
+    flipped = flip[ring_ids]
+    starts, ends = ring_offsets[:-1][ring_ids], ring_offsets[1:][ring_ids]
+    index[flipped] = (starts + ends - 1 - index)[flipped]
+    vertices = np.column_stack((x[index], y[index]))
+
+    codes = np.full(len(x), Path.LINETO, dtype=Path.code_type)
+    codes[ring_offsets[:-1][ring_lengths > 0]] = Path.MOVETO
+    codes[ring_offsets[1:][ring_lengths > 0] - 1] = Path.CLOSEPOLY
+
+    geom_starts = ring_offsets[part_offsets[geom_offsets]][1:-1]
+    return [Path(geom_vertices, geom_codes) for geom_vertices, geom_codes
+            in zip(np.split(vertices, geom_starts), np.split(codes, geom_starts))][:n_countries]
+
+
+def get_renderer(level, width=IMAGE_WIDTH, dpi=IMAGE_DPI):
+    """
+    Builds the figure drawing the countries at a level of detail, the first time it's called
+    in a process for that level and size.
+    Returns: A tuple of the Figure and the PatchCollection of the countries.
+    """
+
+    key = (level, width, dpi)
+    if key not in _renderers:
+        levels, missing, _ = load_map_buffers(find_map_cache(SHAPEFILE))
+        # the countries with a polygon, the first rows of the cache (see shared_data.py)
+        paths = get_country_paths(levels[level], int(np.count_nonzero(~np.asarray(missing))))
+
+        # width / height = 1.7647, like the map of world_map.py
+        figure = Figure(figsize=(width / dpi, width / 1.7647 / dpi), dpi=dpi)
+        axes = figure.add_axes([0, 0, 1, 0.94])
+        axes.set_axis_off()
+        axes.set_xlim(-180, 180)
+        axes.set_ylim(-90, 90)
+        axes.set_aspect('auto')
+        collection = PatchCollection([PathPatch(path) for path in paths], edgecolor='black',
+                                     linewidth=0.2)
+        axes.add_collection(collection)
+        _renderers[key] = (figure, collection)
+
+    return _renderers[key]
+
+
+def render_frames(frames):
+    """
+    Draws and saves a list of Frames, reusing the figure of their level of detail and size.
+    Returns: The list of the paths of the images written.
+    """
+
+    for frame in frames:
+        figure, collection = get_renderer(frame.level, frame.width, frame.dpi)
+        collection.set_facecolor(frame.colors)
+        figure.suptitle(frame.title)
+
+        colors, labels = frame.legend
+        for legend in figure.legends:
+            legend.remove()
+        figure.legend(handles=[Patch(facecolor=color, edgecolor='black', label=label)
+                               for color, label in zip(colors, labels)],
+                      loc='lower left', fontsize='small', title=frame.title.split(',')[0])
+        figure.savefig(frame.path)
+
+    return [frame.path for frame in frames]
+
+
+def get_frame_name(field, year=None):
+    """
+    Returns the file name (without extension) of the image of a field and year.
+    """
+
+    name = field.lower().replace(' ', '_')
+    return name if year is None else '%s_%d' % (name, year)
+
+
+def create_frames(fields=COLOR_FIELDS, years=(DEFAULT_YEAR,), file_format='png',
+                  width=IMAGE_WIDTH, dpi=IMAGE_DPI, out_dir=RENDER_DIR):
+    """
+    Computes the colors of every image to render.
+    Input: The color fields, the years (only used by the YEAR_FIELDS, the other fields are
+    drawn once), the image format (any matplotlib can save), the width of the images in pixels,
+    their resolution and the folder to write them in.
+    Returns: The list of Frames.
+    """
+
+    _, field_colors, field_legends, year_store, year_classes = load_countries()
+    # the coarsest level of detail whose tolerance is under a pixel of the image
+    level = choose_level(360, width)
+
+    frames = []
+    for field in fields:
+        if field not in YEAR_FIELDS:
+            frames.append(Frame(os.path.join(out_dir, get_frame_name(field) + '.' + file_format),
+                                field, field_colors[field].tolist(), field_legends[field], level,
+                                width, dpi))
+            continue
+
+        for year in years:
+            year_index = np.searchsorted(year_store.years, year)
+            if year_index == len(year_store.years) or year_store.years[year_index] != year:
+                raise ValueError("No population data for %d." % year)
+            colors = get_year_colors(year_classes[field], field_legends[field][0], NAN_COLOR,
+                                     year_index)
+            frames.append(Frame(
+                os.path.join(out_dir, get_frame_name(field, year) + '.' + file_format),
+                '%s, %d' % (field, year), colors.tolist(), field_legends[field], level, width, dpi))
+
+    return frames
+
+
+def render(frames, workers=None):
+    """
+    Renders Frames in a pool of processes (all the CPUs by default, in this process with
+    workers=1), creating the folders of the images.
+    Returns: The list of the paths of the images written.
+    """
+
+    for folder in {os.path.dirname(frame.path) for frame in frames}:
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    return sum(map_chunks(render_frames, frames, workers, RENDER_CHUNK_SIZE), [])
+
+
+def parse_years(text):
+    """
+    Parses a list of years, e.g. '1990,2000-2019'.
+    Returns: The list of years.
+    """
+
+    years = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            years.extend(range(int(first), int(last) + 1))
+        else:
+            years.append(int(part))
+    return years
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render images of the map for every field and year.")
+    parser.add_argument('--fields', nargs='+', choices=COLOR_FIELDS, default=COLOR_FIELDS)
+    parser.add_argument('--years', type=parse_years, default=[DEFAULT_YEAR],
+                        help="years of the population fields, e.g. 1990,2000-2019")
+    parser.add_argument('--format', default='png', help="image format, e.g. png or svg")
+    parser.add_argument('--width', type=int, default=IMAGE_WIDTH, help="width in pixels")
+    parser.add_argument('--dpi', type=int, default=IMAGE_DPI)
+    parser.add_argument('--out', default=RENDER_DIR, help="folder to write the images in")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes to use (all the CPUs by default)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frames = create_frames(args.fields, args.years, args.format, args.width, args.dpi, args.out)
+    paths = render(frames, args.workers)
+    print('Rendered %d images in %s in %.2f s' % (len(paths), args.out, time.perf_counter() - start))
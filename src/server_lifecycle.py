@@ -0,0 +1,25 @@
+import time
+
+from shared_data import load_shared_data
+from country_details import load_details_table
+
+##################################################################
+# Server hooks of the Bokeh directory app (see main.py).
+#
+# The shared data is loaded as soon as a server process starts instead of during its
+# first session. With `bokeh serve --num-procs N .` every worker process loads its own
+# copy after being forked, but the polygons are memory-mapped from map_cache/, so the
+# workers all share the same pages of memory for them.
+##################################################################
+
+
+def on_server_loaded(server_context):
+    """
+    Loads the data shared by every session of the map, and the data sets of the countries'
+    details.
+    """
+
+    start = time.perf_counter()
+    load_shared_data()
+    load_details_table()
+    print('Loaded the shared map data in %.2f s' % (time.perf_counter() - start))
@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from bokeh.palettes import Category10
+
+from create_dataframe import find_final_dataset
+from classify import get_breaks, get_labels, get_class_colors, get_column_classes, get_category_classes
+from countries import get_iso3_codes, load_dataset
+from map_cache import load_map_buffers, load_lod_levels, load_spatial_index, load_map_topologies, find_map_cache
+from quantize import encode_topology
+from point_layers import build_point_levels
+from year_store import build_year_store, classify_years, get_year_colors
+
+##################################################################
+# The data world_map.py plots, loaded once per server process and shared by all its
+# sessions.
+#
+# Everything here is read-only: sessions only build their glyphs from it, so a new
+# session doesn't read any file or compute anything. The geometry itself comes from the
+# memory-mapped cache of map_cache.py, whose pages are also shared by every worker
+# process when the server runs with --num-procs.
+##################################################################
+
+SHAPEFILE = find_final_dataset()  # the Parquet or Feather file when there is one
+CAPITALS_FILE = "../database/df_capitals.csv"
+
+# population density ranges:
+#   0 - 10      0
+#   10 - 25     1
+#   25 - 50     2
+#   50 - 75     3
+#   75 - 100    4
+#   100 - 150   5
+#   150 - 300   6
+#   300 - 1000  7
+#   1000+       8
+DENSITY_BREAKS = [10, 25, 50, 75, 100, 150, 300, 1000]
+DENSITY_PALETTE = ['#f7f4f9', '#e7e1ef', '#d4b9da', '#c994c7',
+                   '#df65b0', '#e7298a', '#ce1256', '#980043', '#67001f']
+# DENSITY_PALETTE = ['#fcfbfd','#efedf5','#dadaeb','#bcbddc','#9e9ac8','#807dba','#6a51a3','#54278f','#3f007d']
+
+# fields the countries can be colored by
+COLOR_FIELDS = ['Population density', 'Population', 'Government type']
+NAN_COLOR = 'gray'  # color of countries with no data for the field
+# fields which have a value for every year, and their matrix in the YearStore (see year_store.py)
+YEAR_FIELDS = {'Population density': 'density', 'Population': 'population'}
+DEFAULT_YEAR = 2019  # year shown when a session starts
+
+_shared = {}  # the shared data, once loaded
+
+
+def get_field_classes(df_countries, field):
+    """
+    Finds the class of each country for one of the COLOR_FIELDS.
+    Returns: A tuple of the array of each country's class (-1 for no data), the list of the
+    classes' colors and the list of their legend labels.
+    """
+
+    if field == 'Population density':
+        return get_column_classes(df_countries, 'pop_density', DENSITY_PALETTE,
+                                  scheme='manual', breaks=DENSITY_BREAKS)
+    elif field == 'Population':
+        return get_column_classes(df_countries, '2019', DENSITY_PALETTE, scheme='quantile')
+    elif field == 'Government type':
+        return get_category_classes(df_countries, 'gov_type', Category10[10], min_count=2)
+
+
+def get_year_field_breaks(year_store, field):
+    """
+    Finds the class breaks of one of the YEAR_FIELDS, which are the same for every year.
+    """
+
+    if field == 'Population density':
+        return np.asarray(DENSITY_BREAKS, dtype=np.float64)
+    elif field == 'Population':
+        year_index = np.searchsorted(year_store.years, DEFAULT_YEAR)
+        return get_breaks(year_store.population[:, year_index], 'quantile', len(DENSITY_PALETTE))
+
+
+def load_countries():
+    """
+    Loads the countries and computes their color for each of the COLOR_FIELDS.
+    Returns: A tuple of the DataFrame of the countries (without their polygons), the dictionary
+    of each field's colors (in DEFAULT_YEAR for the YEAR_FIELDS), the dictionary of each field's
+    (class colors, class labels), the YearStore of the countries and the dictionary of the
+    class matrix of each of the YEAR_FIELDS.
+    """
+
+    # compiled once from the final data set (see map_cache.py)
+    # the countries without a polygon (e.g. the World Bank's regions) aren't shown, they're the
+    # last rows of the cache
+    _, missing, attributes = load_map_buffers(find_map_cache(SHAPEFILE))
+    countries = attributes[~np.asarray(missing)].copy()
+
+    # join the other data sets on the countries' ISO3 codes, see countries.py
+    countries_iso3, _ = get_iso3_codes(countries['NAME_EN'])
+    df_governments, _ = load_dataset('governments')
+    gov_types = countries_iso3.map(
+        df_governments.drop_duplicates('ISO3').set_index('ISO3')['gov_edit'].str.strip())
+
+    # every year's population of the countries, for the year slider, joined on the ISO3 codes
+    # rather than on the final data set's World Bank codes, which many countries (e.g. France)
+    # are missing
+    year_store = build_year_store(countries_iso3, countries['area'])
+    year_index = np.searchsorted(year_store.years, DEFAULT_YEAR)
+
+    # the color of every country for each field, computed up front so switching fields (or
+    # years) only has to send the new colors
+    field_colors = {}
+    field_legends = {}
+    year_classes = {}
+    for field in COLOR_FIELDS:
+        if field in YEAR_FIELDS:
+            breaks = get_year_field_breaks(year_store, field)
+            labels = get_labels(breaks)
+            colors = get_class_colors(DENSITY_PALETTE, len(labels))
+            year_classes[field] = classify_years(getattr(year_store, YEAR_FIELDS[field]), breaks)
+            field_colors[field] = get_year_colors(year_classes[field], colors, NAN_COLOR, year_index)
+        else:
+            classes, colors, labels = get_field_classes(
+                countries.assign(gov_type=gov_types), field)
+            field_colors[field] = np.array(colors + [NAN_COLOR], dtype=object)[classes]
+        field_legends[field] = (colors, labels)
+
+    return (countries, field_colors, field_legends, year_store, year_classes)
+
+
+def load_shared_data():
+    """
+    Loads everything the sessions of world_map.py need, the first time it's called.
+    Returns: A dictionary with:
+        'countries': the DataFrame of the countries' attributes,
+        'countries_columns': the same as a dictionary of arrays, ready for a ColumnDataSource,
+        'field_colors', 'field_legends': the countries' colors and legend of each color field,
+        'year_store', 'year_classes': every year's population of the countries and their
+            classes for each of the YEAR_FIELDS (see year_store.py),
+        'lod_levels': the countries' polygons at each level of detail (see lod.py), as
+            memory-mapped buffers (see map_cache.load_lod_levels()),
+        'spatial_index': the spatial index of the countries (see spatial_index.py),
+        'capital_levels', 'capital_labels': the capitals binned for every zoom level and the
+            label of each capital (see point_layers.py).
+    None of it may be modified.
+    """
+
+    if 'data' not in _shared:
+        countries, field_colors, field_legends, year_store, year_classes = load_countries()
+        df_capitals = pd.read_csv(CAPITALS_FILE)
+
+        _shared['data'] = {
+            'countries': countries,
+            'countries_columns': {name: countries[name].to_numpy() for name in countries.columns},
+            'field_colors': field_colors,
+            'field_legends': field_legends,
+            'year_store': year_store,
+            'year_classes': year_classes,
+            'lod_levels': load_lod_levels(SHAPEFILE),
+            'spatial_index': load_spatial_index(SHAPEFILE),
+            'capital_levels': build_point_levels(df_capitals['CapitalLongitude'],
+                                                 df_capitals['CapitalLatitude']),
+            'capital_labels': (df_capitals['CapitalName_x'] + ', ' +
+                               df_capitals['Country/Region']).to_numpy(),
+        }
+
+    return _shared['data']
+
+
+def load_compact_levels(precision):
+    """
+    Encodes the topology of the countries' polygons at each level of detail with quantize.py,
+    the first time it's called for a precision.
+    Returns: A list with, for each level, a tuple of the arcs' x deltas, y deltas and offsets
+    and of the countries' parts and arcs (see encode_topology()).
+    """
+
+    key = ('compact', precision)
+    if key not in _shared:
+        topologies = load_map_topologies(find_map_cache(SHAPEFILE))
+        _shared[key] = [encode_topology(topology, precision) for topology in topologies]
+
+    return _shared[key]
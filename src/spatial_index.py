@@ -0,0 +1,50 @@
+import numpy as np
+import shapely
+
+##################################################################
+# Spatial index of the country polygons, to find which country is at a given point.
+#
+# The polygons are put in an STRtree (a tree of their bounding boxes), so a lookup only
+# tests the handful of polygons whose bounding box contains the point instead of every
+# country.
+##################################################################
+
+
+def build_spatial_index(geometries):
+    """
+    Builds the spatial index of a sequence of geometries.
+    Returns: The STRtree of the geometries. Missing and empty geometries are never matched.
+    """
+
+    geometries = np.asarray(geometries, dtype=object)
+    # prepared geometries make the point-in-polygon tests of countries_at() much faster
+    shapely.prepare(geometries)
+    return shapely.STRtree(geometries)
+
+
+def countries_at(tree, lons, lats):
+    """
+    Finds the country at each of a set of points.
+    Input: The spatial index and the longitudes and latitudes of the points.
+    Returns: An integer array with the index (in the geometries the tree was built from) of the
+    country containing each point, or -1 for points outside every country. A point on a border
+    gets the country with the lowest index.
+    """
+
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    points = shapely.points(lons, lats)
+
+    # candidates from the bounding boxes, then the exact test on the (prepared) polygons only
+    point_index, country_index = tree.query(points)
+    hits = shapely.intersects_xy(tree.geometries[country_index], lons[point_index], lats[point_index])
+    point_index, country_index = point_index[hits], country_index[hits]
+
+    # sort by point, then by country, and keep the first country found for each point
+    order = np.lexsort((country_index, point_index))
+    point_index, country_index = point_index[order], country_index[order]
+    found = np.full(len(points), -1, dtype=np.int64)
+    first = np.unique(point_index, return_index=True)[1]
+    found[point_index[first]] = country_index[first]
+
+    return found
@@ -0,0 +1,201 @@
+import argparse
+import cProfile
+import functools
+import json
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+##################################################################
+# Opt-in timing of world_map.py's sessions and callbacks.
+#
+# Set the WORLD_MAP_TELEMETRY environment variable to the path of a log file to enable it:
+#   WORLD_MAP_TELEMETRY=telemetry.log bokeh serve --show world_map.py
+# Every span (loading the shared data, creating a session, each callback...) is then
+# appended to the log as a line of JSON with its duration, the session, the process and
+# its memory, and the size of every new session's document is logged too. Summarize the
+# log with:
+#   python telemetry.py telemetry.log
+#
+# While enabled, sending SIGUSR1 to a server process starts profiling it with cProfile,
+# and sending it again writes the profile to PROFILE_DIR (readable by pstats, snakeviz or
+# flameprof, to draw flame graphs):
+#   kill -USR1 <pid>
+#
+# When it's disabled, span() does nothing and timed() returns the callbacks unchanged.
+##################################################################
+
+TELEMETRY_VARIABLE = 'WORLD_MAP_TELEMETRY'  # environment variable with the path of the log
+PROFILE_DIR = "profiles"  # folder the profiles are written to
+
+_state = {'log_file': None, 'profiler': None}
+_lock = threading.Lock()
+
+
+def enable(log_file):
+    """
+    Starts logging the spans to the given file, and profiling on SIGUSR1.
+    """
+
+    _state['log_file'] = log_file
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, toggle_profiler)
+
+
+def is_enabled():
+    return _state['log_file'] is not None
+
+
+def get_memory():
+    """
+    Returns the memory used by the process in MB (its peak memory where the current one is
+    unknown).
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def write_record(record):
+    """
+    Appends a record to the log, with the time, process and memory.
+    """
+
+    record = dict(record, time=time.time(), pid=os.getpid(), memory_mb=round(get_memory(), 1))
+    line = json.dumps(record, default=str)
+    with _lock, open(_state['log_file'], 'a') as f:
+        f.write(line + '\n')
+
+
+@contextmanager
+def span(name, session=None, **fields):
+    """
+    Times the code in a with block and logs it under the given name, if telemetry is enabled.
+    Input: The name of the span, the id of the session it belongs to and any other fields to
+    log with it.
+    """
+
+    if not is_enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        write_record(dict(fields, span=name, session=session,
+                          seconds=time.perf_counter() - start))
+
+
+def timed(function, session=None):
+    """
+    Wraps a callback so every call of it is logged as a span named after it, if telemetry is
+    enabled. The wrapper keeps the callback's signature, which Bokeh checks.
+    """
+
+    if not is_enabled():
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__, session):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def get_session_id(doc):
+    """
+    Returns the id of the session of a Bokeh document, or None outside of bokeh serve.
+    """
+
+    context = doc.session_context
+    return context.id if context is not None else None
+
+
+def log_document_size(doc, session=None):
+    """
+    Logs the size of a document serialized to JSON, as sent to the browser, if telemetry is
+    enabled.
+    """
+
+    if is_enabled():
+        size = len(json.dumps(doc.to_json(), separators=(',', ':'), default=str))
+        write_record({'span': 'document_size', 'session': session, 'bytes': size})
+
+
+def toggle_profiler(signum=None, frame=None):
+    """
+    Starts profiling the process, or if it's already being profiled, stops and writes the
+    profile to PROFILE_DIR.
+    Returns: The path of the profile written, or None when profiling started.
+    """
+
+    if _state['profiler'] is None:
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+        return None
+
+    profiler, _state['profiler'] = _state['profiler'], None
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, 'world_map-%d-%d.prof' % (os.getpid(), time.time()))
+    profiler.dump_stats(path)
+    if is_enabled():
+        write_record({'span': 'profile', 'path': path})
+    return path
+
+
+def summarize(log_file):
+    """
+    Summarizes a telemetry log.
+    Returns: A list of (span, count, mean, 95th percentile, max) tuples, in seconds, sorted by
+    total time, and the list of the document sizes in bytes.
+    """
+
+    durations = {}
+    sizes = []
+    with open(log_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if 'seconds' in record:
+                durations.setdefault(record['span'], []).append(record['seconds'])
+            elif record['span'] == 'document_size':
+                sizes.append(record['bytes'])
+
+    summary = []
+    for name, seconds in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        seconds = np.array(seconds)
+        summary.append((name, len(seconds), seconds.mean(), np.percentile(seconds, 95),
+                        seconds.max()))
+
+    return (summary, sizes)
+
+
+if os.environ.get(TELEMETRY_VARIABLE):
+    enable(os.environ[TELEMETRY_VARIABLE])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize a telemetry log of world_map.py.")
+    parser.add_argument('log_file')
+    args = parser.parse_args()
+
+    summary, sizes = summarize(args.log_file)
+    print('%-30s %7s %10s %10s %10s' % ('span', 'count', 'mean ms', 'p95 ms', 'max ms'))
+    for name, count, mean, p95, longest in summary:
+        print('%-30s %7d %10.1f %10.1f %10.1f' % (name, count, mean * 1000, p95 * 1000,
+                                                   longest * 1000))
+    if sizes:
+        print('\ndocument sizes: mean %d B, max %d B over %d sessions' % (
+            np.mean(sizes), max(sizes), len(sizes)))
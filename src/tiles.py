@@ -0,0 +1,382 @@
+import argparse
+import functools
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from create_dataframe import FINAL_FILE, PatchBuffers, buffers_to_geometries, get_patch_buffers, find_final_dataset
+from lod import simplify_coverage
+from map_cache import find_map_cache, load_map_buffers
+
+##################################################################
+# Static vector tiles of the final data set.
+#
+# export_tiles() cuts the country polygons into a pyramid of tiles: at zoom z the world
+# (longitudes -180 to 180, latitudes -90 to 90) is split into 2^(z+1) x 2^z square tiles,
+# numbered from the bottom left. Each tile holds the countries' polygons simplified for
+# that zoom and clipped to the tile, with their coordinates quantized to a
+# TILE_EXTENT x TILE_EXTENT grid. The tiles are written to <folder>/<z>/<x>/<y>.bin, so
+# a viewer only has to read the few tiles it shows.
+#
+# Tile format: every number is an unsigned varint (7 bits per byte, high bit set when
+# more bytes follow), starting with the magic bytes b'WMT2' and the number of features.
+# Each feature is its country's row in the final data set, its number of parts, and for each part its number of rings; each ring is its number of
+# points followed by the zigzag encoded x, y deltas from the previous point (the first
+# point is relative to the tile's bottom left corner).
+##################################################################
+
+TILES_DIR = "tiles"  # folder the tiles are written to
+TILE_ZOOMS = range(5)  # zoom levels of the pyramid
+TILE_EXTENT = 4096  # size of the grid the coordinates are quantized to
+TILE_PIXELS = 512  # the tiles are simplified to look right when shown this many pixels wide
+MAGIC = b'WMT2'  # b'WMT1' tiles also had the countries' borders, as lines
+
+
+def get_tile_size(zoom):
+    """
+    Returns the width (and height) in degrees of the tiles at a zoom level.
+    """
+
+    return 180 / 2 ** zoom
+
+
+def get_tile_bounds(zoom, x, y):
+    """
+    Returns the (minx, miny, maxx, maxy) of a tile in degrees.
+    """
+
+    size = get_tile_size(zoom)
+    return (-180 + x * size, -90 + y * size, -180 + (x + 1) * size, -90 + (y + 1) * size)
+
+
+def choose_zoom(x_span, plot_width, zooms=TILE_ZOOMS):
+    """
+    Picks the zoom level whose tiles are closest to TILE_PIXELS wide on screen.
+    Input: The width of the visible x range (in degrees) and of the plot (in pixels).
+    """
+
+    degrees_per_pixel = x_span / max(plot_width, 1)
+    zoom = int(round(np.log2(180 / (TILE_PIXELS * degrees_per_pixel))))
+    return min(max(zoom, min(zooms)), max(zooms))
+
+
+def get_visible_tiles(zoom, x_start, x_end, y_start, y_end):
+    """
+    Returns the list of (x, y) of the tiles of a zoom level overlapping the visible area.
+    """
+
+    size = get_tile_size(zoom)
+    columns, rows = 2 ** (zoom + 1), 2 ** zoom
+    x0, x1 = [int(np.clip(np.floor((x + 180) / size), 0, columns - 1)) for x in (x_start, x_end)]
+    y0, y1 = [int(np.clip(np.floor((y + 90) / size), 0, rows - 1)) for y in (y_start, y_end)]
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def on_tile_edges(zoom, x, y):
+    """
+    Returns whether each point of the x and y coordinate arrays is on the edge of a tile of a
+    zoom level. The decoded coordinates of the tiles' edges are exact, since the tiles' size and
+    grid are powers of 2 of the world's.
+    """
+
+    size = get_tile_size(zoom)
+    return ((np.asarray(x) + 180) % size == 0) | ((np.asarray(y) + 90) % size == 0)
+
+
+def get_tile_edge_arcs(topology, zoom):
+    """
+    Finds the arcs of the clipped polygons of tiles that are only a piece of a tile's edge,
+    where a polygon was cut rather than one of its borders.
+    Input: The Topology of the tiles' polygons, cut at the tiles' edges (see on_tile_edges()),
+    and the tiles' zoom level.
+    Returns: A boolean array, True for the arcs that are on an edge.
+    """
+
+    arc_offsets = np.asarray(topology.arc_offsets)
+    arc_x, arc_y = np.asarray(topology.arc_x), np.asarray(topology.arc_y)
+    firsts, lasts = arc_offsets[:-1], arc_offsets[1:] - 1
+    two_points = lasts - firsts == 1
+    size = get_tile_size(zoom)
+    vertical = (arc_x[firsts] == arc_x[lasts]) & ((arc_x[firsts] + 180) % size == 0)
+    horizontal = (arc_y[firsts] == arc_y[lasts]) & ((arc_y[firsts] + 90) % size == 0)
+    return two_points & (vertical | horizontal)
+
+
+#################################################
+# Encoding
+#################################################
+def encode_varints(values):
+    """
+    Encodes an array of non-negative integers as varints, without looping over the values.
+    Returns: The encoded bytes.
+    """
+
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for bits in range(7, 64, 7):
+        n_bytes += values >= (np.uint64(1) << np.uint64(bits))
+
+    starts = np.concatenate(([0], np.cumsum(n_bytes)[:-1]))
+    out = np.zeros(n_bytes.sum(), dtype=np.uint8)
+    for k in range(int(n_bytes.max(initial=0))):
+        has_byte = n_bytes > k
+        byte = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(n_bytes[has_byte] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[has_byte] + k] = byte
+
+    return out.tobytes()
+
+
+def decode_varints(data):
+    """
+    Decodes a byte string of varints, without looping over the values.
+    Returns: An int64 array of the values.
+    """
+
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    values = (data & 0x7f).astype(np.int64) << shifts
+    return np.bitwise_or.reduceat(values, starts)
+
+
+def zigzag(values):
+    """
+    Maps signed integers to non-negative ones (0, -1, 1, -2... to 0, 1, 2, 3...).
+    """
+
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def unzigzag(values):
+    """
+    Reverses zigzag().
+    """
+
+    return (values >> 1) ^ -(values & 1)
+
+
+def keep_parts(geometries, types):
+    """
+    Removes the parts that aren't of the given geometry types from each geometry, as clipping
+    can return collections mixing polygons, lines and points.
+    Returns: An array with, for each geometry, the list of its parts of the given types.
+    """
+
+    parts, owners = shapely.get_parts(geometries, return_index=True)
+    keep = np.isin(shapely.get_type_id(parts), types)
+    kept = [[] for _ in range(len(geometries))]
+    for part, owner in zip(parts[keep], owners[keep].tolist()):
+        kept[owner].append(part)
+    return kept
+
+
+def get_fill_buffers(polygons):
+    """
+    Same as get_patch_buffers(), but the polygons of geometry collections are kept too.
+    """
+
+    polygons = np.asarray(polygons, dtype=object).copy()
+    collections = shapely.get_type_id(polygons) == shapely.GeometryType.GEOMETRYCOLLECTION
+    if collections.any():
+        kept = keep_parts(polygons[collections], [shapely.GeometryType.POLYGON])
+        polygons[collections] = [shapely.MultiPolygon(parts) for parts in kept]
+    return get_patch_buffers(polygons)
+
+
+def encode_tile(ids, buffers, bounds):
+    """
+    Encodes the features of a tile.
+    Input: The array of the features' ids, the PatchBuffers of their polygons and the bounds of
+    the tile.
+    Returns: The encoded tile as bytes.
+    """
+
+    minx, miny, maxx, maxy = bounds
+    x, y, ring_offsets, part_offsets, geom_offsets = buffers
+    qx = np.round((x - minx) / (maxx - minx) * TILE_EXTENT).astype(np.int64)
+    qy = np.round((y - miny) / (maxy - miny) * TILE_EXTENT).astype(np.int64)
+
+    # delta from the previous point of the ring, the first point being relative to 0
+    dx = np.diff(qx, prepend=0)
+    dy = np.diff(qy, prepend=0)
+    first = ring_offsets[:-1][np.diff(ring_offsets) > 0]
+    dx[first] = qx[first]
+    dy[first] = qy[first]
+    deltas = zigzag(np.column_stack((dx, dy)).ravel())
+
+    numbers = []
+    n_features = 0
+    for g in range(len(ids)):
+        if geom_offsets[g + 1] == geom_offsets[g]:
+            continue
+        n_features += 1
+        numbers.append([ids[g], geom_offsets[g + 1] - geom_offsets[g]])
+        for p in range(geom_offsets[g], geom_offsets[g + 1]):
+            numbers.append([part_offsets[p + 1] - part_offsets[p]])
+            for r in range(part_offsets[p], part_offsets[p + 1]):
+                numbers.append([ring_offsets[r + 1] - ring_offsets[r]])
+                numbers.append(deltas[2 * ring_offsets[r]:2 * ring_offsets[r + 1]])
+
+    numbers.insert(0, [n_features])
+    return MAGIC + encode_varints(np.concatenate(numbers))
+
+
+def decode_tile(data, bounds):
+    """
+    Decodes a tile.
+    Input: The encoded tile and its bounds.
+    Returns: A tuple of the array of the features' ids and the PatchBuffers of their polygons
+    (in degrees), one geometry per feature.
+    """
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a world map tile.")
+
+    minx, miny, maxx, maxy = bounds
+    numbers = decode_varints(data[len(MAGIC):])
+    values = numbers.tolist()
+
+    # walk the features' structure, the coordinates are decoded all at once afterwards
+    ids, parts_per_geom, rings_per_part, ring_sizes, ring_starts = [], [], [], [], []
+    i = 1
+    for _ in range(values[0]):
+        feature_id, n_parts = values[i:i + 2]
+        i += 2
+        ids.append(feature_id)
+        parts_per_geom.append(n_parts)
+        for _ in range(n_parts):
+            rings_per_part.append(values[i])
+            i += 1
+            for _ in range(rings_per_part[-1]):
+                ring_sizes.append(values[i])
+                ring_starts.append(i + 1)
+                i += 1 + 2 * values[i]
+
+    ring_offsets, part_offsets, geom_offsets = [
+        np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        for counts in (ring_sizes, rings_per_part, parts_per_geom)]
+    ring_sizes = np.asarray(ring_sizes, dtype=np.int64)
+
+    # every point's x and y deltas, then their sums within each ring
+    positions = np.arange(ring_offsets[-1]) - np.repeat(ring_offsets[:-1], ring_sizes)
+    index = np.repeat(np.asarray(ring_starts, dtype=np.int64), ring_sizes) + 2 * positions
+    deltas = unzigzag(np.column_stack((numbers[index], numbers[index + 1])))
+    coords = np.cumsum(deltas, axis=0)
+    nonempty = ring_sizes > 0
+    before = np.zeros((len(ring_sizes), 2), dtype=np.int64)
+    before[nonempty] = coords[ring_offsets[:-1][nonempty]] - deltas[ring_offsets[:-1][nonempty]]
+    coords -= np.repeat(before, ring_sizes, axis=0)
+
+    x = minx + coords[:, 0] * ((maxx - minx) / TILE_EXTENT)
+    y = miny + coords[:, 1] * ((maxy - miny) / TILE_EXTENT)
+    return (np.asarray(ids, dtype=np.int64),
+            PatchBuffers(x, y, ring_offsets, part_offsets, geom_offsets))
+
+
+def merge_tiles(tiles):
+    """
+    Puts the features of several tiles together.
+    Input: The list of the decoded tiles (see decode_tile()).
+    Returns: A tuple of the array of the features' ids and the PatchBuffers of all of them, a
+    feature being in it once for every tile it's in.
+    """
+
+    ids, x, y, ring_offsets, part_offsets, geom_offsets = [], [], [], [[0]], [[0]], [[0]]
+    n_coords = n_rings = n_parts = 0  # totals of the tiles before, which their offsets start at
+    for tile_ids, buffers in tiles:
+        ids.append(tile_ids)
+        x.append(buffers.x)
+        y.append(buffers.y)
+        ring_offsets.append(buffers.ring_offsets[1:] + n_coords)
+        part_offsets.append(buffers.part_offsets[1:] + n_rings)
+        geom_offsets.append(buffers.geom_offsets[1:] + n_parts)
+        n_coords += buffers.ring_offsets[-1]
+        n_rings += buffers.part_offsets[-1]
+        n_parts += buffers.geom_offsets[-1]
+
+    return (np.concatenate(ids + [np.empty(0, dtype=np.int64)]),
+            PatchBuffers(np.concatenate(x + [np.empty(0)]), np.concatenate(y + [np.empty(0)]),
+                         *[np.concatenate(offsets).astype(np.int64)
+                           for offsets in (ring_offsets, part_offsets, geom_offsets)]))
+
+
+#################################################
+# Export
+#################################################
+def get_tile_path(tiles_dir, zoom, x, y):
+    return os.path.join(tiles_dir, str(zoom), str(x), '%d.bin' % y)
+
+
+def export_tiles(geometries=None, tiles_dir=TILES_DIR, zooms=TILE_ZOOMS):
+    """
+    Writes the vector tile pyramid of the final data set.
+    Input: The countries' geometries, in the order of the rows of the map cache (those of the
+    map cache of the final data set if not given), the folder to write the tiles in and the
+    zoom levels to create.
+    Returns: The number of tiles written. Tiles without any country aren't written.
+    """
+
+    if geometries is None:
+        # the features' ids are the rows of world_map.py's countries, which are those of the
+        # cache rather than of the final data set (see map_cache.py)
+        levels, _, _ = load_map_buffers(find_map_cache(find_final_dataset()))
+        geometries = buffers_to_geometries(levels[0])
+    geometries = np.asarray(geometries, dtype=object)
+
+    n_tiles = 0
+    for zoom in zooms:
+        size = get_tile_size(zoom)
+        simplified = simplify_coverage(geometries, size / TILE_PIXELS)
+        tree = shapely.STRtree(simplified)
+
+        for x in range(2 ** (zoom + 1)):
+            for y in range(2 ** zoom):
+                bounds = get_tile_bounds(zoom, x, y)
+                ids = np.sort(tree.query(shapely.box(*bounds)))
+                if len(ids) == 0:
+                    continue
+
+                fills = get_fill_buffers(shapely.clip_by_rect(simplified[ids], *bounds))
+
+                path = get_tile_path(tiles_dir, zoom, x, y)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(encode_tile(ids, fills, bounds))
+                n_tiles += 1
+
+    with open(os.path.join(tiles_dir, 'metadata.json'), 'w') as f:
+        json.dump({'zooms': list(zooms), 'extent': TILE_EXTENT, 'pixels': TILE_PIXELS,
+                   'n_features': len(geometries)}, f)
+
+    return n_tiles
+
+
+@functools.lru_cache(maxsize=1024)
+def read_tile(tiles_dir, zoom, x, y):
+    """
+    Reads and decodes a tile. Decoded tiles are kept in memory, shared by every session.
+    Returns: The tile's features (see decode_tile()), None if the tile doesn't exist.
+    """
+
+    path = get_tile_path(tiles_dir, zoom, x, y)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return decode_tile(f.read(), get_tile_bounds(zoom, x, y))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the vector tiles of " + FINAL_FILE + ".")
+    parser.add_argument('--tiles-dir', default=TILES_DIR)
+    parser.add_argument('--max-zoom', type=int, default=max(TILE_ZOOMS))
+    args = parser.parse_args()
+    print(export_tiles(tiles_dir=args.tiles_dir, zooms=range(args.max_zoom + 1)), "tiles written")
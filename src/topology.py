@@ -0,0 +1,273 @@
+from collections import namedtuple
+
+import numpy as np
+
+from create_dataframe import PatchBuffers
+
+##################################################################
+# Shared-border topology of the country polygons, TopoJSON style.
+#
+# Neighbouring countries each have their own copy of the border between them. Here the
+# rings are cut into arcs wherever they meet other rings (the junctions), and every arc
+# is stored once: a ring is then the list of its arcs, each used forwards (i) or
+# backwards (~i, as in TopoJSON). A border shared by two countries is a single arc
+# used by both, so it's stored and sent once and always drawn the same way for both.
+#
+# The map cache (see map_cache.py) stores the topology of every level of detail, with
+# the PatchBuffers topology_to_buffers() rebuilds from it (and from which Bokeh's xs and
+# ys are built) so they don't have to be rebuilt in every process. With --compact, world_map.py sends the arcs themselves and
+# the browser rebuilds the rings (see quantize.encode_topology()).
+##################################################################
+
+# The arcs' coordinates are arc_x[arc_offsets[i]:arc_offsets[i+1]] for arc i, and the arcs of
+# ring j are ring_arcs[arc_ring_offsets[j]:arc_ring_offsets[j+1]], as signed references
+# (i for arc i, ~i for arc i backwards). part_offsets and geom_offsets are those of the
+# PatchBuffers the topology was built from.
+Topology = namedtuple('Topology', ['arc_x', 'arc_y', 'arc_offsets', 'ring_arcs',
+                                   'arc_ring_offsets', 'part_offsets', 'geom_offsets'])
+
+
+def get_open_rings(buffers):
+    """
+    Drops the closing coordinate of every ring of a PatchBuffers tuple, and the coordinates
+    repeating the one before them.
+    Returns: A tuple of the x and y coordinates and the offsets of the open rings.
+    """
+
+    ring_offsets = np.asarray(buffers.ring_offsets)
+    x = np.asarray(buffers.x, dtype=np.float64)
+    y = np.asarray(buffers.y, dtype=np.float64)
+    ring_ids = np.repeat(np.arange(len(ring_offsets) - 1), np.diff(ring_offsets))
+
+    keep = np.ones(len(x), dtype=bool)
+    keep[ring_offsets[1:][np.diff(ring_offsets) > 0] - 1] = False
+    repeated = np.zeros(len(x), dtype=bool)
+    repeated[1:] = (x[1:] == x[:-1]) & (y[1:] == y[:-1]) & (ring_ids[1:] == ring_ids[:-1])
+    keep &= ~repeated
+
+    lengths = np.bincount(ring_ids[keep], minlength=len(ring_offsets) - 1)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return (x[keep], y[keep], offsets)
+
+
+def find_junctions(point_ids, offsets):
+    """
+    Finds the junctions of a set of open rings: the points where a ring meets another one
+    coming from or going to a different point.
+    Input: The id of every coordinate's point (the same for equal coordinates) and the offsets
+    of the rings.
+    Returns: A boolean array, True for the coordinates that are junctions.
+    """
+
+    n = len(point_ids)
+    index = np.arange(n)
+    ring_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    starts, ends = offsets[:-1][ring_ids], offsets[1:][ring_ids]
+    previous = point_ids[np.where(index == starts, ends - 1, index - 1)]
+    following = point_ids[np.where(index == ends - 1, starts, index + 1)]
+    low, high = np.minimum(previous, following), np.maximum(previous, following)
+
+    # a point is a junction when its neighbours aren't the same in all of its rings
+    order = np.lexsort((high, low, point_ids))
+    same_point = point_ids[order][1:] == point_ids[order][:-1]
+    other_neighbours = (low[order][1:] != low[order][:-1]) | (high[order][1:] != high[order][:-1])
+    junction_points = np.unique(point_ids[order][1:][same_point & other_neighbours])
+
+    return np.isin(point_ids, junction_points)
+
+
+def get_point_ids(x, y):
+    """
+    Numbers the distinct points of a set of coordinates, in the order of np.unique().
+    Returns: A tuple of the index of the first coordinate of every point and the point id of
+    every coordinate.
+    """
+
+    order = np.lexsort((y, x))
+    new_point = np.ones(len(order), dtype=bool)
+    new_point[1:] = (x[order][1:] != x[order][:-1]) | (y[order][1:] != y[order][:-1])
+    point_ids = np.empty(len(order), dtype=np.int64)
+    point_ids[order] = np.cumsum(new_point) - 1
+    return (order[new_point], point_ids)
+
+
+def get_arc_starts(point_ids, offsets, junctions):
+    """
+    Finds where every ring's first arc starts: at the ring's first junction, or at its lowest
+    point if it has none, so the same ring in two countries (e.g. an enclave) gives the same arc.
+    Returns: The array of the index of each ring's first arc's coordinate (unused for empty rings).
+    """
+
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    starts = offsets[:-1].copy()
+    if not nonempty.any():
+        return starts
+
+    index = np.arange(len(point_ids))
+    ring_starts = offsets[:-1][nonempty]
+    first_junction = np.minimum.reduceat(np.where(junctions, index, len(point_ids)), ring_starts)
+    ring_ids = np.repeat(np.arange(len(lengths)), lengths)
+    lowest_ids = np.minimum.reduceat(point_ids, ring_starts)
+    lowest_ids = np.repeat(lowest_ids, lengths[nonempty])
+    lowest = np.minimum.reduceat(np.where(point_ids == lowest_ids, index, len(point_ids)),
+                                 ring_starts)
+    starts[nonempty] = np.where(first_junction < len(point_ids), first_junction, lowest)
+    return starts
+
+
+def build_topology(buffers, cuts=None):
+    """
+    Cuts the rings of a PatchBuffers tuple into arcs, each shared arc being kept once.
+    Input: The PatchBuffers and, optionally, a function of the x and y coordinate arrays
+    returning whether to also cut the rings at each of those points (e.g. tiles.on_tile_edges()).
+    Returns: A Topology.
+    """
+
+    x, y, offsets = get_open_rings(buffers)
+    first, point_ids = get_point_ids(x, y)
+    junctions = find_junctions(point_ids, offsets)
+    if cuts is not None:
+        junctions |= cuts(x, y)
+    lengths = np.diff(offsets)
+    n_rings = len(lengths)
+
+    # every ring rotated to start with its first arc, and closed by repeating that point
+    arc_starts = get_arc_starts(point_ids, offsets, junctions)
+    ring_ids = np.repeat(np.arange(n_rings), lengths)
+    positions = np.arange(len(point_ids)) - offsets[:-1][ring_ids]
+    rotated = offsets[:-1][ring_ids] + (arc_starts[ring_ids] - offsets[:-1][ring_ids]
+                                         + positions) % lengths[ring_ids]
+    closed_lengths = lengths + (lengths > 0)
+    closed_offsets = np.zeros(n_rings + 1, dtype=np.int64)
+    np.cumsum(closed_lengths, out=closed_offsets[1:])
+    closed = np.empty(closed_offsets[-1], dtype=np.int64)  # coordinate indices
+    closed[closed_offsets[:-1][ring_ids] + positions] = rotated
+    closed[closed_offsets[1:][lengths > 0] - 1] = rotated[(positions == 0)]
+
+    # an arc runs from every cut (junction, or first point of the ring) to the next one
+    cuts = (junctions[rotated] | (positions == 0))
+    cut_positions = np.flatnonzero(cuts)
+    cut_rings = ring_ids[cut_positions]
+    ref_starts = closed_offsets[:-1][cut_rings] + positions[cut_positions]
+    next_in_ring = np.append(cut_rings[1:] == cut_rings[:-1], False)
+    ref_ends = np.where(next_in_ring, np.append(ref_starts[1:], 0),
+                        closed_offsets[1:][cut_rings] - 1)  # inclusive
+
+    # between two junctions, the points all have the same neighbours in every ring, so an arc
+    # is known from its first two points, and it's the reverse of another one when its last
+    # two points are that one's first two
+    closed_points = point_ids[closed]
+    forwards = np.column_stack((closed_points[ref_starts], closed_points[ref_starts + 1]))
+    backwards = np.column_stack((closed_points[ref_ends], closed_points[ref_ends - 1]))
+    reverse = (backwards[:, 0] < forwards[:, 0]) | (
+        (backwards[:, 0] == forwards[:, 0]) & (backwards[:, 1] < forwards[:, 1]))
+    keys = np.where(reverse[:, np.newaxis], backwards, forwards)
+    _, first_refs, arc_of_ref = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    arc_of_ref = arc_of_ref.ravel()
+
+    # arcs numbered in the order they're first used, in the direction of that first use
+    order = np.argsort(first_refs, kind='stable')
+    numbers = np.empty(len(order), dtype=np.int64)
+    numbers[order] = np.arange(len(order))
+    arc_first_refs = first_refs[order]
+    arc_ids = numbers[arc_of_ref]
+    ring_arcs = np.where(reverse == reverse[first_refs][arc_of_ref], arc_ids, ~arc_ids)
+
+    arc_lengths = ref_ends[arc_first_refs] - ref_starts[arc_first_refs] + 1
+    arc_offsets = np.zeros(len(arc_lengths) + 1, dtype=np.int64)
+    np.cumsum(arc_lengths, out=arc_offsets[1:])
+    coordinates = closed[np.arange(arc_offsets[-1])
+                         + np.repeat(ref_starts[arc_first_refs] - arc_offsets[:-1], arc_lengths)]
+    coordinates = first[point_ids[coordinates]]
+
+    arc_ring_offsets = np.zeros(n_rings + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cut_rings, minlength=n_rings), out=arc_ring_offsets[1:])
+
+    return Topology(x[coordinates], y[coordinates], arc_offsets, ring_arcs.astype(np.int64),
+                    arc_ring_offsets, np.asarray(buffers.part_offsets, dtype=np.int64),
+                    np.asarray(buffers.geom_offsets, dtype=np.int64))
+
+
+def get_ring_coordinates(topology):
+    """
+    Finds which coordinates of the arcs make up each ring: the coordinates of its arcs in
+    order (reversed for the arcs used backwards), without the first coordinate of every arc
+    but the ring's first one, which is the last coordinate of the arc before it.
+    Returns: A tuple of the indices of the coordinates in the arcs and the offsets of the rings.
+    """
+
+    refs = np.asarray(topology.ring_arcs)
+    arc_offsets = np.asarray(topology.arc_offsets)
+    arc_ring_offsets = np.asarray(topology.arc_ring_offsets)
+    backwards = refs < 0
+    arc_ids = np.where(backwards, ~refs, refs)
+
+    first_of_ring = np.zeros(len(refs), dtype=bool)
+    first_of_ring[arc_ring_offsets[:-1][np.diff(arc_ring_offsets) > 0]] = True
+    skip = (~first_of_ring).astype(np.int64)
+    counts = arc_offsets[arc_ids + 1] - arc_offsets[arc_ids] - skip
+
+    # position of every coordinate within its arc reference
+    ref_starts = np.zeros(len(refs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ref_starts[1:])
+    positions = np.arange(ref_starts[-1]) - np.repeat(ref_starts[:-1], counts)
+    ref_of_coordinate = np.repeat(np.arange(len(refs)), counts)
+
+    forwards_index = arc_offsets[arc_ids][ref_of_coordinate] + skip[ref_of_coordinate] + positions
+    backwards_index = (arc_offsets[arc_ids + 1][ref_of_coordinate] - 1 - skip[ref_of_coordinate]
+                       - positions)
+    indices = np.where(backwards[ref_of_coordinate], backwards_index, forwards_index)
+
+    ring_offsets = ref_starts[arc_ring_offsets]
+    return (indices, ring_offsets)
+
+
+def topology_to_buffers(topology):
+    """
+    Rebuilds the PatchBuffers of the polygons of a Topology, without looping in Python.
+    """
+
+    indices, ring_offsets = get_ring_coordinates(topology)
+    return PatchBuffers(np.asarray(topology.arc_x)[indices], np.asarray(topology.arc_y)[indices],
+                        ring_offsets, np.asarray(topology.part_offsets),
+                        np.asarray(topology.geom_offsets))
+
+
+def renumber_arcs(geometry_arcs):
+    """
+    Renumbers the arcs used by some of the geometries, so only those arcs have to be sent.
+    Input: The list of the signed arc references of each of the geometries.
+    Returns: A tuple of the sorted array of the arcs used and the list of the geometries'
+    references to their positions in it.
+    """
+
+    lengths = [len(refs) for refs in geometry_arcs]
+    if sum(lengths) == 0:
+        return (np.empty(0, dtype=np.int64), [np.asarray(refs) for refs in geometry_arcs])
+
+    refs = np.concatenate(geometry_arcs)
+    backwards = refs < 0
+    arc_ids = np.where(backwards, ~refs, refs)
+    used = np.unique(arc_ids)
+    positions = np.searchsorted(used, arc_ids)
+    renumbered = np.where(backwards, ~positions, positions).astype(refs.dtype)
+
+    return (used, np.split(renumbered, np.cumsum(lengths)[:-1]))
+
+
+def select_arcs(arc_offsets, arc_ids):
+    """
+    Finds the coordinates of some of the arcs.
+    Input: The arc offsets of a Topology and the ids of the arcs.
+    Returns: A tuple of the indices of the arcs' coordinates, one arc after the other, and the
+    number of coordinates of each arc.
+    """
+
+    arc_offsets = np.asarray(arc_offsets)
+    lengths = arc_offsets[arc_ids + 1] - arc_offsets[arc_ids]
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    indices = np.arange(lengths.sum()) + np.repeat(arc_offsets[arc_ids] - starts, lengths)
+    return (indices, lengths)
@@ -4,12 +4,59 @@ from shapely.geometry import Point, LineString, Polygon, Point
 import matplotlib.pyplot as plt
 from bokeh.io import curdoc, output_file, show
 from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource, GeoJSONDataSource, HoverTool, LogColorMapper, LogTicker, ColorBar, CheckboxGroup, FuncTickFormatter, FixedTicker, HoverTool, BoxZoomTool, ResetTool, ToolbarBox, Toolbar
-from bokeh.layouts import column
-from bokeh.palettes import Inferno, Cividis, Viridis8, Viridis6, Viridis
+from bokeh.models import ColumnDataSource, GeoJSONDataSource, HoverTool, LogColorMapper, LinearColorMapper, LogTicker, ColorBar, CheckboxGroup, Select, Div, Slider, Button, FuncTickFormatter, FixedTicker, HoverTool, BoxZoomTool, ResetTool, ToolbarBox, Toolbar, CustomJS
+from bokeh.layouts import column, row
+from bokeh.palettes import Inferno, Cividis, Viridis8, Viridis6, Viridis, Category10
 import numpy as np
+import argparse
+import sys
+from html import escape
+from urllib.parse import quote
 
-from create_dataframe import add_patch_coords
+from bokeh.events import RangesUpdate, Tap
+from lod import choose_level, visible_rows
+from classify import classify_column
+from spatial_index import countries_at
+from tiles import choose_zoom, get_tile_edge_arcs, get_visible_tiles, merge_tiles, on_tile_edges, read_tile
+from shared_data import (DENSITY_BREAKS, DENSITY_PALETTE, COLOR_FIELDS, NAN_COLOR, YEAR_FIELDS,
+                         DEFAULT_YEAR, load_shared_data, load_compact_levels)
+from year_store import get_year_colors
+from point_layers import get_point_data
+from country_details import get_country_details, format_details
+from telemetry import span, timed, get_session_id, log_document_size
+from quantize import COORDINATE_PRECISION, encode_topology, make_topology_decoder
+from topology import build_topology, renumber_arcs, select_arcs
+from map_cache import get_patch_coords
+from bokeh.document import Document
+from bokeh.embed import file_html
+from bokeh.resources import CDN
+
+##################################################################
+# The world map app.
+#
+# Everything the map shows is loaded once per server process by shared_data.py, so
+# make_document() only builds the glyphs and callbacks of a new session. Run with either:
+#   bokeh serve --show world_map.py
+# or, to load the data when the server starts rather than on the first session (see
+# server_lifecycle.py and main.py):
+#   bokeh serve --show .
+##################################################################
+
+MAX_LABEL_LENGTH = 30  # longer color bar labels get cut off
+PLAY_INTERVAL = 200  # milliseconds between the years when playing the years
+
+# the map can also be drawn from the vector tiles exported by tiles.py, with:
+# bokeh serve --show world_map.py --args --tiles tiles
+parser = argparse.ArgumentParser()
+parser.add_argument('--tiles', help="folder of the vector tiles to draw the map from")
+# or send the polygons quantized and as binary arrays rather than JSON (see quantize.py), with:
+# bokeh serve --show world_map.py --args --compact
+parser.add_argument('--compact', action='store_true',
+                    help="send the polygons quantized (the tiles always are)")
+parser.add_argument('--precision', type=int, default=COORDINATE_PRECISION,
+                    help="decimals of the coordinates kept by --compact and --tiles")
+parser.add_argument('--html', help="save the map to a standalone HTML file instead")
+args, _ = parser.parse_known_args(sys.argv[1:])
 
 
 def patch_colors(df_countries):
@@ -17,130 +64,448 @@ def patch_colors(df_countries):
     Determines the color of each patch based on the population density of that patch.
     """
 
-    # population density ranges:
-    #   0 - 10      0
-    #   10 - 25     1
-    #   25 - 50     2
-    #   50 - 75     3
-    #   75 - 100    4
-    #   100 - 150   5
-    #   150 - 300   6
-    #   300 - 1000  7
-    #   1000+       8
-
-    palette = ['#f7f4f9', '#e7e1ef', '#d4b9da', '#c994c7',
-               '#df65b0', '#e7298a', '#ce1256', '#980043', '#67001f']
-    # palette = ['#fcfbfd','#efedf5','#dadaeb','#bcbddc','#9e9ac8','#807dba','#6a51a3','#54278f','#3f007d']
-    density_ranges = ['≤ 10', '10 - 25', '25 - 50', '50 - 75', '75 - 100', '100 - 150',
-                      '150 - 300', '300 - 1000', '1000+']
-    df_countries['color'] = ''
-    df_countries['legend'] = ''
-
-    for row, data in df_countries.iterrows():
-        density = data['density']
-        if density <= 10:
-            df_countries.loc[row, 'color'] = palette[0]
-            df_countries.loc[row, 'legend'] = density_ranges[0]
-        elif density <= 25:
-            df_countries.loc[row, 'color'] = palette[1]
-            df_countries.loc[row, 'legend'] = density_ranges[1]
-        elif density <= 50:
-            df_countries.loc[row, 'color'] = palette[2]
-            df_countries.loc[row, 'legend'] = density_ranges[2]
-        elif density <= 75:
-            df_countries.loc[row, 'color'] = palette[3]
-            df_countries.loc[row, 'legend'] = density_ranges[3]
-        elif density <= 100:
-            df_countries.loc[row, 'color'] = palette[4]
-            df_countries.loc[row, 'legend'] = density_ranges[4]
-        elif density <= 150:
-            df_countries.loc[row, 'color'] = palette[5]
-            df_countries.loc[row, 'legend'] = density_ranges[5]
-        elif density <= 300:
-            df_countries.loc[row, 'color'] = palette[6]
-            df_countries.loc[row, 'legend'] = density_ranges[6]
-        elif density <= 1000:
-            df_countries.loc[row, 'color'] = palette[7]
-            df_countries.loc[row, 'legend'] = density_ranges[7]
-        elif density > 1000:
-            df_countries.loc[row, 'color'] = palette[8]
-            df_countries.loc[row, 'legend'] = density_ranges[8]
+    df_countries['color'], df_countries['legend'] = classify_column(
+        df_countries, 'density', DENSITY_PALETTE, scheme='manual', breaks=DENSITY_BREAKS)
 
     return df_countries
 
 
-#################################################
-# Plot countries
-#################################################
-df_countries = gpd.read_file("final_dataset.shp")
-df_countries = add_patch_coords(df_countries)
-df_countries.drop(columns='geometry', inplace=True)
-df_countries['pop_densit'] = df_countries['pop_densit'] / 10000
+def make_document(doc):
+    """
+    Builds a session of the map on the given document, timing it if telemetry is enabled (see
+    telemetry.py).
+    """
+
+    session = get_session_id(doc)
+    with span('make_document', session):
+        build_document(doc, session)
+    log_document_size(doc, session)
+
+
+def build_document(doc, session=None):
+    """
+    Builds a session of the map on the given document. Only the session's own models are
+    created here, the data comes from load_shared_data() and is never modified.
+    """
+
+    with span('load_shared_data', session):
+        shared = load_shared_data()
+    countries = shared['countries']
+    field_colors = shared['field_colors']
+    field_legends = shared['field_legends']
+    lod_levels = shared['lod_levels']
+    year_store = shared['year_store']
+    n_countries = len(countries)
+
+    # the session's columns of the countries: only their names and colors, the other details
+    # are sent when a country is hovered (see country_details.py). The color column is replaced
+    # when the color field changes and the details are filled in as they're sent.
+    countries_columns = {
+        'NAME_EN': shared['countries_columns']['NAME_EN'],
+        'row': np.arange(n_countries),
+        'color': field_colors[COLOR_FIELDS[0]],
+        'details': np.full(n_countries, '', dtype=object),
+    }
+
+    #################################################
+    # Plot countries
+    #################################################
+    plot_width = 1300
+    plot_height = int(plot_width / 1.7647)
+    # fixed ranges showing the whole world, since the source only holds the countries in view
+    # (the first paint and the reset tool would otherwise fit those)
+    plot = figure(plot_width=plot_width, plot_height=plot_height,  # width / height = 1.7647
+                  x_range=(-180, 180), y_range=(-90, 90),
+                  title='%s, %d' % (COLOR_FIELDS[0], DEFAULT_YEAR), toolbar_location='left')
+    #plot.axis.visible = False
+    if args.compact or args.tiles:
+        # the browser decodes the polygons itself from the quantized arcs, and the borders
+        # between two countries are only sent once
+        if not args.tiles:
+            compact_levels = load_compact_levels(args.precision)
+        arcs_source = ColumnDataSource({'qx': [], 'qy': [], 'lengths': []})
+        coordinate_columns = ['parts', 'arcs']
+        xs = {'expr': make_topology_decoder(arcs_source, 'qx', precision=args.precision)}
+        ys = {'expr': make_topology_decoder(arcs_source, 'qy', precision=args.precision)}
+    else:
+        coordinate_columns = ['xs', 'ys']
+        xs, ys = 'xs', 'ys'
+    countries_source = ColumnDataSource({name: [] for name in list(countries_columns) + coordinate_columns})
+    countries_glyph = plot.multi_polygons(xs, ys, source=countries_source, line_color="black",
+                                          fill_color='color')
+
+    # one block of color per class, with the class's label in its middle
+    color_mapper = LinearColorMapper(palette=['white'], low=0, high=1)
+    ticker = FixedTicker(ticks=[])
+    color_bar = ColorBar(color_mapper=color_mapper, location=(
+        0, 0), major_tick_line_color=None, ticker=ticker, label_standoff=10)
+
+    plot.add_layout(color_bar, 'right')
+
+    def set_color_bar(field):
+        """
+        Shows the classes of the given field in the color bar.
+        """
+
+        colors, labels = field_legends[field]
+        color_mapper.update(palette=colors, high=len(colors))
+        ticker.ticks = [i + 0.5 for i in range(len(colors))]
+        color_bar.major_label_overrides = {
+            i + 0.5: label if len(label) <= MAX_LABEL_LENGTH else label[:MAX_LABEL_LENGTH - 3] + '...'
+            for i, label in enumerate(labels)}
 
-max_pop_density = df_countries.loc[df_countries['pop_densit']
-                                   != np.inf, 'pop_densit'].squeeze().max()
-min_pop_density = df_countries['pop_densit'].min()
-color_mapper = LogColorMapper(palette=list(reversed(Viridis[256])),
-                              low=min_pop_density, high=max_pop_density + 500)
+    set_color_bar(COLOR_FIELDS[0])
 
-plot_width = 1300
-plot_height = int(plot_width / 1.7647)
-plot = figure(plot_width=plot_width, plot_height=plot_height,  # width / height = 1.7647
-              title="Population density", toolbar_location='left')
-#plot.axis.visible = False
-countries_glyph = plot.multi_polygons("xs", "ys", source=df_countries[:239], line_color="black",
-                                      fill_color={'field': 'pop_densit', 'transform': color_mapper})
+    #################################################
+    # Country details
+    #################################################
+    # the browser sends the row of the hovered country, unless its details were already sent
+    hovered_source = ColumnDataSource({'row': [-1]})
+    send_hovered = CustomJS(args={'source': countries_source, 'hovered': hovered_source}, code="""
+        const indices = cb_data.index.indices;
+        if (indices.length == 0)
+            return;
+        const row = source.data['row'][indices[0]];
+        if (source.data['details'][indices[0]] !== '' || hovered.data['row'][0] == row)
+            return;
+        hovered.data = {row: [row]};
+    """)
 
-ticker = FixedTicker(
-    ticks=[1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000])
+    plot.add_tools(HoverTool(
+        renderers=[countries_glyph], tooltips='<div><b>@{NAME_EN}</b></div>@{details}{safe}',
+        callback=send_hovered, name='Hover (country)'))
 
-color_bar = ColorBar(color_mapper=color_mapper, location=(
-    0, 0), major_tick_line_color='black', ticker=ticker, label_standoff=10)
+    def get_details(row):
+        """
+        Returns the details of a country as HTML.
+        """
 
-plot.add_layout(color_bar, 'right')
+        return format_details(get_country_details(row)) or '<div>No other data.</div>'
 
+    def hover_country_callback(attr, old, new):
+        """
+        Callback for when a country is hovered for the first time. Sends its details to the
+        tooltip.
+        """
 
-plot.add_tools(HoverTool(
-    renderers=[countries_glyph], tooltips='@{NAME_EN}', name='Hover (country)'))
+        row = new['row'][0]
+        if not 0 <= row < n_countries or countries_columns['details'][row]:
+            return
 
+        countries_columns['details'][row] = get_details(row)
+        shown = np.flatnonzero(current_lod['rows'] == row)
+        if len(shown):
+            countries_source.patch({'details': [(int(i), countries_columns['details'][row])
+                                                for i in shown]})
 
-#################################################
-# Plot capitals
-#################################################
-df_capitals = pd.read_csv("../database/df_capitals.csv")
+    hovered_source.on_change('data', timed(hover_country_callback, session))
 
-capitals_glyph = plot.circle(x='CapitalLongitude', y='CapitalLatitude', source=df_capitals,
-                             fill_color='red', line_color='red', size=4.5)
+    #################################################
+    # Level of detail
+    #################################################
+    current_lod = {'level': None, 'rows': None}
 
+    def get_arcs_data(encoded, rows):
+        """
+        Selects the arcs of some of the geometries of an encoded topology, renumbered so only
+        those arcs are sent.
+        Input: The output of encode_topology() and the rows of the geometries.
+        Returns: A tuple of the data of the arcs' source, the dictionary of the geometries'
+        parts and arcs columns and the sorted array of the ids of the arcs sent.
+        """
 
-capitals_tooltips = """ 
-    <div>
+        arc_x, arc_y, arc_offsets, parts, arcs = encoded
+        used, geometry_arcs = renumber_arcs([arcs[i] for i in rows.tolist()])
+        indices, lengths = select_arcs(arc_offsets, used)
+        return ({'qx': [arc_x[indices]], 'qy': [arc_y[indices]], 'lengths': [lengths.astype(np.int32)]},
+                {'parts': [parts[i] for i in rows.tolist()], 'arcs': geometry_arcs}, used)
+
+    def set_countries_data(key, rows, coordinates):
+        """
+        Replaces the countries' polygons with the given ones.
+        Input: A key identifying the polygons (level of detail or tiles) shown, the row of each
+        polygon in the countries' columns and the dictionary of the polygons' coordinate columns
+        (xs and ys, or the encoded columns with --compact and --tiles).
+        """
+
+        if key == current_lod['level'] and np.array_equal(rows, current_lod['rows']):
+            return  # nothing changed, so don't resend the polygons
+        current_lod['level'], current_lod['rows'] = key, rows
+
+        new_data = {name: values[rows] for name, values in countries_columns.items()}
+        new_data.update(coordinates)
+        countries_source.data = new_data
+
+    def set_level_of_detail(level, rows):
+        """
+        Replaces the countries' polygons with those of the given level of detail, keeping only
+        the given rows.
+        """
+
+        if level == current_lod['level'] and np.array_equal(rows, current_lod['rows']):
+            return
+
+        if args.compact:
+            arcs_source.data, coordinates, _ = get_arcs_data(compact_levels[level], rows)
+        else:
+            # only the countries shown are converted to lists, the levels stay as arrays
+            xs, ys = get_patch_coords(lod_levels[level], rows)
+            coordinates = {'xs': xs, 'ys': ys}
+        set_countries_data(level, rows, coordinates)
+
+    # the hot paths of the callbacks are timed separately too
+    set_level_of_detail = timed(set_level_of_detail, session)
+
+    def set_tiles(zoom, visible_tiles):
+        """
+        Replaces the countries' polygons and borders with those of the given vector tiles. Both
+        are sent quantized, like with --compact, and the polygons' borders only once.
+        """
+
+        key = ('tiles', zoom, tuple(visible_tiles))
+        if key == current_lod['level']:
+            return
+
+        tiles = [tile for tile in (read_tile(args.tiles, zoom, x, y) for x, y in visible_tiles)
+                 if tile is not None]
+        feature_ids, fills = merge_tiles(tiles)
+        shown = np.flatnonzero(feature_ids < n_countries)
+        # the polygons are also cut where they cross the tiles' edges, so the borders are the
+        # arcs that aren't pieces of an edge
+        topology = build_topology(fills, lambda x, y: on_tile_edges(zoom, x, y))
+        arcs_source.data, coordinates, used = get_arcs_data(
+            encode_topology(topology, args.precision), shown)
+        borders = np.flatnonzero(~get_tile_edge_arcs(topology, zoom)[used])
+        borders_glyph.data_source.data = {'line': borders.astype(np.int32)}
+
+        set_countries_data(key, feature_ids[shown], coordinates)
+
+    set_tiles = timed(set_tiles, session)
+
+    def update_level_of_detail(event):
+        """
+        Callback for when the plot's ranges change. Sends the simplified polygons matching the
+        zoom level, and only those of the countries (or tiles) inside the visible area.
+        """
+
+        x_start, x_end = plot.x_range.start, plot.x_range.end
+        y_start, y_end = plot.y_range.start, plot.y_range.end
+        if None in (x_start, x_end, y_start, y_end):
+            return
+
+        if args.tiles:
+            zoom = choose_zoom(x_end - x_start, plot_width)
+            set_tiles(zoom, get_visible_tiles(zoom, x_start, x_end, y_start, y_end))
+            return
+
+        level = choose_level(x_end - x_start, plot_width)
+        bounds = lod_levels[level][2][:n_countries]
+        set_level_of_detail(level, np.flatnonzero(
+            visible_rows(bounds, x_start, x_end, y_start, y_end)))
+
+    # start with the whole world visible
+    if args.tiles:
+        # tiles are clipped, so the outlines are only drawn along the arcs that are borders
+        countries_glyph.glyph.line_color = None
+        borders_glyph = plot.multi_line(
+            xs={'expr': make_topology_decoder(arcs_source, 'qx', refs='line',
+                                              precision=args.precision, lines=True)},
+            ys={'expr': make_topology_decoder(arcs_source, 'qy', refs='line',
+                                              precision=args.precision, lines=True)},
+            source=ColumnDataSource({'line': []}), line_color='black')
+        zoom = choose_zoom(360, plot_width)
+        set_tiles(zoom, get_visible_tiles(zoom, -180, 180, -90, 90))
+    else:
+        set_level_of_detail(choose_level(360, plot_width), np.arange(n_countries))
+    plot.on_event(RangesUpdate, timed(update_level_of_detail, session))
+
+    #################################################
+    # Color field
+    #################################################
+    field_select = Select(title='Color by', value=COLOR_FIELDS[0], options=COLOR_FIELDS)
+    current_year = {'index': int(np.searchsorted(year_store.years, DEFAULT_YEAR)), 'callback': None}
+
+    def get_colors(field):
+        """
+        Returns the colors of every country for the given field, in the selected year for the
+        YEAR_FIELDS.
+        """
+
+        if field in YEAR_FIELDS:
+            return get_year_colors(shared['year_classes'][field], field_legends[field][0],
+                                   NAN_COLOR, current_year['index'])
+        return field_colors[field]
+
+    def set_colors(field):
+        """
+        Colors the countries by the given field. Only the colors of the countries shown that
+        changed are sent to the browser, the polygons stay as they are.
+        """
+
+        countries_columns['color'] = get_colors(field)
+        new_colors = countries_columns['color'][current_lod['rows']]
+        changed = np.flatnonzero(new_colors != countries_source.data['color'])
+        if len(changed):
+            countries_source.patch({'color': [(int(i), new_colors[i]) for i in changed]})
+
+        if field in YEAR_FIELDS:
+            plot.title.text = '%s, %d' % (field, year_store.years[current_year['index']])
+        else:
+            plot.title.text = field
+
+    set_colors = timed(set_colors, session)
+
+    def change_color_field_callback(attr, old, new):
+        """
+        Callback function for the color field selector.
+        """
+
+        set_colors(new)
+        set_color_bar(new)
+        year_slider.disabled = play_button.disabled = new not in YEAR_FIELDS
+
+    field_select.on_change('value', timed(change_color_field_callback, session))
+
+    #################################################
+    # Year
+    #################################################
+    year_slider = Slider(title='Year', start=year_store.years[0], end=year_store.years[-1],
+                         value=DEFAULT_YEAR, step=1)
+    play_button = Button(label='► Play', width=80)
+
+    def change_year_callback(attr, old, new):
+        """
+        Callback function for the year slider. The colors of every year were computed up front
+        (see year_store.py), so this only picks those of the new year.
+        """
+
+        current_year['index'] = int(np.searchsorted(year_store.years, new))
+        if field_select.value in YEAR_FIELDS:
+            set_colors(field_select.value)
+
+    def next_year():
+        """
+        Periodic callback moving the slider to the next year while playing, and stopping at the
+        last year.
+        """
+
+        if year_slider.value >= year_slider.end:
+            play_callback()
+        else:
+            year_slider.value += 1
+
+    def play_callback():
+        """
+        Callback function for the play button, which starts or stops moving through the years.
+        """
+
+        if current_year['callback'] is None:
+            if year_slider.value >= year_slider.end:
+                year_slider.value = year_slider.start
+            current_year['callback'] = doc.add_periodic_callback(timed(next_year, session),
+                                                                 PLAY_INTERVAL)
+            play_button.label = '❚❚ Pause'
+        else:
+            doc.remove_periodic_callback(current_year['callback'])
+            current_year['callback'] = None
+            play_button.label = '► Play'
+
+    year_slider.on_change('value', timed(change_year_callback, session))
+    play_button.on_click(timed(play_callback, session))
+
+    #################################################
+    # Clicked country
+    #################################################
+    country_info = Div(text='Click on a country to see its details and Wikipedia page.')
+
+    def tap_country_callback(event):
+        """
+        Callback function for clicks on the map. Finds the country that was clicked (with the
+        spatial index, so only the few countries around the point are tested) and shows its
+        details and a link to its Wikipedia page.
+        """
+
+        index = countries_at(shared['spatial_index'], event.x, event.y)[0]
+        if index < 0 or index >= n_countries:
+            country_info.text = 'Click on a country to see its details and Wikipedia page.'
+            return
+
+        name = countries['NAME_EN'].iloc[index]
+        url = 'https://en.wikipedia.org/wiki/' + quote(name.replace(' ', '_'))
+        country_info.text = '<b>%s</b>%s<a href="%s" target="_blank">%s on Wikipedia</a>' % (
+            escape(name), get_details(index), url, escape(name))
+
+    plot.on_event(Tap, timed(tap_country_callback, session))
+
+    #################################################
+    # Plot capitals
+    #################################################
+    # the capitals are binned on grids (see point_layers.py) and only those visible are sent
+    capitals_source = ColumnDataSource({'x': [], 'y': [], 'count': [], 'size': [], 'label': []})
+    capitals_glyph = plot.circle(x='x', y='y', size='size', source=capitals_source,
+                                 fill_color='red', line_color='red')
+
+    capitals_tooltips = """
         <div>
-            <span style="font-size: 12px;">@CapitalName_x, @{Country/Region}</span>
+            <div>
+                <span style="font-size: 12px;">@label</span>
+            </div>
         </div>
-    </div>
-"""
-plot.add_tools(
-    HoverTool(renderers=[capitals_glyph], tooltips=capitals_tooltips))
+    """
+    plot.add_tools(
+        HoverTool(renderers=[capitals_glyph], tooltips=capitals_tooltips))
 
-capitals_checkbox = CheckboxGroup(labels=['Show capitals'], active=[0])
+    capitals_checkbox = CheckboxGroup(labels=['Show capitals'], active=[0])
 
+    def update_capitals(event=None):
+        """
+        Callback for when the plot's ranges change. Sends the capitals (or their clusters)
+        inside the visible area, unless the capitals are hidden.
+        """
 
-def show_capitals_callback(active):
-    """
-    Callback function for the 'Show capitals' checkbox. If the checkbox is active, show the countries' capitals and hover tool. Otherwise,
-    hide them.
-    """
+        if not capitals_glyph.visible:
+            return
 
-    if active:
-        capitals_glyph.visible = True
-    else:
-        capitals_glyph.visible = False
+        x_start, x_end = plot.x_range.start, plot.x_range.end
+        y_start, y_end = plot.y_range.start, plot.y_range.end
+        if None in (x_start, x_end, y_start, y_end):
+            x_start, x_end, y_start, y_end = -180, 180, -90, 90  # the plot isn't shown yet
+
+        capitals_source.data = get_point_data(
+            shared['capital_levels'], shared['capital_labels'], x_start, x_end, y_start, y_end,
+            plot_width, unit='capitals')
+
+    update_capitals()
+    plot.on_event(RangesUpdate, timed(update_capitals, session))
+
+    def show_capitals_callback(active):
+        """
+        Callback function for the 'Show capitals' checkbox. If the checkbox is active, show the countries' capitals and hover tool. Otherwise,
+        hide them, which also stops sending them when the map moves.
+        """
+
+        if active:
+            capitals_glyph.visible = True
+            update_capitals()  # the map may have moved while they were hidden
+        else:
+            capitals_glyph.visible = False
+
+    capitals_checkbox.on_click(timed(show_capitals_callback, session))
+
+    plot.background_fill_color = '#f0f0f0'
 
+    layout = column(capitals_checkbox, field_select, row(play_button, year_slider), plot, country_info)
+    doc.add_root(layout)
 
-capitals_checkbox.on_click(show_capitals_callback)
 
-plot.background_fill_color = '#f0f0f0'
+# run by `bokeh serve world_map.py`, which executes this file for every session under a
+# module name starting with bokeh_app_ (main.py calls make_document() itself)
+if __name__.startswith('bokeh_app_'):
+    make_document(curdoc())
 
-layout = column(capitals_checkbox, plot)
-curdoc().add_root(layout)
+if __name__ == '__main__' and args.html:
+    # without a server, the map can't change its level of detail or react to the widgets
+    document = Document()
+    make_document(document)
+    with open(args.html, 'w') as f:
+        f.write(file_html(document, CDN, 'World map'))
@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from create_dataframe import POPULATION_FILE
+from classify import classify
+from areas import get_density
+
+##################################################################
+# The population of every country for every year of the World Bank file, for the year
+# slider of world_map.py.
+#
+# The values are kept as country x year float32 matrices, in the same row order as the
+# countries of the map, so the data of a year is just a column of the matrix: nothing
+# has to be merged or recomputed when the year changes. The densities use the areas
+# computed once when the map cache was built (see map_cache.prepare_countries()).
+# The classes of every country and year are also computed up front, with the same
+# breaks for every year so the colors of different years can be compared.
+##################################################################
+
+YearStore = namedtuple('YearStore', ['years', 'population', 'density'])
+
+
+def build_year_store(country_codes, areas, population_file=POPULATION_FILE):
+    """
+    Builds the country x year matrices of population and population density.
+    Input: The World Bank code of each country (NaN if it has none), each country's area in
+    km^2 and the path to the population file.
+    Returns: A YearStore of the array of years and the float32 matrices of the population and
+    of the population density (per km^2). Missing values are NaN, and so are the densities of
+    countries without an area.
+    """
+
+    years, population = read_indicator(population_file, country_codes)
+    density = get_density(population, areas)
+
+    return YearStore(years, population.astype(np.float32), density.astype(np.float32))
+
+
+def read_indicator(indicator_file, country_codes):
+    """
+    Reads a World Bank indicator file (like the population file) as a country x year matrix.
+    Input: The path to the file and the World Bank code of each country (NaN if it has none).
+    Returns: A tuple of the array of the years which have data and the float64 matrix of the
+    values, NaN where they're missing.
+    """
+
+    df = pd.read_csv(indicator_file, header=2)
+    year_columns = [column for column in df.columns if column.isdigit() and df[column].notna().any()]
+
+    values = df.set_index('Country Code')[year_columns].reindex(country_codes)
+    return (np.array(year_columns, dtype=np.int64), values.to_numpy(dtype=np.float64))
+
+
+def classify_years(matrix, breaks):
+    """
+    Finds the class of every country for every year.
+    Input: A country x year matrix of values and the class breaks.
+    Returns: An int8 matrix of the classes, -1 for missing values.
+    """
+
+    return classify(matrix.ravel(), breaks).reshape(matrix.shape).astype(np.int8)
+
+
+def get_year_colors(classes, colors, nan_color, year_index):
+    """
+    Returns the array of every country's color for one year.
+    Input: The class matrix from classify_years(), the classes' colors, the color of missing
+    values and the index of the year in the YearStore.
+    """
+
+    return np.array(colors + [nan_color], dtype=object)[classes[:, year_index]]
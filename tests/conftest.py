@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules of src/ import each other by name and read the data sets from paths relative
+# to src/ (e.g. "../database"), like when world_map.py is served from there
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
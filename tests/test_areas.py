@@ -0,0 +1,37 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import areas
+from areas import get_areas_cached, get_density, get_per_capita
+from create_dataframe import get_areas
+
+
+def test_get_areas_cached(tmp_path, monkeypatch):
+    geometries = gpd.GeoSeries([shapely.box(0, 0, 1, 1), None, shapely.box(10, 40, 12, 41)],
+                               index=[3, 5, 7], crs='EPSG:4326')
+    cache_dir = str(tmp_path)
+
+    cached = get_areas_cached(geometries, cache_dir=cache_dir)
+    np.testing.assert_allclose(cached, get_areas(geometries))
+    assert cached.index.tolist() == [3, 5, 7]
+    assert cached[5] == 0
+
+    # read from the file next time, nothing is projected again
+    areas._areas.clear()
+    monkeypatch.setattr(areas, 'get_areas_parallel', None)
+    pd.testing.assert_series_equal(get_areas_cached(geometries, cache_dir=cache_dir), cached)
+
+
+def test_density_and_per_capita():
+    values = np.array([[10.0, 20.0], [30.0, 40.0], [1.0, 2.0]])
+
+    density = get_density(values, [2.0, 0.0, np.nan])
+    assert density[0].tolist() == [5.0, 10.0]
+    assert np.isnan(density[1:]).all()
+
+    per_capita = get_per_capita(values, np.array([[1.0, 0.0], [10.0, 10.0], [np.nan, 2.0]]))
+    assert per_capita[1].tolist() == [3.0, 4.0]
+    assert np.isnan(per_capita[0, 1]) and np.isnan(per_capita[2, 0])
+    assert get_per_capita(pd.Series([4.0, 6.0]), [2.0, 3.0]).tolist() == [2.0, 2.0]
@@ -0,0 +1,37 @@
+from build_dataset import Stage, get_needed_stages
+
+
+def read_source():
+    return [1, 2, 3]
+
+
+def double(values):
+    return [2 * value for value in values]
+
+
+def total(values):
+    return sum(values)
+
+
+def create_test_stages(cache_dir):
+    source = Stage('source0', read_source, cache_dir=cache_dir)
+    fix = Stage('fix_double', double, [source], cache_dir=cache_dir)
+    return Stage('population', total, [fix], cache_dir=cache_dir), fix, source
+
+
+def test_cached_final_stage_needs_no_inputs(tmp_path):
+    final, fix, source = create_test_stages(str(tmp_path))
+    assert ({stage.name for stage in get_needed_stages(final)}
+            == {'population', 'fix_double', 'source0'})
+    assert final.output() == 12
+
+    # a new build finds the final stage cached, so neither its inputs nor their inputs are loaded
+    final, fix, source = create_test_stages(str(tmp_path))
+    assert [stage.name for stage in get_needed_stages(final)] == ['population']
+    assert final.output() == 12
+    assert not fix._done and not source._done
+
+    # forced stages are rebuilt, with their inputs
+    final, fix, source = create_test_stages(str(tmp_path))
+    final.force = True
+    assert {stage.name for stage in get_needed_stages(final)} == {'population', 'fix_double'}
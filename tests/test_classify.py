@@ -0,0 +1,24 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from classify import classify, get_category_classes
+
+
+def test_classify_manual_breaks():
+    classes = classify(np.array([5, 10, 11, 30, np.nan]), np.array([10, 25]))
+    assert classes.tolist() == [0, 0, 1, 2, -1]
+
+
+def test_category_classes_group_the_rare_values():
+    df = pd.DataFrame({'government': ['a', 'a', 'b', 'b', 'c', None, 'd']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        classes, colors, labels = get_category_classes(df, 'government', ['r', 'g', 'b'],
+                                                       min_count=2)
+
+    assert labels == ['a', 'b', 'other']
+    assert colors == ['r', 'g', 'b']
+    # the values that aren't a label are 'other', the missing ones have no class
+    assert classes.tolist() == [0, 0, 1, 1, 2, -1, 2]
@@ -0,0 +1,58 @@
+import geopandas as gpd
+import shapely
+
+from create_dataframe import (add_population, apply_polygon_fixes, get_fix_geometries,
+                              get_fix_geometry, repair_chunk)
+
+
+def test_repair_chunk_keeps_the_polygons():
+    bowtie = shapely.Polygon([(0, 0), (2, 2), (2, 0), (0, 2), (0, 0)])
+    square = shapely.box(0, 0, 1, 1)
+    repaired = repair_chunk([bowtie, square, None])
+
+    assert repaired[0].geom_type == 'MultiPolygon' and repaired[0].is_valid
+    assert repaired[0].area == 2.0
+    assert repaired[1] is square
+    assert repaired[2] is None
+
+
+def test_repair_chunk_without_polygons():
+    # a zero-area ring and a ring collapsed to a line have no polygonal part once valid
+    flat = shapely.Polygon([(0, 0), (1, 1), (2, 2), (0, 0)])
+    line = shapely.Polygon([(0, 0), (1, 0), (0, 0), (1, 0)])
+    repaired = repair_chunk([flat, line])
+
+    for geometry in repaired:
+        assert geometry.geom_type == 'Polygon' and geometry.is_empty
+
+
+def test_polygon_fixes():
+    base = gpd.GeoDataFrame({'NAME_EN': ['A', 'B', 'C'], 'ISO_A3': ['AAA', 'BBB', 'CCC'],
+                             'geometry': [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1),
+                                          shapely.box(5, 5, 6, 6)]})
+    other = gpd.GeoDataFrame({'ISO3': ['CCC'], 'NAME': ['C'], 'geometry': [shapely.box(5, 5, 7, 7)]})
+    fixes = [{'country': 'A', 'union': 'B'}, {'country': 'C', 'replace_from': 2}]
+    geodatasets = [base, None, other]
+
+    geometries = get_fix_geometries(fixes, geodatasets, workers=1)
+    assert [geometry.area for geometry in geometries] == [2.0, 4.0]
+    assert all(geometry.equals(get_fix_geometry(fix, geodatasets))
+               for fix, geometry in zip(fixes, geometries))
+
+    fixed = apply_polygon_fixes(base, fixes, geometries)
+    assert fixed['NAME_EN'].tolist() == ['A', 'C']
+    assert fixed['geometry'].area.tolist() == [2.0, 4.0]
+
+
+def test_add_population_joins_on_the_names():
+    # set 0 has no ISO_A3 for France and Norway
+    countries = gpd.GeoDataFrame({'NAME_EN': ['France', 'Norway', 'Somaliland'],
+                                  'ISO_A3': ['-99', '-99', '-99'],
+                                  'geometry': [shapely.box(0, 0, 1, 1)] * 3})
+    df = add_population(countries, areas=[10**12] * 3)
+
+    assert df['NAME_EN'].tolist() == ['France', 'Norway', 'Somaliland']
+    assert df['Country Code'].tolist()[:2] == ['FRA', 'NOR']
+    assert df['2019'].iloc[0] > 6 * 10**7 and df['2019'].iloc[1] > 5 * 10**6
+    assert df['pop_density'].iloc[0] == df['2019'].iloc[0] / 10**6
+    assert df['2019'].isna().iloc[2]
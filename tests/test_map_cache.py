@@ -0,0 +1,69 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from create_dataframe import SHAPEFILE_COLUMNS, buffers_to_geometries
+from lod import LOD_TOLERANCES
+from map_cache import build_map_cache, find_map_cache, load_map_buffers, load_map_topologies
+from topology import topology_to_buffers
+
+
+def write_countries(path):
+    # a region without a polygon between two countries, like the World Bank's rows of a rebuilt
+    # final data set
+    gpd.GeoDataFrame({
+        'NAME_EN': ['A', None, 'B'], 'Country Code': ['AAA', 'WLD', 'BBB'],
+        'Country Name': ['A', 'World', 'B'], '2019': [10.0, 30.0, 20.0],
+        'pop_density': [1.0, 2.0, 3.0],
+        'geometry': [shapely.box(0, 0, 1, 1), None, shapely.box(2, 0, 4, 1)]},
+        crs='EPSG:4326').rename(columns=SHAPEFILE_COLUMNS).to_file(path)
+
+
+def test_countries_with_polygons_come_first(tmp_path):
+    shapefile = str(tmp_path / 'countries.shp')
+    write_countries(shapefile)
+    levels, missing, attributes = load_map_buffers(build_map_cache(shapefile, str(tmp_path / 'cache')))
+
+    assert np.asarray(missing).tolist() == [False, False, True]
+    assert attributes['NAME_EN'].tolist() == ['A', 'B', None]
+    geometries = buffers_to_geometries(levels[0])
+    assert [geometry.area for geometry in geometries[:2]] == [1.0, 2.0]
+
+
+def test_densities_are_per_km2(tmp_path):
+    shapefile = str(tmp_path / 'countries.shp')
+    write_countries(shapefile)
+    _, _, attributes = load_map_buffers(build_map_cache(shapefile, str(tmp_path / 'cache')))
+
+    # from the population and the area, whatever the data set's pop_density
+    np.testing.assert_allclose(attributes['pop_density'][:2],
+                               attributes['2019'][:2] / attributes['area'][:2])
+    assert 10000 < attributes['area'][0] < 15000  # a 1 degree square at the equator
+    assert np.isnan(attributes['pop_density'][2])
+
+
+def test_find_map_cache_reuses_the_cache(tmp_path):
+    shapefile = str(tmp_path / 'countries.shp')
+    write_countries(shapefile)
+    cache_dir = str(tmp_path / 'cache')
+
+    path = find_map_cache(shapefile, cache_dir)
+    assert find_map_cache(shapefile, cache_dir) == path
+
+    # a changed data set gets a new cache
+    gpd.read_file(shapefile).iloc[:2].to_file(shapefile)
+    assert find_map_cache(shapefile, cache_dir) != path
+
+
+def test_cached_levels_match_their_topology(tmp_path):
+    shapefile = str(tmp_path / 'countries.shp')
+    write_countries(shapefile)
+    path = build_map_cache(shapefile, str(tmp_path / 'cache'))
+    levels, _, _ = load_map_buffers(path)
+    topologies = load_map_topologies(path)
+
+    assert len(levels) == len(topologies) == len(LOD_TOLERANCES)
+    for buffers, topology in zip(levels, topologies):
+        rebuilt = topology_to_buffers(topology)
+        for field in buffers._fields:
+            np.testing.assert_array_equal(getattr(buffers, field), getattr(rebuilt, field))
@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from create_dataframe import (FINAL_FILE, add_patch_coords, get_geometry_coords, read_final_dataset,
+                              read_geodata)
+
+
+def read_data_set(name):
+    if name == 'final':
+        return read_final_dataset(FINAL_FILE + '.shp')
+    return read_geodata(name)
+
+
+# set 2's shapefile isn't in the repository
+@pytest.mark.parametrize('name', [0, 1, 'final'])
+def test_patch_coords_match_get_geometry_coords(name):
+    geodata = read_data_set(name)
+    expected = [get_geometry_coords(geometry) for geometry in geodata['geometry']]
+
+    geodata = add_patch_coords(geodata)
+
+    # the patches are serialized as JSON for Bokeh, so they must be identical once serialized
+    assert json.dumps(geodata['xs'].tolist()) == json.dumps([xs for xs, _ in expected])
+    assert json.dumps(geodata['ys'].tolist()) == json.dumps([ys for _, ys in expected])
@@ -0,0 +1,33 @@
+import numpy as np
+
+from point_layers import (POINT_CELL_PIXELS, POINT_CELL_SIZES, build_point_levels,
+                          choose_point_level, query_points)
+
+
+def test_choose_point_level_reaches_both_ends():
+    levels = build_point_levels([0.0, 10.0], [0.0, 10.0])
+    plot_width = 1000
+    # the visible width in degrees for which cells of a given size are POINT_CELL_PIXELS wide
+    span = lambda cell_size: cell_size * plot_width / POINT_CELL_PIXELS
+
+    # zoomed out, the biggest cells are used, even once they're smaller than wanted
+    biggest, smallest = max(POINT_CELL_SIZES), min(POINT_CELL_SIZES)
+    assert choose_point_level(levels, span(biggest), plot_width) == 0
+    assert choose_point_level(levels, span(biggest * 0.75), plot_width) == 0
+    assert choose_point_level(levels, span(biggest * 10), plot_width) == 0
+    assert choose_point_level(levels, span(biggest / 2), plot_width) == 1
+    # zoomed in past the smallest cells, the points themselves are drawn
+    assert levels[-1].cell_size == 0
+    assert choose_point_level(levels, span(smallest), plot_width) == len(levels) - 2
+    assert choose_point_level(levels, span(smallest / 2), plot_width) == len(levels) - 1
+    assert choose_point_level(levels, span(smallest / 100), plot_width) == len(levels) - 1
+
+
+def test_query_points_keeps_the_edges():
+    levels = build_point_levels([-10.0, 0.0, 10.0, 20.0], [5.0, -5.0, 5.0, 5.0])
+    points = levels[-1]
+
+    indices = query_points(points, -10, 10, -5, 5)
+    assert sorted(points.x[indices].tolist()) == [-10.0, 0.0, 10.0]
+    assert len(query_points(points, 10, 10, 5, 5)) == 1
+    assert len(query_points(points, 11, 19, -90, 90)) == 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import shapely
+
+from create_dataframe import buffers_to_patch_coords, get_patch_buffers
+from quantize import MAX_PRECISION, decode_topology_coords, encode_topology, quantize
+from topology import build_topology, topology_to_buffers
+
+
+def test_quantize():
+    assert quantize([1.23456, -0.00004, -0.00005], 4).tolist() == [12346, 0, 0]
+    with pytest.raises(ValueError):
+        quantize([0], MAX_PRECISION + 1)
+
+
+@pytest.mark.parametrize('precision', [2, 4])
+def test_decoded_coordinates_are_within_the_precision(precision):
+    rng = np.random.default_rng(0)
+    # irregular polygons sharing a border, with coordinates that aren't round
+    angles = np.sort(rng.uniform(0, 2 * np.pi, 50))
+    radius = rng.uniform(5, 10, 50)
+    blob = shapely.Polygon(np.column_stack((radius * np.cos(angles), radius * np.sin(angles))))
+    geometries = [blob.intersection(shapely.box(-20, -20, 0.123456, 20)),
+                  blob.intersection(shapely.box(0.123456, -20, 20, 20))]
+    topology = build_topology(get_patch_buffers(geometries))
+
+    arc_x, arc_y, arc_offsets, parts, arcs = encode_topology(topology, precision)
+    xs, ys = decode_topology_coords(arc_x, arc_y, np.diff(arc_offsets), parts, arcs, precision)
+    expected_xs, expected_ys = buffers_to_patch_coords(topology_to_buffers(topology))
+
+    for decoded, expected in ((xs, expected_xs), (ys, expected_ys)):
+        decoded = np.concatenate([ring for geometry in decoded for polygon in geometry
+                                  for ring in polygon])
+        expected = np.concatenate([ring for geometry in expected for polygon in geometry
+                                   for ring in polygon])
+        assert np.abs(decoded - expected).max() <= 0.5 * 10**-precision + 1e-12
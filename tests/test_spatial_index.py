@@ -0,0 +1,13 @@
+import shapely
+
+from spatial_index import build_spatial_index, countries_at
+
+
+def test_countries_at():
+    tree = build_spatial_index([shapely.box(0, 0, 1, 1), None, shapely.box(1, 0, 2, 1),
+                                shapely.Polygon()])
+
+    found = countries_at(tree, [0.5, 1.5, 1.0, 5.0, 0.5], [0.5, 0.5, 0.5, 5.0, 2.0])
+    # inside each box, on their shared border (the lowest index wins), and outside both
+    assert found.tolist() == [0, 2, 0, -1, -1]
+    assert countries_at(tree, 1.5, 0.5).tolist() == [2]
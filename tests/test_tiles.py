@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import shapely
+
+from create_dataframe import buffers_to_geometries, get_patch_buffers
+from tiles import (TILE_EXTENT, decode_tile, decode_varints, encode_tile, encode_varints,
+                   get_tile_bounds, get_tile_size, merge_tiles, unzigzag, zigzag)
+
+
+def test_varints():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**40, 2**62])
+    data = encode_varints(values)
+
+    assert encode_varints([0, 127, 128, 300]) == bytes([0, 127, 0x80, 1, 0xac, 2])
+    assert len(data) == 1 + 1 + 1 + 2 + 2 + 2 + 3 + 6 + 9
+    assert decode_varints(data).tolist() == values.tolist()
+    assert decode_varints(b'').tolist() == []
+
+
+def test_zigzag():
+    values = np.array([0, -1, 1, -2, 2, -(2**40), 2**40])
+    assert zigzag(values[:5]).tolist() == [0, 1, 2, 3, 4]
+    assert unzigzag(zigzag(values)).tolist() == values.tolist()
+
+
+def test_tile_round_trip():
+    zoom, x, y = 2, 3, 1
+    bounds = get_tile_bounds(zoom, x, y)
+    minx, miny, maxx, maxy = bounds
+    inside = shapely.Polygon([(minx + 1.1, miny + 2.2), (maxx - 3.3, miny + 0.7),
+                              (maxx, maxy), (minx + 1.1, miny + 2.2)])
+    geometries = [inside, None, shapely.MultiPolygon([shapely.box(minx, miny, minx + 1, miny + 1),
+                                                      shapely.box(minx + 2, miny, minx + 3, miny + 1)])]
+
+    ids, buffers = decode_tile(encode_tile(np.array([4, 7, 9]), get_patch_buffers(geometries),
+                                           bounds), bounds)
+
+    # features without polygons aren't written
+    assert ids.tolist() == [4, 9]
+    step = get_tile_size(zoom) / TILE_EXTENT
+    for decoded, original in zip(buffers_to_geometries(buffers), [inside, geometries[2]]):
+        assert shapely.get_num_geometries(decoded) == shapely.get_num_geometries(original)
+        assert shapely.hausdorff_distance(decoded, original) <= step
+
+    merged_ids, merged = merge_tiles([(ids, buffers), (ids[:0], get_patch_buffers([])), (ids, buffers)])
+    assert merged_ids.tolist() == [4, 9, 4, 9]
+    assert len(merged.geom_offsets) == 5
+
+
+def test_decode_tile_checks_the_format():
+    with pytest.raises(ValueError):
+        decode_tile(b'WMT1' + encode_varints([0]), get_tile_bounds(0, 0, 0))
@@ -0,0 +1,46 @@
+import numpy as np
+import shapely
+
+from create_dataframe import buffers_to_geometries, get_patch_buffers
+from topology import build_topology, renumber_arcs, select_arcs, topology_to_buffers
+
+# two squares sharing an edge, and a square with a hole next to them
+GEOMETRIES = [shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1),
+              shapely.Polygon(shapely.box(3, 0, 6, 3).exterior.coords,
+                              [shapely.box(4, 1, 5, 2).exterior.coords])]
+
+
+def test_topology_round_trip():
+    buffers = get_patch_buffers(GEOMETRIES)
+    rebuilt = buffers_to_geometries(topology_to_buffers(build_topology(buffers)))
+
+    assert len(rebuilt) == len(GEOMETRIES)
+    for geometry, original in zip(rebuilt, GEOMETRIES):
+        assert geometry.equals(original)
+        assert shapely.get_num_coordinates(geometry) == shapely.get_num_coordinates(original)
+    np.testing.assert_array_equal(topology_to_buffers(build_topology(buffers)).ring_offsets,
+                                  buffers.ring_offsets)
+
+
+def test_shared_borders_are_kept_once():
+    topology = build_topology(get_patch_buffers(GEOMETRIES[:2]))
+
+    refs = np.asarray(topology.ring_arcs)
+    arc_ids = np.where(refs < 0, ~refs, refs)
+    # the edge x = 1 is used by both squares, once in each direction
+    shared = [arc for arc in np.unique(arc_ids) if np.count_nonzero(arc_ids == arc) == 2]
+    assert len(shared) == 1
+    assert sorted(refs[arc_ids == shared[0]] < 0) == [False, True]
+    start, end = topology.arc_offsets[shared[0]], topology.arc_offsets[shared[0] + 1]
+    assert set(np.asarray(topology.arc_x)[start:end].tolist()) == {1.0}
+
+
+def test_renumber_arcs():
+    used, refs = renumber_arcs([np.array([5, ~2]), np.array([], dtype=np.int64), np.array([2])])
+
+    assert used.tolist() == [2, 5]
+    assert [r.tolist() for r in refs] == [[1, ~0], [], [0]]
+
+    indices, lengths = select_arcs(np.array([0, 2, 5, 6]), np.array([2, 0]))
+    assert indices.tolist() == [5, 0, 1]
+    assert lengths.tolist() == [1, 2]
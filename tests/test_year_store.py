@@ -0,0 +1,16 @@
+import numpy as np
+
+from shared_data import load_countries
+
+# territories the World Bank population file has no row for (Antarctica, Jersey, Taiwan...)
+MAX_UNMATCHED_COUNTRIES = 30
+
+
+def test_year_store_matches_the_countries():
+    countries, _, _, year_store, _ = load_countries()
+    unmatched = np.isnan(year_store.population).all(axis=1)
+
+    assert unmatched.sum() <= MAX_UNMATCHED_COUNTRIES, list(countries['NAME_EN'][unmatched])
+    for name in ['United States of America', "People's Republic of China", 'United Kingdom', 'France', 'Australia']:
+        row = np.flatnonzero(countries['NAME_EN'].to_numpy() == name)[0]
+        assert not np.isnan(year_store.population[row]).all(), name